@@ -1,9 +1,8 @@
 import os
-import json
 from pathlib import Path
 import plotly.express as px
 
-from viktor import ViktorController
+from viktor import ViktorController, UserError
 from viktor.core import Storage, File
 from viktor.geometry import GeoPoint
 
@@ -12,14 +11,20 @@ from viktor.parametrization import ViktorParametrization, Page, GeoPointField, O
     IntegerField, ActionButton, LineBreak, FileField, DownloadButton
 from viktor.result import DownloadResult
 from viktor.views import MapView, MapResult, MapPoint, GeometryView, GeometryResult, WebView, WebResult, \
-    PlotlyAndDataResult, PlotlyAndDataView, PlotlyView, PlotlyResult, DataView, DataResult
+    PlotlyAndDataResult, PlotlyAndDataView, PlotlyView, PlotlyResult, DataView, DataResult, DataGroup, DataItem
 from viktor.external.generic import GenericAnalysis
 
-from optimization.run_optimization import run_optimization
+from optimization.run_optimization import run_optimization, get_checkpoint_dataframe, update_response_model, predict_design
+from optimization.response_model import MIN_ROWS, MODEL_KINDS
+from optimization.sampling import SAMPLING_STRATEGIES
+from optimization.pareto import PARETO_DISPLAY_OPTIONS, get_pareto_front
 from shapediver.ShapeDiverComputation import ShapeDiverComputation
 from structural import evol_algo, calculate_embodied_carbon
 from structural.analysis import base_analysis
-from carbon_and_cost.calculate_carbon_and_cost import calculate_carbon_and_cost
+from carbon_and_cost.calculate_carbon_and_cost import calculate_carbon_and_cost_from_aggregates, load_geometry_aggregates
+
+OPTIMIZATION_DIMENSIONS = ['Base Radius', 'Peak Radius', 'No Floors', 'Floor to Floor', 'Cost', 'Embodied Carbon']
+CORE_DIMENSION = 'Core Embodied Carbon'
 
 
 def param_site_class_visible(params, **kwargs):
@@ -29,6 +34,45 @@ def param_site_class_visible(params, **kwargs):
         return False
 
 
+def get_optimization_dimensions(params):
+    return OPTIMIZATION_DIMENSIONS + [CORE_DIMENSION] if params.global_optimization.size_core else OPTIMIZATION_DIMENSIONS
+
+
+def get_parallel_coordinates(df, pareto_display=None, pareto_epsilon=0):
+    dimensions = [column for column in df.columns if column in OPTIMIZATION_DIMENSIONS + [CORE_DIMENSION]]
+    if pareto_display in (None, 'All designs') or len(df) == 0:
+        return px.parallel_coordinates(df, color="Embodied Carbon",
+                                       dimensions=dimensions,
+                                       color_continuous_scale=px.colors.diverging.Tealrose,
+                                       color_continuous_midpoint=2)
+    front = get_pareto_front(df, epsilon=pareto_epsilon)
+    if pareto_display == 'Pareto front only':
+        return px.parallel_coordinates(df[front], color="Embodied Carbon",
+                                       dimensions=dimensions,
+                                       color_continuous_scale=px.colors.diverging.Tealrose)
+    df = df.assign(**{'Pareto Front': front.astype(int)})
+    return px.parallel_coordinates(df, color='Pareto Front',
+                                   dimensions=dimensions + ['Pareto Front'],
+                                   color_continuous_scale=[(0, 'lightgray'), (1, 'crimson')],
+                                   range_color=(0, 1))
+
+
+def param_core_sizing_workers_visible(params, **kwargs):
+    return bool(params.global_optimization.size_core)
+
+
+def param_pareto_epsilon_visible(params, **kwargs):
+    return params.global_optimization.pareto_display not in (None, 'All designs')
+
+
+def param_evaluation_budget_visible(params, **kwargs):
+    return params.global_optimization.sampling_strategy not in (None, 'Full factorial')
+
+
+def param_refinement_tolerance_visible(params, **kwargs):
+    return params.global_optimization.sampling_strategy == 'Progressive refinement'
+
+
 class Parametrization(ViktorParametrization):
     location = Page('Location', views='get_map_view')
     location.center = GeoPointField('Building location', default=GeoPoint(40.7182, -74.0162))
@@ -64,6 +108,7 @@ class Parametrization(ViktorParametrization):
     structural.r_value = NumberField('R Value', flex=20)
     structural.line_break4 = LineBreak()
     structural.file_wind = FileField('Wind load input', file_types=['.png', '.jpg', '.jpeg','.txt','.json'], max_size=5_000_000)
+    structural.exposure = OptionField('Exposure Category', options=['B', 'C', 'D'], default='B', flex=30)
 
     optimization = Page('Profile Optimization', views='profile_optimization')
     optimization.story_forces = IntegerField('Story Forces', min=0, default=100)
@@ -87,7 +132,7 @@ class Parametrization(ViktorParametrization):
     carbon_and_cost.carbon_per_beam_length = NumberField('Carbon per Beam Length', suffix='CO2/m', flex=50)
     carbon_and_cost.cost_per_beam_length = NumberField('Cost per Beam Length', suffix='$/m', flex=50)
 
-    global_optimization = Page('Global Optimization', views='get_optimization')
+    global_optimization = Page('Global Optimization', views=['get_optimization', 'get_optimization_progress'])
     global_optimization.min_base_radius = NumberField('Min Base Radius', default=60)
     global_optimization.max_base_radius = NumberField('Max Base Radius', default=200)
     global_optimization.step_base_radius = NumberField('Step Base Radius', default=10)
@@ -100,8 +145,27 @@ class Parametrization(ViktorParametrization):
     global_optimization.min_floor_to_floor = NumberField('Min Floor to Floor', default=8)
     global_optimization.max_floor_to_floor = NumberField('Max Floor to Floor', default=15)
     global_optimization.step_floor_to_floor = NumberField('Step Floor to Floor', default=1)
+    global_optimization.use_local_geometry = BooleanField('Use local geometry engine')
+    global_optimization.reuse_results = BooleanField('Reuse Stored Results', default=True)
+    global_optimization.sampling_strategy = OptionField('Sampling Strategy', options=SAMPLING_STRATEGIES, default='Full factorial', flex=50)
+    global_optimization.evaluation_budget = IntegerField('Evaluation Budget', min=1, default=200, visible=param_evaluation_budget_visible, flex=50)
+    global_optimization.refinement_tolerance = NumberField('Refinement Tolerance', min=0, max=1, default=0.02, num_decimals=3, visible=param_refinement_tolerance_visible, flex=50)
     global_optimization.run_async = BooleanField('Run Asynchronously')
     global_optimization.number_of_workers = NumberField('Number of parallel workers', default=4)
+    global_optimization.sample_timeout = NumberField('Timeout per Sample', suffix='s', default=300)
+    global_optimization.size_core = BooleanField('Size Core per Sample', flex=50)
+    global_optimization.core_sizing_workers = IntegerField('Core Sizing Processes', min=1, visible=param_core_sizing_workers_visible, flex=50)
+    global_optimization.pareto_display = OptionField('Show Designs', options=PARETO_DISPLAY_OPTIONS, default='All designs', flex=50)
+    global_optimization.pareto_epsilon = NumberField('Pareto Thinning', min=0, max=1, default=0, num_decimals=3, visible=param_pareto_epsilon_visible, flex=50)
+    global_optimization.response_model_kind = OptionField('Response Model', options=MODEL_KINDS, default='Gaussian process', flex=50)
+    global_optimization.fit_response_model = ActionButton('Fit Response Model', method='fit_response_model', flex=50)
+
+    design_predictor = Page('Design Predictor', views='get_design_prediction')
+    design_predictor.base_radius = NumberField('Base Radius', default=83, min=60, max=200, num_decimals=0, step=1.0, variant='slider')
+    design_predictor.peak_radius = NumberField('Peak Radius', default=60, min=60, max=100, num_decimals=0, step=1.0, variant='slider')
+    design_predictor.no_floors = NumberField('No Floors', default=18, min=10, max=50, num_decimals=0, step=1, variant='slider')
+    design_predictor.floor_to_floor = NumberField('Floor to Floor', default=12, min=8, max=15, num_decimals=0, step=1.0, variant='slider')
+    design_predictor.verify = BooleanField('Compute in Background')
 
 
 class Controller(ViktorController):
@@ -180,20 +244,57 @@ class Controller(ViktorController):
 
     @PlotlyView("Result", duration_guess=10, update_label='RUN OPTIMIZATION')
     def get_optimization(self, params, **kwargs):
-        dimensions = ['Base Radius', 'Peak Radius', 'No Floors', 'Floor to Floor', 'Cost', 'Embodied Carbon']
-        df = run_optimization(params, dimensions)
-        fig = px.parallel_coordinates(df, color="Embodied Carbon",
-                                      dimensions=dimensions,
-                                      color_continuous_scale=px.colors.diverging.Tealrose,
-                                      color_continuous_midpoint=2)
+        df = run_optimization(params, get_optimization_dimensions(params))
+        o = params.global_optimization
+        fig = get_parallel_coordinates(df, o.pareto_display, o.pareto_epsilon)
         return PlotlyResult(fig.to_json())
 
+    @PlotlyView("Partial Result", duration_guess=1)
+    def get_optimization_progress(self, params, **kwargs):
+        df, n, at_most = get_checkpoint_dataframe(get_optimization_dimensions(params))
+        if df is None:
+            raise UserError('No optimization has been run yet')
+        o = params.global_optimization
+        fig = get_parallel_coordinates(df, o.pareto_display, o.pareto_epsilon)
+        fig.update_layout(title=f"{len(df)} of {'at most ' if at_most else ''}{n} samples completed")
+        return PlotlyResult(fig.to_json())
+
+    def fit_response_model(self, params, **kwargs):
+        # fitted on request instead of on every sweep view, the fit takes seconds on large sweeps
+        df, n, at_most = get_checkpoint_dataframe(get_optimization_dimensions(params))
+        if df is None:
+            raise UserError('No optimization has been run yet')
+        if update_response_model(params, df) is None:
+            raise UserError(f'A response model needs at least {MIN_ROWS} designs, the last sweep has {len(df)}')
+
+    @DataView("Predicted", duration_guess=1)
+    def get_design_prediction(self, params, **kwargs):
+        p = params.design_predictor
+        point = {'base_radius': p.base_radius, 'peak_radius': p.peak_radius, 'no_floors': p.no_floors, 'floor_to_floor': p.floor_to_floor}
+        model, prediction, computed = predict_design(params, point, p.verify)
+
+        items = []
+        for (target, suffix, prefix) in [('Embodied Carbon', 'tonnes C02', ''), ('Cost', 'K', '$')]:
+            subgroup = []
+            if target + ' Std' in prediction:
+                subgroup.append(DataItem('Standard Deviation', prediction[target + ' Std'], number_of_decimals=0, prefix=prefix, suffix=suffix))
+            subgroup.append(DataItem('Cross Validated Error', model.cv_error[target]['MAPE'], number_of_decimals=1, suffix='%'))
+            items.append(DataItem(f'Predicted {target}', prediction[target], number_of_decimals=0, prefix=prefix, suffix=suffix,
+                                  subgroup=DataGroup(*subgroup)))
+        if p.verify:
+            if computed is None:
+                items.append(DataItem('Computed', 'running, update the view to see the result'))
+            else:
+                cost, carbon = computed
+                items.append(DataItem('Computed Embodied Carbon', carbon, number_of_decimals=0, suffix='tonnes C02'))
+                items.append(DataItem('Computed Cost', cost, number_of_decimals=0, prefix='$', suffix='K'))
+        items.append(DataItem('Response Model', f'{model.kind}, fitted on {model.n} designs'))
+        return DataResult(DataGroup(*items))
+
     @PlotlyAndDataView("Result", duration_guess=1)
     def get_carbon_and_cost(self, params, **kwargs):
-        building_structure = json.loads(Storage().get('BUILDING_STRUCTURE', scope='entity').getvalue())
-        building_floor_elv_area = json.loads(Storage().get('BUILDING_FLOOR_ELV_AREA', scope='entity').getvalue())
-
-        fig, data, total_cost, total_carbon = calculate_carbon_and_cost(params, building_structure, building_floor_elv_area)
+        # the geometry is aggregated once when it is stored, unit rate changes only rescale the totals
+        fig, data, total_cost, total_carbon = calculate_carbon_and_cost_from_aggregates(params, load_geometry_aggregates())
         return PlotlyAndDataResult(fig.to_json(), data)
 
     def run_etabs(self, params, **kwargs):
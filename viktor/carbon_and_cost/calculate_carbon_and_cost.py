@@ -1,27 +1,30 @@
-import math
+import hashlib
+import json
 
+import numpy as np
 import plotly.graph_objects as go
 import plotly.subplots as sp
 
+from viktor import File
+from viktor.core import Storage
 from viktor.views import DataGroup, DataItem
 
+from tower_geometry.generate_tower_geometry import get_member_lengths
+
+GEOMETRY_AGGREGATES_KEY = 'BUILDING_GEOMETRY_AGGREGATES'
+AGGREGATES_VERSION = 1 # increase when get_geometry_aggregates changes, stored aggregates are then recomputed
+RATE_NAMES = ['carbon_per_floor_area', 'carbon_per_beam_length', 'cost_per_floor_area', 'cost_per_beam_length']
+
 
 def calculate_carbon_and_cost(params, building_structure, building_floor_elv_area):
-    nodes = building_structure['nodes']
-    beams = building_structure['beams']
-    beam_length = []
-    for beam in beams:
-        x1, y1, z1 = nodes[beam[0]*3], nodes[beam[0]*3 + 1], nodes[beam[0]*3 + 2]
-        x2, y2, z2 = nodes[beam[1]*3], nodes[beam[1]*3 + 1], nodes[beam[1]*3 + 2]
-        beam_length.append(math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2 + (z2 - z1) ** 2))
-
-    total_beam_length = sum(beam_length)
-    embodied_carbon_beams = total_beam_length * params.carbon_and_cost.carbon_per_beam_length / 1000 # Convert to tonnes
-    cost_beams = total_beam_length * params.carbon_and_cost.cost_per_beam_length / 1000
-
-    total_floor_area = sum([floor['area'] for floor in building_floor_elv_area])
-    embodied_carbon_floors = total_floor_area * params.carbon_and_cost.carbon_per_floor_area / 1000 # Convert to tonnes
-    cost_floors = total_floor_area * params.carbon_and_cost.cost_per_floor_area / 1000
+    return calculate_carbon_and_cost_from_aggregates(params, get_geometry_aggregates(building_structure, building_floor_elv_area))
+
+
+def calculate_carbon_and_cost_from_aggregates(params, aggregates):
+    total_beam_length = aggregates['total_beam_length']
+    total_floor_area = aggregates['total_floor_area']
+    embodied_carbon_floors, embodied_carbon_beams, cost_floors, cost_beams = calculate_carbon_and_cost_parts(
+        params, total_beam_length, total_floor_area)
 
     total_carbon = embodied_carbon_floors + embodied_carbon_beams
     total_cost = cost_floors + cost_beams
@@ -45,3 +48,114 @@ def calculate_carbon_and_cost(params, building_structure, building_floor_elv_are
     fig.add_trace(go.Pie(labels=['Floors', 'Beams'], values=[cost_floors, cost_beams]), row=2, col=1)
 
     return fig, data, total_cost, total_carbon
+
+
+def calculate_carbon_and_cost_parts(params, total_beam_length, total_floor_area):
+    parts = score_designs(total_beam_length, total_floor_area, get_unit_rates(params))
+    return tuple(float(part) for part in parts)
+
+
+def get_geometry_aggregates(building_structure, building_floor_elv_area):
+    """
+    Totals of a geometry that carbon and cost are calculated from
+
+    Parameters:
+    - building_structure (dict): BUILDING_STRUCTURE, {"nodes": [x, y, z, ...], "beams": [[i, j], ...], ...}
+    - building_floor_elv_area (list): BUILDING_FLOOR_ELV_AREA, [{"elevation": z, "area": area}, ...]
+
+    Returns:
+    - dict: total_beam_length, total_column_length, total_floor_area and floor_areas ([[elevation, area], ...], the
+      elevation is None if the export has none)
+    """
+    total_beam_length = get_member_lengths(building_structure['nodes'], building_structure['beams']).sum()
+    total_column_length = get_member_lengths(building_structure['nodes'], building_structure.get('columns', [])).sum()
+    # only the area is required, exports without elevations still get a cost
+    floor_areas = [[floor.get('elevation'), float(floor['area'])] for floor in building_floor_elv_area]
+    total_floor_area = np.sum([area for (elevation, area) in floor_areas])
+    return {
+        'total_beam_length': float(total_beam_length),
+        'total_column_length': float(total_column_length),
+        'total_floor_area': float(total_floor_area),
+        'floor_areas': floor_areas,
+    }
+
+
+def get_geometry_version(building_structure_data, building_floor_elv_area_data):
+    """
+    Identity of stored aggregates: a hash of AGGREGATES_VERSION and the BUILDING_STRUCTURE and
+    BUILDING_FLOOR_ELV_AREA exports (bytes) they were computed from
+    """
+    digest = hashlib.sha256(str(AGGREGATES_VERSION).encode('utf-8'))
+    for data in (building_structure_data, building_floor_elv_area_data):
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
+
+def store_geometry_aggregates(building_structure_data, building_floor_elv_area_data):
+    """
+    Compute the aggregates of a geometry and store them in the entity Storage next to its exports, so that the
+    Carbon & Cost page does not parse the exports again when only unit rates change
+
+    Parameters:
+    - building_structure_data, building_floor_elv_area_data (bytes): the BUILDING_STRUCTURE and
+      BUILDING_FLOOR_ELV_AREA exports as stored
+
+    Returns:
+    - dict: the aggregates, see get_geometry_aggregates, with the version of the geometry
+    """
+    aggregates = get_geometry_aggregates(json.loads(building_structure_data), json.loads(building_floor_elv_area_data))
+    aggregates['version'] = get_geometry_version(building_structure_data, building_floor_elv_area_data)
+    Storage().set(GEOMETRY_AGGREGATES_KEY, data=File.from_data(json.dumps(aggregates)), scope='entity')
+    return aggregates
+
+
+def load_geometry_aggregates():
+    """
+    Aggregates of the stored geometry of the entity
+
+    The cached aggregates are only used if their version matches the stored exports, otherwise (not cached, cached
+    for other exports or by an older AGGREGATES_VERSION) they are computed from the exports again. Hashing the
+    exports is much cheaper than parsing them.
+    """
+    building_structure_data = Storage().get('BUILDING_STRUCTURE', scope='entity').getvalue_binary()
+    building_floor_elv_area_data = Storage().get('BUILDING_FLOOR_ELV_AREA', scope='entity').getvalue_binary()
+    try:
+        aggregates = json.loads(Storage().get(GEOMETRY_AGGREGATES_KEY, scope='entity').getvalue())
+    except (FileNotFoundError, json.JSONDecodeError):
+        aggregates = None
+    if aggregates is None or aggregates.get('version') != get_geometry_version(building_structure_data, building_floor_elv_area_data):
+        return store_geometry_aggregates(building_structure_data, building_floor_elv_area_data)
+    return aggregates
+
+
+def get_unit_rates(params):
+    """
+    Unit rates of the Carbon & Cost page, {name: rate} for the names in RATE_NAMES
+    """
+    return {name: getattr(params.carbon_and_cost, name) for name in RATE_NAMES}
+
+
+def score_designs(total_beam_length, total_floor_area, rates):
+    """
+    Carbon and cost of many designs or unit rate scenarios at once
+
+    All inputs broadcast against each other: pass arrays of designs with scalar rates, scalar totals with arrays of
+    rates, or e.g. total_beam_length[:, None] with rates of shape (s,) to score every design under every scenario.
+
+    Parameters:
+    - total_beam_length (float or numpy.ndarray): total beam length in m
+    - total_floor_area (float or numpy.ndarray): total floor area in m2
+    - rates (dict): {name: rate} for the names in RATE_NAMES, see get_unit_rates
+
+    Returns:
+    - tuple: embodied_carbon_floors, embodied_carbon_beams (tonnes CO2), cost_floors, cost_beams ($K) as arrays
+    """
+    total_beam_length = np.asarray(total_beam_length, dtype=float)
+    total_floor_area = np.asarray(total_floor_area, dtype=float)
+    embodied_carbon_beams = total_beam_length * np.asarray(rates['carbon_per_beam_length']) / 1000 # Convert to tonnes
+    cost_beams = total_beam_length * np.asarray(rates['cost_per_beam_length']) / 1000
+
+    embodied_carbon_floors = total_floor_area * np.asarray(rates['carbon_per_floor_area']) / 1000 # Convert to tonnes
+    cost_floors = total_floor_area * np.asarray(rates['cost_per_floor_area']) / 1000
+
+    return embodied_carbon_floors, embodied_carbon_beams, cost_floors, cost_beams
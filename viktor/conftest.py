@@ -0,0 +1 @@
+# makes the top-level packages of the app (optimization, structural, ...) importable in tests
@@ -0,0 +1,123 @@
+"""
+Checkpoints of running Global Optimization sweeps
+
+Completed rows are written in batches while a sweep runs, so that a sweep that is interrupted (worker restart or
+timeout) resumes from its checkpoint instead of starting over, and so that the finished part of a sweep can be
+plotted while it is still running. Checkpoints are kept in the entity Storage, or in a local directory when
+OPTIMIZATION_CHECKPOINT_DIR is set.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from viktor import File
+from viktor.core import Storage
+
+CHECKPOINT_KEY = 'OPTIMIZATION_CHECKPOINT'
+DESIGN_COLUMNS = ['Base Radius', 'Peak Radius', 'No Floors', 'Floor to Floor']
+CHECKPOINT_BATCH_SIZE = 25 # completed samples between checkpoints
+CHECKPOINT_MIN_INTERVAL = 2 # seconds, limits the number of Storage writes when samples complete quickly
+CHECKPOINT_INTERVAL = 10 # seconds, a checkpoint is also written when this has passed since the last one
+
+
+def get_run_key(context, strategy, budget, space, tolerance=None):
+    """
+    Identity of a sweep: equal for runs that evaluate the same points with the same inputs
+    """
+    run = {
+        'context': context,
+        'strategy': strategy,
+        'budget': budget,
+        'grid': {name: values.tolist() for (name, values) in zip(space.names, space.values)},
+    }
+    if tolerance is not None:
+        run['tolerance'] = tolerance
+    body = json.dumps(run, sort_keys=True)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def read_checkpoint():
+    """
+    Read the checkpoint of the last sweep of the entity, or None if there is none
+    """
+    directory = os.getenv('OPTIMIZATION_CHECKPOINT_DIR')
+    try:
+        if directory:
+            with open(os.path.join(directory, CHECKPOINT_KEY + '.json')) as checkpoint_file:
+                return json.load(checkpoint_file)
+        return json.loads(Storage().get(CHECKPOINT_KEY, scope='entity').getvalue())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_checkpoint(checkpoint):
+    data = json.dumps(checkpoint)
+    directory = os.getenv('OPTIMIZATION_CHECKPOINT_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        # write to a temporary file first, so readers never see a partial checkpoint
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as checkpoint_file:
+            checkpoint_file.write(data)
+        os.replace(temp_path, os.path.join(directory, CHECKPOINT_KEY + '.json'))
+    else:
+        Storage().set(CHECKPOINT_KEY, data=File.from_data(data), scope='entity')
+
+
+class OptimizationCheckpoint:
+    """
+    Rows of a running sweep, written every CHECKPOINT_BATCH_SIZE rows (but at most every CHECKPOINT_MIN_INTERVAL
+    seconds) or every CHECKPOINT_INTERVAL seconds
+
+    Rows of a resumed checkpoint are carried over until their samples are reported again, so that a checkpoint
+    never holds fewer rows than the one it continues.
+    """
+
+    def __init__(self, run_key, n, carried=(), at_most=False):
+        """
+        :param n: number of samples of the sweep, or its upper bound if at_most
+        """
+        self.run_key = run_key
+        self.n = n
+        self.at_most = at_most
+        self.rows = []
+        self.carried = {get_row_key(row): row for row in carried}
+        self.failed = 0
+        self.finished = False
+        self._pending = 0
+        self._written = time.monotonic()
+
+    @classmethod
+    def resume(cls, run_key, n, at_most=False):
+        """
+        Continue the checkpoint of the same sweep if it did not finish, otherwise start a new one
+        """
+        checkpoint = read_checkpoint()
+        if checkpoint is not None and checkpoint.get('run_key') == run_key and not checkpoint.get('finished'):
+            return cls(run_key, n, checkpoint.get('rows', []), at_most)
+        return cls(run_key, n, at_most=at_most)
+
+    def add(self, row, failed=False):
+        if failed:
+            self.failed += 1
+        else:
+            self.rows.append(row)
+            self.carried.pop(get_row_key(row), None)
+        self._pending += 1
+        elapsed = time.monotonic() - self._written
+        if elapsed >= CHECKPOINT_INTERVAL or (self._pending >= CHECKPOINT_BATCH_SIZE and elapsed >= CHECKPOINT_MIN_INTERVAL):
+            self.write()
+
+    def write(self, finished=False):
+        self.finished = finished
+        rows = self.rows if finished else self.rows + list(self.carried.values())
+        write_checkpoint({'run_key': self.run_key, 'n': self.n, 'at_most': self.at_most and not finished, 'rows': rows,
+                          'failed': self.failed, 'finished': finished, 'time': time.time()})
+        self._pending = 0
+        self._written = time.monotonic()
+
+
+def get_row_key(row):
+    return tuple(row[column] for column in DESIGN_COLUMNS)
@@ -0,0 +1,134 @@
+"""
+Streaming execution engine for optimization samples
+
+Samples are drawn from an ask/tell sampler (see optimization.sampling) and evaluated concurrently on one event
+loop, with at most max_in_flight evaluations running at a time. Every task gets its own read-only snapshot of its
+inputs, results are yielded as soon as they complete and fed back to the sampler, and an exception or a timeout only
+fails its own sample.
+"""
+import asyncio
+import inspect
+import threading
+import time
+from types import MappingProxyType
+
+
+class SampleResult:
+    """
+    Outcome of one evaluated sample: the result of the evaluator, or the error that made it fail
+    """
+
+    def __init__(self, i, point, result=None, error=None, elapsed=0.0):
+        self.i = i
+        self.point = point
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+async def iter_results(sampler, make_task, evaluate, *, max_in_flight=4, timeout=None):
+    """
+    Evaluate the points of a sampler and yield a SampleResult per point, in order of completion
+
+    Coroutine evaluators run on the event loop, other evaluators on a thread per sample. The timeout of a sample
+    starts when its thread starts running. A thread that exceeds the timeout cannot be interrupted: its sample is
+    reported as failed and the thread is abandoned, it finishes in the background without taking the place of a new
+    sample.
+
+    :param sampler: ask/tell sampler, failed samples are told as None
+    :param make_task: make_task(point, i) returns the keyword arguments of evaluate for the i-th point (1-based)
+    :param evaluate: evaluate(**task) returns the result of a sample
+    :param max_in_flight: maximum number of concurrent evaluations
+    :param timeout: seconds after which a sample fails, None for no limit
+    """
+    in_flight = set()
+    submitted = 0
+    try:
+        while True:
+            for point in sampler.ask(max_in_flight - len(in_flight)) if len(in_flight) < max_in_flight else []:
+                submitted += 1
+                point = MappingProxyType(dict(point))
+                task = MappingProxyType(make_task(point, submitted))
+                in_flight.add(asyncio.ensure_future(evaluate_sample(evaluate, submitted, point, task, timeout)))
+            if len(in_flight) == 0:
+                break
+
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in sorted(done, key=lambda future: future.result().i):
+                sample = future.result()
+                sampler.tell([sample.point], [sample.result if sample.ok else None])
+                yield sample
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+async def evaluate_sample(evaluate, i, point, task, timeout):
+    start = time.perf_counter()
+    try:
+        if inspect.iscoroutinefunction(evaluate):
+            result = await asyncio.wait_for(evaluate(**task), timeout)
+        else:
+            start, call = await start_thread(evaluate, task)
+            result = await asyncio.wait_for(call, timeout)
+    except asyncio.TimeoutError:
+        return SampleResult(i, point, error=TimeoutError(f'Sample timed out after {timeout} s'), elapsed=time.perf_counter() - start)
+    except Exception as e:
+        return SampleResult(i, point, error=e, elapsed=time.perf_counter() - start)
+    return SampleResult(i, point, result=result, elapsed=time.perf_counter() - start)
+
+
+async def start_thread(evaluate, task):
+    """
+    Run evaluate(**task) on a new daemon thread
+
+    :return: the time the thread started running and a future of the result of evaluate
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.create_future()
+    finished = loop.create_future()
+
+    def set_result(future, result=None, error=None):
+        # the future of an abandoned thread has been cancelled by its timeout
+        if not future.done():
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def notify(future, result=None, error=None):
+        try:
+            loop.call_soon_threadsafe(set_result, future, result, error)
+        except RuntimeError:
+            pass # the event loop has been closed while an abandoned thread was running
+
+    def run():
+        notify(started, time.perf_counter())
+        try:
+            result = evaluate(**task)
+        except BaseException as e:
+            # KeyboardInterrupt and SystemExit end the run as they would on the event loop
+            notify(finished, error=e)
+        else:
+            notify(finished, result)
+
+    threading.Thread(target=run, name='optimization-sample', daemon=True).start()
+    return await started, finished
+
+
+async def run_samples(sampler, make_task, evaluate, on_result, *, max_in_flight=4, timeout=None):
+    """
+    Evaluate the points of a sampler and pass every SampleResult to on_result as soon as it completes
+
+    :return: number of failed samples
+    """
+    failed = 0
+    async for sample in iter_results(sampler, make_task, evaluate, max_in_flight=max_in_flight, timeout=timeout):
+        if not sample.ok:
+            failed += 1
+        on_result(sample)
+    return failed
@@ -0,0 +1,119 @@
+"""
+Pareto front extraction for Global Optimization results
+
+All objectives are minimized. Two objectives (Cost and Embodied Carbon) use an O(n log n) sweep, more objectives
+a blocked pass in lexicographic order that compares every point with the non-dominated points before it only. Equal
+points do not dominate each other, so duplicates of a front point are all on the front.
+"""
+import numpy as np
+
+PARETO_BLOCK_SIZE = 256 # rows compared with the front at once by get_pareto_mask_nd
+OBJECTIVES = ['Cost', 'Embodied Carbon', 'Core Embodied Carbon']
+PARETO_DISPLAY_OPTIONS = ['All designs', 'Highlight Pareto front', 'Pareto front only']
+
+
+def get_pareto_mask(values):
+    """
+    Boolean mask of the non-dominated rows
+
+    :param values: (n, k) array of objectives to minimize
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim != 2:
+        raise ValueError('values must be a 2-D array of shape (n, k)')
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    if values.shape[1] == 1:
+        return values[:, 0] == values[:, 0].min()
+    # duplicates share the outcome of their unique row
+    unique, inverse = np.unique(values, axis=0, return_inverse=True)
+    if values.shape[1] == 2:
+        mask = get_pareto_mask_2d(unique)
+    else:
+        mask = get_pareto_mask_nd(unique)
+    return mask[inverse.reshape(-1)]
+
+
+def get_pareto_mask_2d(unique):
+    """
+    Sweep over unique rows in lexicographic order (as returned by np.unique): a row is non-dominated if its second
+    objective is lower than that of every row before it
+    """
+    previous_best = np.minimum.accumulate(np.r_[np.inf, unique[:-1, 1]])
+    return unique[:, 1] < previous_best
+
+
+def get_pareto_mask_nd(unique, block_size=PARETO_BLOCK_SIZE):
+    """
+    Blocked pass over unique rows in lexicographic order (as returned by np.unique): no row can be dominated by a row
+    after it, so a row is non-dominated if no non-dominated row before it and no row before it in its block dominates
+    it. Rows are distinct, so a row dominates another if it is not worse in any objective.
+    """
+    mask = np.zeros(len(unique), dtype=bool)
+    front = unique[:0]
+    for start in range(0, len(unique), block_size):
+        index = np.arange(start, min(start + block_size, len(unique)))
+        # rows dominated by the front so far
+        index = index[~get_dominates(front, unique[index]).any(axis=0)]
+        # rows dominated by a row before them in the block, never by themselves or later rows
+        index = index[~np.triu(get_dominates(unique[index], unique[index]), 1).any(axis=0)]
+        mask[index] = True
+        front = np.concatenate([front, unique[index]])
+    return mask
+
+
+def get_dominates(a, b):
+    """
+    dominates[i, j]: row i of a is not worse than row j of b in any objective
+    """
+    dominates = np.ones((len(a), len(b)), dtype=bool)
+    for k in range(a.shape[1]):
+        dominates &= a[:, k, None] <= b[None, :, k]
+    return dominates
+
+
+def get_epsilon_pareto_mask(values, epsilon):
+    """
+    Boolean mask of an epsilon-box thinned Pareto front
+
+    The objective space is divided in boxes of epsilon times the range of the front in every objective. Every box
+    that holds front points keeps one of them, the point closest to the lower corner of the box, and the best point
+    of every objective is always kept, so that the front keeps its extent. Boxes are not pruned by dominance of their
+    floored indices: boxes that share a coordinate would remove each other, and a box is only worse than another in
+    every objective when its points are dominated, which front points are not.
+
+    :param values: (n, k) array of objectives to minimize
+    :param epsilon: box size as a fraction of the objective ranges, 0 for the full front
+    """
+    values = np.asarray(values, dtype=float)
+    mask = get_pareto_mask(values)
+    if not epsilon or epsilon <= 0 or not mask.any():
+        return mask
+
+    front = np.flatnonzero(mask)
+    minimum = values[front].min(axis=0)
+    size = epsilon * np.maximum(np.ptp(values[front], axis=0), 1e-12)
+    scaled = (values[front] - minimum) / size
+    boxes = np.floor(scaled)
+    # one point per box: the closest to the lower corner
+    distance = np.linalg.norm(scaled - boxes, axis=1)
+    order = np.lexsort((distance,) + tuple(boxes.T[::-1]))
+    first = np.r_[True, np.any(np.diff(boxes[order], axis=0) != 0, axis=1)]
+    chosen = np.union1d(order[first], np.argmin(values[front], axis=0))
+
+    thinned = np.zeros(len(values), dtype=bool)
+    thinned[front[chosen]] = True
+    return thinned
+
+
+def get_pareto_front(df, objectives=None, epsilon=0):
+    """
+    Mask of the Pareto optimal designs of an optimization result
+
+    :param df: pandas.DataFrame with a column per objective
+    :param objectives: columns to minimize, by default the columns of OBJECTIVES that df has
+    :param epsilon: epsilon-dominance thinning, see get_epsilon_pareto_mask
+    """
+    if objectives is None:
+        objectives = [column for column in OBJECTIVES if column in df.columns]
+    return get_epsilon_pareto_mask(df[objectives].to_numpy(dtype=float), epsilon)
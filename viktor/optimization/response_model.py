@@ -0,0 +1,181 @@
+"""
+Response model of Global Optimization results
+
+A scikit-learn regression model fitted on the rows of a sweep, (base radius, peak radius, no floors, floor to
+floor) -> (Cost, Embodied Carbon), that predicts new designs in milliseconds instead of a ShapeDiver computation.
+The error of the model is estimated with k-fold cross validation, Gaussian process folds reuse the kernel
+hyperparameters of the full fit. The last fitted model is kept in the entity Storage, or in a local directory when
+OPTIMIZATION_MODEL_DIR is set.
+"""
+import hashlib
+import os
+import pickle
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.base import clone
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, RBF, WhiteKernel
+from sklearn.model_selection import KFold, cross_val_predict
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from viktor import File
+from viktor.core import Storage
+
+RESPONSE_MODEL_KEY = 'OPTIMIZATION_RESPONSE_MODEL'
+MODEL_KINDS = ['Gaussian process', 'Gradient boosting']
+FEATURES = ['Base Radius', 'Peak Radius', 'No Floors', 'Floor to Floor']
+TARGETS = ['Cost', 'Embodied Carbon']
+MIN_ROWS = 20 # fewer rows than this are not enough for a response model
+MAX_GAUSSIAN_PROCESS_ROWS = 500 # a Gaussian process fit scales with the cube of the rows, larger sweeps are subsampled
+CV_FOLDS = 5
+
+
+def make_estimator(kind):
+    """
+    Unfitted regressor of one target for a kind in MODEL_KINDS
+    """
+    if kind in (None, 'Gaussian process'):
+        # a large length scale bound lets the fit switch off design variables that do not change the target
+        kernel = ConstantKernel(1.0) * RBF(length_scale=np.ones(len(FEATURES)), length_scale_bounds=(1e-2, 1e5)) \
+            + WhiteKernel(1e-5, noise_level_bounds=(1e-10, 1e-1))
+        return make_pipeline(StandardScaler(), GaussianProcessRegressor(kernel, normalize_y=True, n_restarts_optimizer=0, random_state=0))
+    if kind == 'Gradient boosting':
+        return make_pipeline(StandardScaler(), HistGradientBoostingRegressor(max_iter=300, random_state=0))
+    raise ValueError(f'Unknown response model: {kind}')
+
+
+class ResponseModel:
+    """
+    One fitted regressor per target, with the cross validated error and the inputs it was fitted on
+    """
+
+    def __init__(self, kind, estimators, cv_error, n, bounds, context=None, data_hash=None):
+        self.kind = kind
+        self.estimators = estimators
+        self.cv_error = cv_error
+        self.n = n
+        self.bounds = bounds
+        self.context = context
+        self.data_hash = data_hash
+        self.sklearn_version = sklearn.__version__
+        self.created = time.time()
+
+    def predict(self, designs):
+        """
+        Predict the Cost and Embodied Carbon of designs
+
+        :param designs: pandas.DataFrame with the FEATURES columns, or a list of dicts with those keys
+        :return: pandas.DataFrame with a column per target, and for Gaussian processes a '<target> Std' column with
+            the standard deviation of the prediction
+        """
+        X = pd.DataFrame(designs, columns=FEATURES).to_numpy(dtype=float)
+        predicted = {}
+        for (target, estimator) in zip(TARGETS, self.estimators):
+            if self.kind == 'Gaussian process':
+                predicted[target], predicted[target + ' Std'] = estimator.predict(X, return_std=True)
+            else:
+                predicted[target] = estimator.predict(X)
+        return pd.DataFrame(predicted)
+
+    def is_extrapolating(self, design):
+        """
+        True if a design (dict with the FEATURES keys) lies outside the range of the rows the model was fitted on
+        """
+        return any(not (low <= design[feature] <= high) for (feature, (low, high)) in zip(FEATURES, self.bounds))
+
+
+def fit_response_model(df, kind='Gaussian process', context=None):
+    """
+    Fit a response model on the rows of a sweep and estimate its error with cross validation
+
+    :param df: pandas.DataFrame with the FEATURES and TARGETS columns, as returned by run_optimization
+    :param kind: a kind in MODEL_KINDS
+    :param context: identity of the inputs of the sweep (see optimization.result_store.get_context)
+    """
+    df = get_training_rows(df)
+    data_hash = get_data_hash(df)
+    if len(df) < MIN_ROWS:
+        raise ValueError(f'A response model needs at least {MIN_ROWS} designs, the sweep has {len(df)}')
+    if kind in (None, 'Gaussian process') and len(df) > MAX_GAUSSIAN_PROCESS_ROWS:
+        df = df.sample(MAX_GAUSSIAN_PROCESS_ROWS, random_state=0)
+    X = df[FEATURES].to_numpy(dtype=float)
+
+    estimators = []
+    cv_error = {}
+    folds = KFold(n_splits=min(CV_FOLDS, len(df)), shuffle=True, random_state=0)
+    for target in TARGETS:
+        y = df[target].to_numpy(dtype=float)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', ConvergenceWarning)
+            estimator = make_estimator(kind).fit(X, y)
+            validation = clone(estimator)
+            if kind in (None, 'Gaussian process'):
+                # the folds keep the kernel of the full fit instead of optimizing their own
+                validation.set_params(gaussianprocessregressor__kernel=estimator[-1].kernel_,
+                                      gaussianprocessregressor__optimizer=None)
+            cv_error[target] = get_error(y, cross_val_predict(validation, X, y, cv=folds))
+        estimators.append(estimator)
+    bounds = [(float(X[:, k].min()), float(X[:, k].max())) for k in range(len(FEATURES))]
+    return ResponseModel(kind or 'Gaussian process', estimators, cv_error, len(df), bounds, context, data_hash)
+
+
+def get_training_rows(df):
+    return df.dropna(subset=FEATURES + TARGETS).drop_duplicates(subset=FEATURES)
+
+
+def get_data_hash(df):
+    """
+    Hash of the FEATURES and TARGETS of the rows of a sweep, independent of the row order
+    """
+    rows = get_training_rows(df)[FEATURES + TARGETS].sort_values(FEATURES)
+    return hashlib.sha256(np.ascontiguousarray(rows.to_numpy(dtype=float)).tobytes()).hexdigest()
+
+
+def get_error(y, predicted):
+    """
+    Mean absolute error, mean absolute percentage error and coefficient of determination of predictions
+    """
+    residual = predicted - y
+    total = np.sum((y - y.mean()) ** 2)
+    return {
+        'MAE': float(np.mean(np.abs(residual))),
+        'MAPE': float(np.mean(np.abs(residual) / np.maximum(np.abs(y), 1e-12)) * 100),
+        'R2': float(1 - np.sum(residual ** 2) / total) if total > 0 else 1.0,
+    }
+
+
+def save_response_model(model):
+    data = pickle.dumps(model)
+    directory = os.getenv('OPTIMIZATION_MODEL_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, RESPONSE_MODEL_KEY + '.pickle'), 'wb') as model_file:
+            model_file.write(data)
+    else:
+        Storage().set(RESPONSE_MODEL_KEY, data=File.from_data(data), scope='entity')
+
+
+def load_response_model():
+    """
+    Load the last fitted response model of the entity, or None if there is none or it was pickled by another
+    scikit-learn version
+    """
+    directory = os.getenv('OPTIMIZATION_MODEL_DIR')
+    try:
+        if directory:
+            with open(os.path.join(directory, RESPONSE_MODEL_KEY + '.pickle'), 'rb') as model_file:
+                model = pickle.load(model_file)
+        else:
+            model = pickle.loads(Storage().get(RESPONSE_MODEL_KEY, scope='entity').getvalue_binary())
+    except (FileNotFoundError, pickle.UnpicklingError):
+        return None
+    if getattr(model, 'sklearn_version', None) != sklearn.__version__:
+        return None
+    return model
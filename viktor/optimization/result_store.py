@@ -0,0 +1,134 @@
+"""
+Persistent store of evaluated Global Optimization design points
+
+Results are keyed by the four design variables and a context hash of everything else that determines cost and
+carbon: the evaluation engine (ShapeDiver model or local geometry engine), the remaining ShapeDiver parameters and the
+carbon and cost rates. Runs that overlap an earlier sweep only evaluate the points that are not stored yet.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from shapediver.ShapeDiverResultCache import normalizeParameters
+
+DESIGN_VARIABLES = ['base_radius', 'peak_radius', 'no_floors', 'floor_to_floor']
+RATE_FIELDS = ['carbon_per_floor_area', 'cost_per_floor_area', 'carbon_per_beam_length', 'cost_per_beam_length']
+# ShapeDiver parameter ids of the design variables
+DESIGN_PARAMETER_IDS = {
+    'base_radius': 'ff31e6cb-2c58-4d73-b6b1-10e63ba346bb',
+    'peak_radius': '5b127d95-8792-4225-ad73-6d958e9fa6ce',
+    'no_floors': 'f86e2cec-4b10-44ca-b42c-e7615be7e784',
+    'floor_to_floor': '1125c8f7-8ba9-4b4c-8d17-4a5f2afcea01',
+}
+KEY_DECIMALS = 6 # design variables are rounded, so that equal grid values from differently built grids match
+
+
+def get_context(engine, shapediver_parameters, carbon_and_cost):
+    """
+    Hash of the inputs other than the design variables that determine the result of a design point
+
+    :param engine: dict identifying the evaluation engine, e.g. {"engine": "shapediver", "ticket": ...}
+    :param shapediver_parameters: ShapeDiver parameters of the sweep, the design variables are ignored
+    :param carbon_and_cost: carbon and cost rates (params.carbon_and_cost)
+    """
+    design_parameter_ids = set(DESIGN_PARAMETER_IDS.values())
+    parameters = {key: value for (key, value) in dict(shapediver_parameters).items() if key not in design_parameter_ids}
+    body = json.dumps({
+        'engine': engine,
+        'parameters': normalizeParameters(parameters),
+        'rates': {field: carbon_and_cost[field] for field in RATE_FIELDS},
+    }, sort_keys=True)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def get_key(point):
+    return tuple(round(float(point[name]), KEY_DECIMALS) for name in DESIGN_VARIABLES)
+
+
+class DesignResultStore:
+    """
+    SQLite table of (context, base radius, peak radius, no floors, floor to floor) -> (cost, carbon, core carbon)
+
+    Core carbon is NULL for results of sweeps without core sizing.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.getenv("OPTIMIZATION_RESULT_STORE") or os.path.join(os.path.expanduser("~"), ".cache", "aectech2023", "design_results.sqlite")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS design_result ("
+            "context TEXT, base_radius REAL, peak_radius REAL, no_floors REAL, floor_to_floor REAL, "
+            "cost REAL, carbon REAL, created REAL, core_carbon REAL, "
+            "PRIMARY KEY (context, base_radius, peak_radius, no_floors, floor_to_floor))"
+        )
+        # stores created before core sizing have no core carbon column
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(design_result)")]
+        if 'core_carbon' not in columns:
+            self._connection.execute("ALTER TABLE design_result ADD COLUMN core_carbon REAL")
+        self._connection.commit()
+
+    def get(self, context, point):
+        """
+        Get the stored (cost, carbon) or (cost, carbon, core carbon) of a design point, or None if it has not been
+        evaluated yet
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT cost, carbon, core_carbon FROM design_result WHERE context=? AND base_radius=? AND peak_radius=? AND no_floors=? AND floor_to_floor=?",
+                (context,) + get_key(point)).fetchone()
+        if row is None:
+            return None
+        return tuple(row[:2]) if row[2] is None else tuple(row)
+
+    def set_many(self, context, results):
+        """
+        Store evaluated design points
+
+        :param results: iterable of (point, (cost, carbon)) or (point, (cost, carbon, core carbon))
+        """
+        now = time.time()
+        rows = [(context,) + get_key(point) + (float(result[0]), float(result[1]), now,
+                                                None if len(result) < 3 else float(result[2])) for (point, result) in results]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO design_result (context, base_radius, peak_radius, no_floors, floor_to_floor, cost, carbon, created, core_carbon) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._connection.commit()
+
+    def count(self, context):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM design_result WHERE context=?", (context,)).fetchone()[0]
+
+    def clear(self, context=None):
+        with self._lock:
+            if context is None:
+                self._connection.execute("DELETE FROM design_result")
+            else:
+                self._connection.execute("DELETE FROM design_result WHERE context=?", (context,))
+            self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_default_store():
+    """
+    Get the shared design result store, created on first use
+    """
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = DesignResultStore()
+        return _default_store
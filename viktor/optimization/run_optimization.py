@@ -1,86 +1,392 @@
 import pandas as pd
+from viktor import UserError, UserMessage
 from viktor.core import Storage, progress_message
 
-from carbon_and_cost.calculate_carbon_and_cost import calculate_carbon_and_cost
-from shapediver.ShapeDiverComputation import ShapeDiverComputation, ShapeDiverComputationForOptimization
+from carbon_and_cost.calculate_carbon_and_cost import calculate_carbon_and_cost_parts, get_geometry_aggregates
+from shapediver.ShapeDiverComputation import ShapeDiverComputation, ShapeDiverComputationForOptimization, \
+    ShapeDiverComputationForOptimizationAsync, ticket, modelViewUrl
+from shapediver.ShapeDiverTinyAsyncSdk import ShapeDiverAsyncHttpTransport, ShapeDiverAsyncSessionPool
+from shapediver.ShapeDiverTinySdkViktorUtils import asyncParameterMapper
+from tower_geometry.generate_tower_geometry import get_tower_summary, DEFAULT_GRID_SPACING, GEOMETRY_VERSION
+from optimization.sampling import DesignSpace, get_sampler, DIMENSIONS
+from optimization.execution_engine import run_samples
+from optimization.result_store import DESIGN_PARAMETER_IDS, get_context, get_default_store, get_key
+from optimization.checkpoint import OptimizationCheckpoint, get_run_key, read_checkpoint
+from optimization.response_model import fit_response_model, get_data_hash, load_response_model, save_response_model, MIN_ROWS
+from structural.core_sizing import CoreSizingPool, get_design_spectrum, get_core_carbon, get_seed, \
+    CORE_POPULATION_SIZE, CORE_GENERATIONS
 
-from typing import List, Tuple
+from types import MappingProxyType
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import functools
+import inspect
+import threading
 
+GRID_SPACING_ID = '6488bc66-2a0a-4c32-bfaa-e5e26a79ab49'
+STORE_BATCH_SIZE = 50 # completed samples written to the result store at once
+RESULT_COLUMNS = ['Cost', 'Embodied Carbon', 'Core Embodied Carbon']
 
-async def batch_run(models_input: List[dict], max_workers) -> Tuple[dict]:
+
+async def run_samples_shapediver_async(sampler, make_task, on_result, max_workers, timeout, wrap_evaluate, max_in_flight=None):
     """
-    :param models_input: [{"name": <name>, "x": <x>, "y": <y>}, ...]
+    Evaluate samples on one event loop, sharing one connection pool and at most max_workers ShapeDiver sessions
+
+    :param max_in_flight: samples evaluated at once, max_workers by default
     """
-    loop = asyncio.get_running_loop()
-    # define the maximum number of operations possible per batch
-    with ThreadPoolExecutor(max_workers=max_workers) as pool:
-        # The method `blocking_method` runs in parallel within this asynchronous method.
-        results = await asyncio.gather(*[loop.run_in_executor(pool, recalculate_cost_and_carbon, *run.values()) for run in models_input])
-    return results
+    transport = ShapeDiverAsyncHttpTransport()
+    session_pool = ShapeDiverAsyncSessionPool(ticket=ticket, modelViewUrl=modelViewUrl, transport=transport, maxSize=max_workers,
+                                              parameterMapper=asyncParameterMapper)
+    try:
+        evaluate = wrap_evaluate(functools.partial(recalculate_cost_and_carbon_async, session_pool))
+        return await run_samples(sampler, make_task, evaluate, on_result, max_in_flight=max_in_flight or max_workers, timeout=timeout)
+    finally:
+        await session_pool.close()
+        await transport.close()
+
 
+def get_shapediver_parameters(params, base_radius, peak_radius, no_floors, floor_to_floor):
+    parameters = dict(params['ShapeDiverParams'])
+    parameters[DESIGN_PARAMETER_IDS['base_radius']] = base_radius
+    parameters[DESIGN_PARAMETER_IDS['peak_radius']] = peak_radius
+    parameters[DESIGN_PARAMETER_IDS['no_floors']] = no_floors
+    parameters[DESIGN_PARAMETER_IDS['floor_to_floor']] = floor_to_floor
+    return parameters
 
-def recalculate_cost_and_carbon(params, base_radius, peak_radius, no_floors, floor_to_floor, i, n):
-    params['ShapeDiverParams']['ff31e6cb-2c58-4d73-b6b1-10e63ba346bb'] = base_radius
-    params['ShapeDiverParams']['5b127d95-8792-4225-ad73-6d958e9fa6ce'] = peak_radius
-    params['ShapeDiverParams']['f86e2cec-4b10-44ca-b42c-e7615be7e784'] = no_floors
-    params['ShapeDiverParams']['1125c8f7-8ba9-4b4c-8d17-4a5f2afcea01'] = floor_to_floor
+
+def get_cost_and_carbon(params, building_structure, building_floor_elv_area):
+    """
+    Total cost and carbon of a ShapeDiver geometry, without the figure and data of the Carbon and Cost view
+    """
+    aggregates = get_geometry_aggregates(building_structure, building_floor_elv_area)
+    embodied_carbon_floors, embodied_carbon_beams, cost_floors, cost_beams = calculate_carbon_and_cost_parts(
+        params, aggregates['total_beam_length'], aggregates['total_floor_area'])
+    return cost_floors + cost_beams, embodied_carbon_floors + embodied_carbon_beams
+
+
+def recalculate_cost_and_carbon(params, base_radius, peak_radius, no_floors, floor_to_floor, i, n, parameters=None, with_floors=False):
+    if parameters is None:
+        parameters = get_shapediver_parameters(params, base_radius, peak_radius, no_floors, floor_to_floor)
 
     # Run ShapeDiver based on the updated parameters
-    building_structure, building_floor_elv_area = ShapeDiverComputationForOptimization(params.ShapeDiverParams)
-    fig, data, cost, carbon = calculate_carbon_and_cost(params, building_structure, building_floor_elv_area)
+    building_structure, building_floor_elv_area = ShapeDiverComputationForOptimization(dict(parameters))
+    cost, carbon = get_cost_and_carbon(params, building_structure, building_floor_elv_area)
+    if with_floors:
+        return cost, carbon, building_floor_elv_area
+    return cost, carbon
+
+
+async def recalculate_cost_and_carbon_async(session_pool, params, base_radius, peak_radius, no_floors, floor_to_floor, i, n, parameters=None, with_floors=False):
+    if parameters is None:
+        parameters = get_shapediver_parameters(params, base_radius, peak_radius, no_floors, floor_to_floor)
+
+    # Run ShapeDiver based on the updated parameters
+    building_structure, building_floor_elv_area = await ShapeDiverComputationForOptimizationAsync(dict(parameters), session_pool)
+    cost, carbon = get_cost_and_carbon(params, building_structure, building_floor_elv_area)
+    if with_floors:
+        return cost, carbon, building_floor_elv_area
+    return cost, carbon
+
+
+def recalculate_cost_and_carbon_local(params, base_radius, peak_radius, no_floors, floor_to_floor, i, n, parameters=None, with_floors=False):
+    """
+    Evaluate a design with the local geometry engine instead of ShapeDiver, see tower_geometry.generate_tower_geometry
+    """
+    if parameters is None:
+        parameters = get_shapediver_parameters(params, base_radius, peak_radius, no_floors, floor_to_floor)
+    grid_spacing = parameters.get(GRID_SPACING_ID) or DEFAULT_GRID_SPACING
+    summary = get_tower_summary(base_radius, peak_radius, no_floors, floor_to_floor, grid_spacing)
+    embodied_carbon_floors, embodied_carbon_beams, cost_floors, cost_beams = calculate_carbon_and_cost_parts(
+        params, summary['total_beam_length'], summary['total_floor_area'])
+    if with_floors:
+        floors = [{'elevation': float(elevation), 'area': float(area)} for (elevation, area) in zip(summary['elevations'], summary['areas'])]
+        return cost_floors + cost_beams, embodied_carbon_floors + embodied_carbon_beams, floors
+    return cost_floors + cost_beams, embodied_carbon_floors + embodied_carbon_beams
+
+
+def with_core_sizing(evaluate, core_pool):
+    """
+    Wrap an evaluator so that it also sizes the core of the design on a CoreSizingPool, see structural.core_sizing
+
+    The wrapped evaluator is a coroutine that returns (cost, carbon, core carbon). Synchronous evaluators run in a
+    thread, the sizing in a worker process, so neither blocks the event loop.
+    """
+    async def evaluate_with_core(**task):
+        if inspect.iscoroutinefunction(evaluate):
+            cost, carbon, floors = await evaluate(**task, with_floors=True)
+        else:
+            cost, carbon, floors = await asyncio.to_thread(functools.partial(evaluate, **task, with_floors=True))
+        best_result = await core_pool.size(floors, seed=get_seed({name: task[name] for name in DIMENSIONS}))
+        return cost, carbon, get_core_carbon(best_result)
+    return evaluate_with_core
+
+
+def with_stored_results(evaluate, store, context, known={}):
+    """
+    Wrap an evaluator so that design points found in known (results by get_key) or in the result store are not
+    evaluated again
+    """
+    def get_stored(task):
+        result = known.get(get_key(task))
+        return result if result is not None else store.get(context, task)
+
+    if inspect.iscoroutinefunction(evaluate):
+        async def evaluate_stored(**task):
+            result = get_stored(task)
+            return result if result is not None else await evaluate(**task)
+    else:
+        def evaluate_stored(**task):
+            result = get_stored(task)
+            return result if result is not None else evaluate(**task)
+    return evaluate_stored
+
+
+def get_optimization_context(params, size_core=None):
+    """
+    Result store context of the evaluation engine, ShapeDiver parameters and rates of the entity
+
+    :param size_core: include the core sizing inputs, by default when core sizing is enabled
+    """
+    if params.global_optimization.use_local_geometry:
+        engine = {'engine': 'local', 'version': GEOMETRY_VERSION}
+    else:
+        engine = {'engine': 'shapediver', 'ticket': ticket, 'modelViewUrl': modelViewUrl}
+    if params.global_optimization.size_core if size_core is None else size_core:
+        # core carbon depends on the site, the loads and the limits of the walls
+        s, w, center = params.structural, params.optimization, params.location.center
+        engine['core'] = {
+            'site': [center.lat, center.lon, s.code, s.risk_cat, s.site_class],
+            'loads': [s.tdl, s.tll, s.r_value],
+            'walls': get_wall_limits(params),
+            'search': [CORE_POPULATION_SIZE, CORE_GENERATIONS],
+        }
+    return get_context(engine, params['ShapeDiverParams'], params.carbon_and_cost)
+
+
+def get_wall_limits(params):
+    w = params.optimization
+    return [w.minimum_wall_thickness, w.maximum_wall_thickness, w.minimum_wall_length, w.maximum_wall_length]
+
+
+def get_result(row):
+    """
+    Result tuple of a result row: (cost, carbon), or (cost, carbon, core carbon) for sweeps with core sizing
+    """
+    return tuple(row[column] for column in RESULT_COLUMNS if column in row)
 
-    message = f"Iteration {i}/{n}. \n " \
+
+def get_point(row):
+    """
+    Design point of a result row
+    """
+    return {'base_radius': row['Base Radius'], 'peak_radius': row['Peak Radius'],
+            'no_floors': row['No Floors'], 'floor_to_floor': row['Floor to Floor']}
+
+
+def get_checkpoint_dataframe(dimensions):
+    """
+    Rows of the last sweep of the entity that have completed so far, with the number of samples of the sweep and
+    whether that number is an upper bound of a running sweep, or (None, 0, False) if no sweep ran yet
+    """
+    checkpoint = read_checkpoint()
+    if checkpoint is None:
+        return None, 0, False
+    return pd.DataFrame(checkpoint['rows'], columns=dimensions), checkpoint['n'], checkpoint.get('at_most', False)
+
+
+def report_progress(base_radius, peak_radius, no_floors, floor_to_floor, cost, carbon, i, n, at_most=False):
+    message = f"Iteration {i}/{'at most ' if at_most else ''}{n}. \n " \
               f"Input parameters: \n " \
               f"Base radius: {base_radius}, Peak radius: {peak_radius}, No Floors: {no_floors} Floor to Floor: {floor_to_floor} \n " \
               f"Output parameters: \n " \
               f"Carbon footprint: {round(carbon)} tonnes CO2 \n Costs: $ {round(cost)}K "
 
     progress_message(message=message, percentage=(i / n) * 100)
-    return cost, carbon
 
 
 def run_optimization(params, dimensions):
-    df = pd.DataFrame(columns=dimensions)
     o = params.global_optimization
-    list_cost = []
-    list_embodied_carbon = []
-
-    options = []
-    i = 0
-    for base_radius in range(o.min_base_radius, o.max_base_radius+1, o.step_base_radius):
-        for peak_radius in range(o.min_peak_radius, o.max_peak_radius+1, o.step_peak_radius):
-            for no_floors in range(o.min_no_floors, o.max_no_floors+1, o.step_no_floors):
-                for floor_to_floor in range(o.min_floor_to_floor, o.max_floor_to_floor+1, o.step_floor_to_floor):
-                    i += 1
-                    options.append({'params': params,
-                                    'base_radius': base_radius,
-                                    'peak_radius': peak_radius,
-                                    'no_floors': no_floors,
-                                    'floor_to_floor': floor_to_floor,
-                                    'i': i})
-
-    n = len(options)
-    for option in options:
-        option['n'] = n
-    i = 0
-
-    if params.global_optimization.run_async:
-        test_results = asyncio.run(batch_run(options, params.global_optimization.number_of_workers))
-        for test_result in test_results:
-            list_cost.append(test_result[0])
-            list_embodied_carbon.append(test_result[1])
+    space = DesignSpace.from_params(o)
+    # a full factorial sweep covers the whole grid, the other strategies stop at the budget
+    budget = None if o.sampling_strategy in (None, 'Full factorial') else o.evaluation_budget
+    tolerance = o.refinement_tolerance if o.sampling_strategy == 'Progressive refinement' else None
+    sampler = get_sampler(o.sampling_strategy, space, budget, tolerance=tolerance)
+    max_workers = max(1, int(o.number_of_workers or 1))
+    timeout = o.sample_timeout or None
+    # strategies that stop early do not reach the budget, the checkpoint gets the actual count when they finish
+    n = sampler.budget
+
+    store = get_default_store()
+    context = get_optimization_context(params)
+
+    # continue an interrupted run of the same sweep, its rows are reported again as their samples complete
+    checkpoint = OptimizationCheckpoint(get_run_key(context, o.sampling_strategy, budget, space, tolerance), n,
+                                        at_most=sampler.stops_early)
+    if o.reuse_results:
+        checkpoint = OptimizationCheckpoint.resume(checkpoint.run_key, n, at_most=sampler.stops_early)
+    resumed = {get_key(get_point(row)): get_result(row) for row in checkpoint.carried.values()}
+
+    # the USGS spectrum is fetched once, every sample sizes its core in a worker process
+    core_pool = None
+    if o.size_core:
+        s = params.structural
+        if not (s.code and s.tdl and s.tll and s.r_value):
+            raise UserError('Core sizing needs the code, Total DL, Total LL and R Value of the Structural Basic page')
+        try:
+            spectrum = get_design_spectrum(params.location.center.lat, params.location.center.lon, s.code, s.risk_cat, s.site_class)
+        except Exception as e:
+            raise UserError(f'The USGS design spectrum could not be fetched: {e}')
+        core_pool = CoreSizingPool(get_wall_limits(params), spectrum, (s.tdl, s.tll, s.r_value), o.core_sizing_workers)
+    core_workers = core_pool.max_workers if core_pool is not None else 0
+
+    # results are always stored, stored results are only used when reuse is enabled
+    def wrap_evaluate(evaluate):
+        if core_pool is not None:
+            evaluate = with_core_sizing(evaluate, core_pool)
+        return with_stored_results(evaluate, store, context, resumed) if o.reuse_results else evaluate
+    completed_results = []
+
+    def make_task(point, i):
+        # every task gets its own read-only copy of the ShapeDiver parameters
+        parameters = MappingProxyType(get_shapediver_parameters(params, **point))
+        return dict(point, params=params, parameters=parameters, i=i, n=n)
+
+    rows = checkpoint.rows
+    errors = []
+    def on_result(sample):
+        if sample.ok:
+            cost, carbon = sample.result[:2]
+            completed_results.append((sample.point, sample.result))
+            if len(completed_results) >= STORE_BATCH_SIZE:
+                store.set_many(context, completed_results)
+                completed_results.clear()
+            row = {
+                'Base Radius': sample.point['base_radius'],
+                'Peak Radius': sample.point['peak_radius'],
+                'No Floors': sample.point['no_floors'],
+                'Floor to Floor': sample.point['floor_to_floor'],
+                'Cost': cost,
+                'Embodied Carbon': carbon,
+            }
+            if len(sample.result) > 2:
+                row['Core Embodied Carbon'] = sample.result[2]
+            checkpoint.add(row)
+        else:
+            errors.append(sample.error)
+            checkpoint.add(None, failed=True)
+        completed = len(rows) + len(errors)
+        # only report about every percent, local evaluations complete thousands per second
+        if sample.ok and (completed % max(1, n // 100) == 0 or completed == n):
+            report_progress(sample.point['base_radius'], sample.point['peak_radius'], sample.point['no_floors'],
+                            sample.point['floor_to_floor'], cost, carbon, completed, n, sampler.stops_early)
+
+    # with core sizing, samples that wait for ShapeDiver and samples that are being sized are in flight together
+    try:
+        if o.use_local_geometry:
+            asyncio.run(run_samples(sampler, make_task, wrap_evaluate(recalculate_cost_and_carbon_local), on_result,
+                                    max_in_flight=max(1, core_workers), timeout=timeout))
+        elif o.run_async:
+            asyncio.run(run_samples_shapediver_async(sampler, make_task, on_result, max_workers, timeout, wrap_evaluate,
+                                                     max_in_flight=max_workers + core_workers))
+        else:
+            # without Run Asynchronously samples are evaluated one after the other, as they always have been
+            asyncio.run(run_samples(sampler, make_task, wrap_evaluate(recalculate_cost_and_carbon), on_result,
+                                    max_in_flight=1, timeout=timeout))
+    except BaseException:
+        checkpoint.write()
+        raise
+    finally:
+        store.set_many(context, completed_results)
+        if core_pool is not None:
+            core_pool.close()
+    checkpoint.n = len(rows) + len(errors)
+    checkpoint.write(finished=True)
+
+    if len(errors) > 0:
+        if len(rows) == 0:
+            raise UserError(f'All {len(errors)} samples failed, first error: {errors[0]}')
+        UserMessage.warning(f'{len(errors)} of {len(errors) + len(rows)} samples failed, first error: {errors[0]}')
+
+    return pd.DataFrame(rows, columns=dimensions)
+
+
+def update_response_model(params, df):
+    """
+    Fit and store the response model of a sweep, see optimization.response_model
+
+    The stored model is kept when it was fitted with the same kind and context on the same rows.
+
+    :return: the fitted model, or None if the sweep has fewer than MIN_ROWS designs
+    """
+    if len(df) < MIN_ROWS:
+        return None
+    kind = params.global_optimization.response_model_kind or 'Gaussian process'
+    context = get_optimization_context(params)
+    model = load_response_model()
+    if model is not None and (model.kind, model.context, getattr(model, 'data_hash', None)) == (kind, context, get_data_hash(df)):
+        UserMessage.info(f'The response model is up to date, fitted on {model.n} designs')
+        return model
+    model = fit_response_model(df, kind, context)
+    save_response_model(model)
+    errors = ', '.join(f"{target} {error['MAPE']:.1f}%" for (target, error) in model.cv_error.items())
+    UserMessage.info(f'{model.kind} response model fitted on {model.n} designs, cross validated error: {errors}')
+    return model
+
+
+_evaluating = set()
+_evaluating_lock = threading.Lock()
+
+
+def start_design_evaluation(params, point):
+    """
+    Evaluate a design point in a background thread and store its result, unless it is stored or running already
+
+    :return: the stored (cost, carbon) of the point, or None if it is being evaluated
+    """
+    # only cost and carbon are computed, so they are stored as a result without core sizing
+    store = get_default_store()
+    context = get_optimization_context(params, size_core=False)
+    result = store.get(context, point)
+    if result is not None:
+        return result
+
+    key = (context, get_key(point))
+    with _evaluating_lock:
+        if key in _evaluating:
+            return None
+        _evaluating.add(key)
+
+    if params.global_optimization.use_local_geometry:
+        evaluate = recalculate_cost_and_carbon_local
     else:
-        for o in options:
-            cost, carbon = recalculate_cost_and_carbon(params, o['base_radius'], o['peak_radius'], o['no_floors'], o['floor_to_floor'], o['i'], o['n'])
-            list_cost.append(cost)
-            list_embodied_carbon.append(carbon)
-
-    df['Base Radius'] = [o['base_radius'] for o in options]
-    df['Peak Radius'] = [o['peak_radius'] for o in options]
-    df['No Floors'] = [o['no_floors'] for o in options]
-    df['Floor to Floor'] = [o['floor_to_floor'] for o in options]
-    df['Cost'] = list_cost
-    df['Embodied Carbon'] = list_embodied_carbon
-    return df
+        evaluate = recalculate_cost_and_carbon
+
+    def evaluate_and_store():
+        try:
+            store.set_many(context, [(point, evaluate(params, **point, i=1, n=1))])
+        finally:
+            with _evaluating_lock:
+                _evaluating.discard(key)
+    threading.Thread(target=evaluate_and_store, name='design-evaluation', daemon=True).start()
+    return None
+
+
+def predict_design(params, point, verify=False):
+    """
+    Predict the cost and carbon of a design point with the stored response model
+
+    :param point: dict with base_radius, peak_radius, no_floors and floor_to_floor
+    :param verify: also evaluate the point in the background, see start_design_evaluation
+    :return: (model, prediction row with Cost, Embodied Carbon and optionally their Std, computed (cost, carbon) or None)
+    """
+    model = load_response_model()
+    if model is None:
+        raise UserError('No response model has been fitted yet, run the Global Optimization and fit the response model first')
+    if model.context != get_optimization_context(params):
+        UserMessage.warning('The response model was fitted with other ShapeDiver parameters, rates or engine, run the Global Optimization again')
+    design = {'Base Radius': point['base_radius'], 'Peak Radius': point['peak_radius'],
+              'No Floors': point['no_floors'], 'Floor to Floor': point['floor_to_floor']}
+    if model.is_extrapolating(design):
+        UserMessage.warning('The design lies outside the range of the sweep, the prediction is an extrapolation')
+    prediction = model.predict([design]).iloc[0]
+    computed = start_design_evaluation(params, point) if verify else None
+    return model, prediction, computed
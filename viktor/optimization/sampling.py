@@ -0,0 +1,370 @@
+"""
+Sampling strategies for the Global Optimization design space
+
+Every sampler follows an ask/tell protocol: ask(n) returns up to n new design points (dicts with base_radius,
+peak_radius, no_floors and floor_to_floor) and tell(points, results) reports their (cost, carbon). A sampler is
+exhausted when ask returns an empty list. All points are snapped to the min/max/step grid of the page and no
+point is proposed twice.
+"""
+import itertools
+import math
+
+import numpy as np
+from scipy.interpolate import RBFInterpolator
+from scipy.stats import qmc
+
+from optimization.pareto import get_pareto_mask
+
+DIMENSIONS = ['base_radius', 'peak_radius', 'no_floors', 'floor_to_floor']
+SAMPLING_STRATEGIES = ['Full factorial', 'Latin hypercube', 'Sobol', 'Surrogate guided', 'Progressive refinement']
+CANDIDATE_POOL_SIZE = 2048 # candidates scored by the surrogate per round
+EXPLORATION_WEIGHT = 0.1 # weight of the distance to evaluated points in the surrogate acquisition
+COARSE_POINTS = 3 # grid values per design variable of the first level of progressive refinement
+SPLIT_FRACTION = 0.25 # design variables that change the objectives of a cell less than this fraction of the largest change are not split
+REFINEMENT_TOLERANCE = 0.02 # distance to the Pareto front, as a fraction of the cost and carbon ranges, of refined cells
+
+
+class DesignSpace:
+    """
+    Grid of allowed values per design variable
+    """
+
+    def __init__(self, values):
+        """
+        :param values: {name: sorted array of allowed values} in the order of DIMENSIONS
+        """
+        self.names = list(values)
+        self.values = [np.asarray(v) for v in values.values()]
+        self.shape = tuple(len(v) for v in self.values)
+        self.size = math.prod(self.shape)
+
+    @classmethod
+    def from_params(cls, o):
+        """
+        Design space of the min/max/step fields of the Global Optimization page
+        """
+        return cls({name: get_grid_values(o[f'min_{name}'], o[f'max_{name}'], o[f'step_{name}']) for name in DIMENSIONS})
+
+    def snap(self, unit_points):
+        """
+        Map points in the unit hypercube to grid indices
+
+        :param unit_points: (n, d) array with values in [0, 1)
+        :return: (n, d) integer array of grid indices
+        """
+        shape = np.array(self.shape)
+        return np.minimum((np.asarray(unit_points) * shape).astype(int), shape - 1)
+
+    def to_unit(self, indices):
+        """
+        Map grid indices to the centers of their cells in the unit hypercube
+        """
+        return (np.asarray(indices) + 0.5) / np.array(self.shape)
+
+    def to_point(self, index):
+        return {name: self.values[k][i].item() for (k, (name, i)) in enumerate(zip(self.names, index))}
+
+    def to_index(self, point):
+        return tuple(int(np.argmin(np.abs(self.values[k] - point[name]))) for (k, name) in enumerate(self.names))
+
+
+def get_grid_values(minimum, maximum, step):
+    """
+    Values minimum, minimum + step, ... up to and including maximum, as ints when the inputs are integral
+    """
+    count = int(math.floor((maximum - minimum) / step + 1e-9)) + 1
+    values = minimum + step * np.arange(max(count, 1))
+    if all(float(v).is_integer() for v in (minimum, step)):
+        values = values.astype(int)
+    return values
+
+
+class Sampler:
+    """
+    Base class of the sampling strategies
+    """
+
+    # True for strategies that may finish before the budget is spent
+    stops_early = False
+
+    def __init__(self, space, budget=None):
+        self.space = space
+        self.budget = space.size if budget is None else min(int(budget), space.size)
+        self.asked = set()
+        self.evaluated = []
+
+    def ask(self, n):
+        indices = []
+        for index in self.propose(min(n, self.budget - len(self.asked))):
+            if index not in self.asked:
+                self.asked.add(index)
+                indices.append(index)
+        return [self.space.to_point(index) for index in indices]
+
+    def propose(self, n):
+        """
+        Up to n new grid indices, to be implemented by the strategies
+        """
+        raise NotImplementedError
+
+    def tell(self, points, results):
+        """
+        Report the (cost, carbon) of evaluated points, failed points are reported as None
+        """
+        for (point, result) in zip(points, results):
+            if result is not None:
+                self.evaluated.append((self.space.to_index(point), result))
+
+
+class FullFactorialSampler(Sampler):
+    """
+    All grid points in order, generated lazily
+    """
+
+    def __init__(self, space, budget=None):
+        super().__init__(space, budget)
+        self._indices = itertools.product(*[range(n) for n in space.shape])
+
+    def propose(self, n):
+        return list(itertools.islice(self._indices, n))
+
+
+class QuasiRandomSampler(Sampler):
+    """
+    Space filling sample of the budget, drawn once from a scipy.stats.qmc engine and snapped to the grid
+
+    Points that snap to the same grid cell are replaced by further draws.
+    """
+
+    def __init__(self, space, budget=None, engine=None):
+        super().__init__(space, budget)
+        self.engine = engine
+        indices = self.draw(self.budget)
+        # draws that keep snapping to the same cells can leave fewer points than the budget
+        self.budget = min(self.budget, len(indices))
+        self._indices = iter(indices)
+
+    def draw(self, count):
+        indices = []
+        seen = set()
+        for attempt in range(10):
+            if len(indices) >= count:
+                break
+            for index in map(tuple, self.space.snap(self.engine.random(count))):
+                if index not in seen and len(indices) < count:
+                    seen.add(index)
+                    indices.append(index)
+        return indices
+
+    def propose(self, n):
+        return list(itertools.islice(self._indices, n))
+
+
+class LatinHypercubeSampler(QuasiRandomSampler):
+    def __init__(self, space, budget=None, seed=0):
+        super().__init__(space, budget, qmc.LatinHypercube(d=len(space.shape), seed=seed))
+
+
+class SobolSampler(QuasiRandomSampler):
+    def __init__(self, space, budget=None, seed=0):
+        super().__init__(space, budget, qmc.Sobol(d=len(space.shape), scramble=True, seed=seed))
+
+    def draw(self, count):
+        # Sobol sequences are balanced for powers of two
+        return super().draw(2 ** math.ceil(math.log2(max(count, 1))))
+
+
+class SurrogateSampler(Sampler):
+    """
+    Surrogate guided sampling that concentrates evaluations near low cost and low carbon designs
+
+    Starts with a Latin hypercube over a quarter of the budget. Then, per round, radial basis function surrogates of
+    cost and carbon are fitted to the evaluated points, and each proposed point minimizes a randomly weighted sum of
+    the normalized predicted cost and carbon minus a bonus for the distance to the points evaluated so far
+    (ParEGO-like scalarization, so that successive points spread along the Pareto front).
+    """
+
+    def __init__(self, space, budget=None, seed=0, initial_fraction=0.25):
+        super().__init__(space, budget)
+        self.rng = np.random.default_rng(seed)
+        initial = max(2 * len(space.shape) + 2, int(self.budget * initial_fraction))
+        self.initial = LatinHypercubeSampler(space, min(initial, self.budget), seed=seed)
+
+    def propose(self, n):
+        initial = self.initial.propose(n)
+        if len(initial) > 0:
+            return initial
+        candidates = self.candidates()
+        if len(candidates) == 0:
+            return []
+        # design variables with a single value (min == max) make the polynomial part of the surrogate singular
+        varying = np.array(self.space.shape) > 1
+        if len(self.evaluated) < int(varying.sum()) + 2:
+            # too few results for a surrogate, e.g. because of failed evaluations
+            return self.propose_random(candidates, n)
+
+        X = self.space.to_unit([index for (index, result) in self.evaluated])[:, varying]
+        Y = np.array([result for (index, result) in self.evaluated], dtype=float)
+        Y = (Y - Y.min(axis=0)) / np.maximum(np.ptp(Y, axis=0), 1e-12)
+        try:
+            surrogate = RBFInterpolator(X, Y, kernel='thin_plate_spline', smoothing=1e-8)
+        except np.linalg.LinAlgError:
+            # e.g. all evaluated points on a line
+            return self.propose_random(candidates, n)
+
+        unit_candidates = self.space.to_unit(candidates)[:, varying]
+        predicted = surrogate(unit_candidates)
+        distance = np.min(np.linalg.norm(unit_candidates[:, None, :] - X[None, :, :], axis=2), axis=1)
+
+        proposed = []
+        taken = np.zeros(len(candidates), dtype=bool)
+        for k in range(min(n, len(candidates))):
+            weight = self.rng.uniform()
+            score = weight * predicted[:, 0] + (1 - weight) * predicted[:, 1] - EXPLORATION_WEIGHT * distance
+            score[taken] = np.inf
+            best = int(np.argmin(score))
+            taken[best] = True
+            proposed.append(tuple(candidates[best]))
+            # spread the batch: the chosen point counts as evaluated for the distance bonus
+            distance = np.minimum(distance, np.linalg.norm(unit_candidates - unit_candidates[best], axis=1))
+        return proposed
+
+    def propose_random(self, candidates, n):
+        chosen = self.rng.choice(len(candidates), size=min(n, len(candidates)), replace=False)
+        return [tuple(candidates[k]) for k in chosen]
+
+    def candidates(self):
+        """
+        Grid indices not asked yet, all of them for small grids, otherwise a random subset
+        """
+        if self.space.size <= CANDIDATE_POOL_SIZE:
+            indices = np.array(list(np.ndindex(*self.space.shape)))
+        else:
+            indices = self.space.snap(self.rng.random((CANDIDATE_POOL_SIZE, len(self.space.shape))))
+            indices = np.unique(indices, axis=0)
+        return np.array([index for index in indices if tuple(index) not in self.asked], dtype=int).reshape(-1, len(self.space.shape))
+
+
+class ProgressiveRefinementSampler(Sampler):
+    """
+    Coarse-to-fine sampling that only refines the parts of the grid near the cost/carbon Pareto front
+
+    The first level evaluates the corners of a coarse grid of COARSE_POINTS values per design variable. When all
+    results of a level are in, every cell that has a corner within tolerance of the Pareto front of the results so
+    far is split in half, and the new corners form the next level. A cell is only split along the design variables
+    that change cost or carbon between its corners by at least SPLIT_FRACTION of the largest change, which keeps the
+    number of new corners per cell far below the 3^4 - 2^4 of a split along all four. Refinement stops when no cell
+    is near the front, all such cells are single grid steps, or the budget is spent. Cells closest to the front are
+    refined first, so a budget cut ends in the least interesting cells.
+    """
+
+    stops_early = True
+
+    def __init__(self, space, budget=None, tolerance=REFINEMENT_TOLERANCE):
+        super().__init__(space, budget)
+        self.tolerance = REFINEMENT_TOLERANCE if tolerance is None else tolerance
+        self.told = 0
+        self.level = 0
+        coarse = [np.unique(np.linspace(0, n - 1, min(n, COARSE_POINTS)).round().astype(int)) for n in space.shape]
+        self.cells = [tuple(cell) for cell in itertools.product(*[list(zip(c[:-1], c[1:])) or [(0, 0)] for c in coarse])]
+        self._queue = iter(itertools.product(*coarse))
+
+    def propose(self, n):
+        if n <= 0:
+            return []
+        proposed = list(itertools.islice(self._queue, n))
+        if len(proposed) == 0 and self.told == len(self.asked) and len(self.cells) > 0:
+            # the level is complete, refine it
+            self.level += 1
+            self._queue = iter(self.refine())
+            proposed = list(itertools.islice(self._queue, n))
+        return proposed
+
+    def tell(self, points, results):
+        super().tell(points, results)
+        self.told += len(points)
+
+    def refine(self):
+        """
+        Split the cells near the Pareto front and return the corners of the new cells that were not asked yet
+        """
+        if len(self.evaluated) == 0:
+            self.cells = []
+            return []
+        indices = [index for (index, result) in self.evaluated]
+        results = np.array([result for (index, result) in self.evaluated], dtype=float)
+        gap = dict(zip(indices, get_dominance_gap(results)))
+        scaled = dict(zip(indices, (results - results.min(axis=0)) / np.maximum(np.ptp(results, axis=0), 1e-12)))
+
+        ranked = []
+        for cell in self.cells:
+            gaps = [gap[corner] for corner in itertools.product(*cell) if corner in gap]
+            if len(gaps) > 0 and min(gaps) <= self.tolerance and any(hi - lo > 1 for (lo, hi) in cell):
+                ranked.append((min(gaps), cell))
+        ranked.sort(key=lambda item: item[0])
+
+        self.cells = []
+        corners = []
+        seen = set()
+        for (_, cell) in ranked:
+            split = self.get_split_dimensions(cell, scaled)
+            halves = [[(lo, (lo + hi) // 2), ((lo + hi) // 2, hi)] if k in split else [(lo, hi)] for (k, (lo, hi)) in enumerate(cell)]
+            for child in itertools.product(*halves):
+                self.cells.append(child)
+                for corner in itertools.product(*child):
+                    if corner not in self.asked and corner not in seen:
+                        seen.add(corner)
+                        corners.append(corner)
+        return corners
+
+    def get_split_dimensions(self, cell, scaled):
+        """
+        Design variables along which a cell is split, by the largest change in scaled cost or carbon along its edges
+        """
+        effects = {}
+        for (k, (lo, hi)) in enumerate(cell):
+            if hi - lo > 1:
+                changes = [np.max(np.abs(scaled[corner] - scaled[corner[:k] + (hi,) + corner[k + 1:]]))
+                           for corner in itertools.product(*cell[:k], [lo], *cell[k + 1:])
+                           if corner in scaled and corner[:k] + (hi,) + corner[k + 1:] in scaled]
+                effects[k] = np.mean(changes) if len(changes) > 0 else np.inf
+        largest = max(effects.values(), default=0)
+        if largest <= 0:
+            # the corners are equal, there is nothing to tell the variables apart
+            return set(effects)
+        return {k for (k, effect) in effects.items() if effect >= SPLIT_FRACTION * largest}
+
+
+def get_dominance_gap(results):
+    """
+    Additive epsilon dominance gap of every result to the other results, in units of the objective ranges
+
+    The gap is 0 for points on the Pareto front, otherwise it is the largest amount by which some other point is
+    better in all objectives.
+
+    :param results: (n, k) array of objectives to minimize
+    """
+    scaled = (results - results.min(axis=0)) / np.maximum(np.ptp(results, axis=0), 1e-12)
+    # the largest gap is always to a point of the front
+    front = scaled[get_pareto_mask(scaled)]
+    return np.max(np.min(scaled[:, None, :] - front[None, :, :], axis=2), axis=1)
+
+
+def get_sampler(strategy, space, budget=None, seed=0, tolerance=None):
+    """
+    Create the sampler of a strategy in SAMPLING_STRATEGIES
+
+    :param budget: maximum number of evaluations, None for all grid points
+    :param tolerance: distance to the Pareto front of the cells refined by progressive refinement
+    """
+    if strategy in (None, 'Full factorial'):
+        return FullFactorialSampler(space, budget)
+    if strategy == 'Latin hypercube':
+        return LatinHypercubeSampler(space, budget, seed=seed)
+    if strategy == 'Sobol':
+        return SobolSampler(space, budget, seed=seed)
+    if strategy == 'Surrogate guided':
+        return SurrogateSampler(space, budget, seed=seed)
+    if strategy == 'Progressive refinement':
+        return ProgressiveRefinementSampler(space, budget, tolerance=tolerance)
+    raise ValueError(f'Unknown sampling strategy: {strategy}')
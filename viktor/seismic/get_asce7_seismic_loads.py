@@ -78,6 +78,25 @@ def calculate_floor_mass(story_floor_area, SD, LL):
     floor_mass = (SD + LL)*story_floor_area
     return floor_mass
 
+def get_spectrum(seismic_spectra, spectrum_type=None):
+    '''
+    Select a spectrum of the output of fetch_usgs_data, the two period MCE spectrum by default
+    '''
+    multiperiod_design_spectrum_df, multiperiod_mce_spectrum_df, two_period_design_spectrum_df, two_period_mce_spectrum_df, seismic_data = seismic_spectra
+
+    if spectrum_type is None:
+        spectrum_df = two_period_mce_spectrum_df
+    elif spectrum_type == 'multi_period_design_spectrum':
+        spectrum_df = multiperiod_design_spectrum_df
+    elif spectrum_type == 'multi_period_mce_spectrum':
+        spectrum_df = multiperiod_mce_spectrum_df
+    elif spectrum_type == 'two_period_design_spectrum':
+        spectrum_df = two_period_design_spectrum_df
+    elif spectrum_type == 'two_period_mce_spectrum':
+        spectrum_df = two_period_mce_spectrum_df
+    return spectrum_df
+
+
 def get_seismic_force(story_data, SD, LL, R, latitude, longitude, code, riskCategory,siteClass, spectrum_type=None, T_optional = None):
     '''
     Parameters for get_seismic_force function:
@@ -101,6 +120,30 @@ def get_seismic_force(story_data, SD, LL, R, latitude, longitude, code, riskCate
     seismic_shear_elevation_plot: list of shear elevation values for plotting
     seismic_data: dictionary of seismic parameters from USGS (sds, sd1, ss, s1, short_period, long_period)
     '''
+    seismic_spectra = fetch_usgs_data(latitude, longitude, code, riskCategory,siteClass)
+    seismic_data = seismic_spectra[4]
+    spectrum_df = get_spectrum(seismic_spectra, spectrum_type)
+
+    story_seismic_loads_dict, seimsic_shear_story_plot, seismic_shear_elevation_plot, seismic_base_shear = distribute_seismic_force(
+        story_data, SD, LL, R, spectrum_df['period'], spectrum_df['acceleration'], T_optional)
+
+    return story_seismic_loads_dict, seimsic_shear_story_plot, seismic_shear_elevation_plot, seismic_data, seismic_base_shear
+
+
+def distribute_seismic_force(story_data, SD, LL, R, periods, accelerations, T_optional = None):
+    '''
+    Equivalent lateral force distribution of the base shear over the stories, for a spectrum that has been fetched
+    already (see fetch_usgs_data and get_spectrum), so that many buildings can be evaluated with one USGS request
+
+    Parameters:
+    story_data, SD, LL, R, T_optional: see get_seismic_force
+    periods: periods of the spectrum in s
+    accelerations: spectral accelerations of the spectrum in g
+
+    Output:
+    story_seismic_loads_dict, seimsic_shear_story_plot, seismic_shear_elevation_plot, seismic_base_shear: see
+    get_seismic_force
+    '''
     # Initialize lists to store story elevation and floor area data
 
     story_elevations = []
@@ -138,21 +181,8 @@ def get_seismic_force(story_data, SD, LL, R, latitude, longitude, code, riskCate
 
     T = 0.016*(total_height**0.7)
 
-    multiperiod_design_spectrum_df, multiperiod_mce_spectrum_df, two_period_design_spectrum_df, two_period_mce_spectrum_df, seismic_data = fetch_usgs_data(latitude, longitude, code, riskCategory,siteClass)
-
     num_stories = len(story_floor_area)
 
-    if spectrum_type is None:
-        spectrum_df = two_period_mce_spectrum_df
-    elif spectrum_type == 'multi_period_design_spectrum':
-        spectrum_df = multiperiod_design_spectrum_df
-    elif spectrum_type == 'multi_period_mce_spectrum':
-        spectrum_df = multiperiod_mce_spectrum_df
-    elif spectrum_type == 'two_period_design_spectrum':
-        spectrum_df = two_period_design_spectrum_df
-    elif spectrum_type == 'two_period_mce_spectrum':
-        spectrum_df = two_period_mce_spectrum_df
-
     if T_optional is not None:
         T = T_optional
 
@@ -170,8 +200,8 @@ def get_seismic_force(story_data, SD, LL, R, latitude, longitude, code, riskCate
 
     total_mass = sum(floor_masses)
 
-    # interpolate T in spectrum_df to obtain acceleration
-    acceleration = np.interp(T, spectrum_df['period'], spectrum_df['acceleration'])
+    # interpolate T in the spectrum to obtain acceleration
+    acceleration = np.interp(T, periods, accelerations)
     base_shear = acceleration*total_mass/R
 
     # Distribute the load among all the stories
@@ -216,7 +246,7 @@ def get_seismic_force(story_data, SD, LL, R, latitude, longitude, code, riskCate
     for i in range(len(story_seismic_loads)):
         story_seismic_loads_dict[story_elevations[i]] = story_seismic_loads[i]
     
-    return story_seismic_loads_dict, seimsic_shear_story_plot, seismic_shear_elevation_plot, seismic_data, seismic_base_shear
+    return story_seismic_loads_dict, seimsic_shear_story_plot, seismic_shear_elevation_plot, seismic_base_shear
 
 if __name__ == '__main__':
     story_elevations = [48, 36, 24, 12] #ft
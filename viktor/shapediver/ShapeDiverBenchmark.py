@@ -0,0 +1,148 @@
+"""End-to-end sweep throughput of the ShapeDiver tiny SDKs against the local stand-in server
+
+Every sample of a sweep borrows a pooled session, requests the BUILDING_STRUCTURE and
+BUILDING_FLOOR_ELV_AREA exports for its parameter values, downloads both assets and parses them,
+which is the ShapeDiver part of run_optimization. Run from the viktor folder:
+    python -m shapediver.ShapeDiverBenchmark --samples 200 --workers 1 2 4 8 16 --latency 0.05
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shapediver.ShapeDiverSessionPool import ShapeDiverSessionPool
+from shapediver.ShapeDiverStandInServer import ShapeDiverStandInServer, BASE_RADIUS, PEAK_RADIUS, NO_FLOORS, FLOOR_TO_FLOOR
+from shapediver.ShapeDiverTinyAsyncSdk import ShapeDiverAsyncHttpTransport, ShapeDiverAsyncSessionPool
+from shapediver.ShapeDiverTinySdk import ShapeDiverHttpTransport, ShapeDiverTinySessionSdk
+
+BENCHMARK_TICKET = 'stand-in'
+EXPORT_NAMES = ['BUILDING_STRUCTURE', 'BUILDING_FLOOR_ELV_AREA']
+
+
+def sweep_samples(count):
+    """Distinct parameter dictionaries of a full factorial sweep, truncated to count samples"""
+
+    samples = []
+    for base_radius in range(60, 201, 5):
+        for peak_radius in range(60, 101, 5):
+            for no_floors in range(10, 51, 2):
+                for floor_to_floor in range(8, 16):
+                    if len(samples) == count:
+                        return samples
+                    samples.append({BASE_RADIUS: base_radius, PEAK_RADIUS: peak_radius,
+                                    NO_FLOORS: no_floors, FLOOR_TO_FLOOR: floor_to_floor})
+    return samples
+
+def evaluate_sync(pool, transport, paramDict):
+    start = time.perf_counter()
+    with pool.borrow() as sdk:
+        response = sdk.export(paramDict = paramDict, exportNames = EXPORT_NAMES)
+    for exportName in EXPORT_NAMES:
+        href = response.exportContentItems(exportName = exportName)[0]['href']
+        json.loads(transport.get(href).content)
+    return time.perf_counter() - start
+
+def run_sync(url, samples, workers):
+    """Sweep with the sync SDK on a thread pool, returns the wall time and the per sample latencies"""
+
+    transport = ShapeDiverHttpTransport(backoffFactor = 0.05, poolSize = max(32, 2 * workers), maxConcurrency = 4 * workers)
+    pool = ShapeDiverSessionPool(lambda: ShapeDiverTinySessionSdk(modelViewUrl = url, ticket = BENCHMARK_TICKET, transport = transport), maxSize = workers)
+    start = time.perf_counter()
+    # the sync SDK prints every export request body
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            latencies = list(executor.map(lambda paramDict: evaluate_sync(pool, transport, paramDict), samples))
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return elapsed, latencies
+
+async def evaluate_async(pool, paramDict):
+    start = time.perf_counter()
+    async with pool.borrow() as sdk:
+        response = await sdk.export(paramDict = paramDict, exportNames = EXPORT_NAMES)
+    hrefs = [response.exportContentItems(exportName = exportName)[0]['href'] for exportName in EXPORT_NAMES]
+    for content in await asyncio.gather(*[sdk.fetchAsset(href) for href in hrefs]):
+        json.loads(content)
+    return time.perf_counter() - start
+
+async def run_async(url, samples, workers):
+    """Sweep with the async SDK on one event loop, returns the wall time and the per sample latencies"""
+
+    transport = ShapeDiverAsyncHttpTransport(backoffFactor = 0.05, poolSize = max(32, 2 * workers), maxConcurrency = 4 * workers)
+    pool = ShapeDiverAsyncSessionPool(ticket = BENCHMARK_TICKET, modelViewUrl = url, transport = transport, maxSize = workers)
+    start = time.perf_counter()
+    try:
+        latencies = await asyncio.gather(*[evaluate_async(pool, paramDict) for paramDict in samples])
+        elapsed = time.perf_counter() - start
+    finally:
+        await pool.close()
+        await transport.close()
+    return elapsed, latencies
+
+def run_benchmark(*, samples = 100, workers = (1, 2, 4, 8, 16), modes = ('sync', 'async'), **faults):
+    """Measure sweep throughput for every combination of mode and worker count
+
+    Parameters:
+    - samples (int): Number of parameter combinations per sweep.
+    - workers (iterable of int): Worker counts (threads and sessions for sync, sessions for async).
+    - modes (iterable of str): 'sync' and/or 'async'.
+    - faults: latency, latencyJitter, throttleRate, failureRate and retryAfter of the stand-in server.
+
+    Returns:
+    - list of dict: One row per run with mode, workers, samples, seconds, throughput and latency percentiles.
+    """
+
+    rows = []
+    for mode in modes:
+        for workerCount in workers:
+            # a fresh server per run, so results of earlier runs are not reused
+            with ShapeDiverStandInServer(**faults) as server:
+                sweep = sweep_samples(samples)
+                if mode == 'sync':
+                    elapsed, latencies = run_sync(server.url, sweep, workerCount)
+                else:
+                    elapsed, latencies = asyncio.run(run_async(server.url, sweep, workerCount))
+                latencies = sorted(latencies)
+                rows.append({
+                    'mode': mode,
+                    'workers': workerCount,
+                    'samples': len(sweep),
+                    'seconds': elapsed,
+                    'throughput': len(sweep) / elapsed,
+                    'p50': statistics.median(latencies),
+                    'p95': latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+                    'throttled': server.state.stats.get('429', 0),
+                    'failed': server.state.stats.get('500', 0),
+                })
+    return rows
+
+def format_rows(rows):
+    lines = [f"{'mode':<6} {'workers':>7} {'samples':>7} {'seconds':>8} {'samples/s':>9} {'p50 [s]':>8} {'p95 [s]':>8} {'429':>5} {'500':>5}"]
+    for row in rows:
+        lines.append(f"{row['mode']:<6} {row['workers']:>7} {row['samples']:>7} {row['seconds']:>8.2f} {row['throughput']:>9.1f} "
+                     f"{row['p50']:>8.3f} {row['p95']:>8.3f} {row['throttled']:>5} {row['failed']:>5}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Sweep throughput of the ShapeDiver tiny SDKs against the local stand-in server')
+    parser.add_argument('--samples', type = int, default = 100)
+    parser.add_argument('--workers', type = int, nargs = '+', default = [1, 2, 4, 8, 16])
+    parser.add_argument('--modes', nargs = '+', choices = ['sync', 'async'], default = ['sync', 'async'])
+    parser.add_argument('--latency', type = float, default = 0.05, help = 'seconds added to every request')
+    parser.add_argument('--latency-jitter', type = float, default = 0.0)
+    parser.add_argument('--throttle-rate', type = float, default = 0.0, help = 'fraction of requests answered with HTTP 429')
+    parser.add_argument('--failure-rate', type = float, default = 0.0, help = 'fraction of requests answered with HTTP 500')
+    parser.add_argument('--json', help = 'also write the results to this file')
+    args = parser.parse_args()
+
+    rows = run_benchmark(samples = args.samples, workers = args.workers, modes = args.modes, latency = args.latency,
+                         latencyJitter = args.latency_jitter, throttleRate = args.throttle_rate, failureRate = args.failure_rate)
+    print(format_rows(rows))
+    if args.json:
+        with open(args.json, 'w') as jsonFile:
+            json.dump(rows, jsonFile, indent = 2)
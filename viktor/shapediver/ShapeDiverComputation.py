@@ -1,11 +1,18 @@
+import asyncio
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from viktor.core import Storage
 from viktor import File, UserMessage, UserError
 import os
 
+from carbon_and_cost.calculate_carbon_and_cost import GEOMETRY_AGGREGATES_KEY, store_geometry_aggregates
+
 # ShapeDiver ticket and modelViewUrl
-from shapediver.ShapeDiverTinySdkViktorUtils import ShapeDiverTinySessionSdkMemoized
+from shapediver.ShapeDiverTinySdkViktorUtils import ShapeDiverSessionPoolShared, exceptionHandler
+from shapediver.ShapeDiverTinySdk import defaultTransport
+from shapediver.ShapeDiverResultCache import ShapeDiverResultCache
 
 ticket = os.getenv("SD_TICKET")
 if ticket is None or len(ticket) == 0:
@@ -14,36 +21,70 @@ modelViewUrl = os.getenv("SD_MODEL_VIEW_URL")
 if modelViewUrl is None or len(modelViewUrl) == 0:
     modelViewUrl = "https://nsc005.us-east-1.shapediver.com"
 
+# Results of earlier computations, keyed by a hash of the ticket and the parameter values
+resultCache = ShapeDiverResultCache()
 
-def ShapeDiverComputation(parameters):
- 
-    # Initialize a session with the model (memoized)
-    shapeDiverSessionSdk = ShapeDiverTinySessionSdkMemoized(ticket, modelViewUrl, forceNewSession = True)
+EXPORT_NAMES = ["BUILDING_STRUCTURE", "BUILDING_FLOOR_EDGE", "BUILDING_FLOOR_ELV_AREA"]
 
-    # compute outputs and exports of ShapeDiver model at the same time, 
-    # get resulting glTF 2 assets and export assets
-    result = shapeDiverSessionSdk.export(paramDict = parameters, includeOutputs = True)
+# Assets are downloaded concurrently over the pooled transport,
+# results are written to the result cache in the background
+assetExecutor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='shapediver-assets')
+cacheExecutor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='shapediver-cache')
+
+logger = logging.getLogger(__name__)
+
+
+def downloadAsset(href):
+    """Download the content of an output or export asset"""
+    response = defaultTransport.get(href)
+    if response.status_code != 200:
+        raise UserError(f'Failed to download asset (HTTP status code {response.status_code})')
+    return response.content
 
-    # get resulting exported asset of export called "BUILDING_STRUCTURE"
-    exportItems = result.exportContentItems(exportName = "BUILDING_STRUCTURE")
-    if len(exportItems) != 1: 
-        UserMessage.warning(f'No exported asset found for export "BUILDING_STRUCTURE".')
-    else:
-        Storage().set('BUILDING_STRUCTURE', data=File.from_url(exportItems[0]['href']), scope='entity')
-    
-    # get resulting exported asset of export called "BUILDING_FLOOR_EDGE"
-    exportItems = result.exportContentItems(exportName = "BUILDING_FLOOR_EDGE")
-    if len(exportItems) != 1: 
-        UserMessage.warning(f'No exported asset found for export "BUILDING_FLOOR_EDGE".')
-    else:
-        Storage().set('BUILDING_FLOOR_EDGE', data=File.from_url(exportItems[0]['href']), scope='entity')
 
-    # get resulting exported asset of export called "BUILDING_FLOOR_ELV_AREA"
-    exportItems = result.exportContentItems(exportName = "BUILDING_FLOOR_ELV_AREA")
-    if len(exportItems) != 1: 
-        UserMessage.warning(f'No exported asset found for export "BUILDING_FLOOR_ELV_AREA".')
+def ShapeDiverComputation(parameters):
+
+    cacheKey = resultCache.key(ticket, parameters)
+    items = resultCache.get(cacheKey, ['GLTF'])
+    if items is not None:
+        exportItems = {}
+        for exportName in EXPORT_NAMES:
+            exportItem = resultCache.get(cacheKey, [exportName])
+            if exportItem is None:
+                UserMessage.warning(f'No exported asset found for export "{exportName}".')
+            else:
+                exportItems.update(exportItem)
+        storeExports(exportItems)
+        # ShapeDiver asset URLs expire, the glTF of a cached result is served from its cached bytes
+        # and there is no valid URL to store for it
+        try:
+            Storage().delete('GLTF_URL', scope='entity')
+        except FileNotFoundError:
+            pass
     else:
-        Storage().set('BUILDING_FLOOR_ELV_AREA', data=File.from_url(exportItems[0]['href']), scope='entity')
+        items = computeAndCacheGeometry(cacheKey, parameters)
+
+    glTF_file = File.from_data(items['GLTF'])
+
+    return glTF_file
+
+
+def computeAndCacheGeometry(cacheKey, parameters):
+ 
+    # Borrow a warm session with the model from the pool,
+    # compute outputs and exports of ShapeDiver model at the same time, 
+    # get resulting glTF 2 assets and export assets
+    with ShapeDiverSessionPoolShared(ticket, modelViewUrl).borrow() as shapeDiverSessionSdk:
+        result = shapeDiverSessionSdk.export(paramDict = parameters, includeOutputs = True)
+
+    # start downloading the exported assets of exports "BUILDING_STRUCTURE", "BUILDING_FLOOR_EDGE" and "BUILDING_FLOOR_ELV_AREA"
+    exportDownloads = {}
+    for exportName in EXPORT_NAMES:
+        exportItems = result.exportContentItems(exportName = exportName)
+        if len(exportItems) != 1: 
+            UserMessage.warning(f'No exported asset found for export "{exportName}".')
+        else:
+            exportDownloads[exportName] = assetExecutor.submit(downloadAsset, exportItems[0]['href'])
 
     # get glTF2 output
     contentItemsGltf2 = result.outputContentItemsGltf2()
@@ -54,34 +95,94 @@ def ShapeDiverComputation(parameters):
     if len(contentItemsGltf2) > 1: 
         UserMessage.warning(f'Computation resulted in {len(contentItemsGltf2)} glTF 2.0 assets, only displaying the first one.')
 
+    # the glTF and the exports are downloaded at the same time, the exports are stored before the view returns
+    # so that other views never read the exports of an earlier design
     glTF_url = contentItemsGltf2[0]['href']
+    glTFDownload = assetExecutor.submit(downloadAsset, glTF_url)
+    exportItems = {exportName: download.result() for (exportName, download) in exportDownloads.items()}
+    storeExports(exportItems)
     Storage().set('GLTF_URL', data=File.from_data(glTF_url), scope='entity')
 
-    glTF_file = File.from_url(glTF_url)
+    items = {'GLTF': glTFDownload.result(), **exportItems}
+    cacheExecutor.submit(cacheResult, cacheKey, items)
 
-    return glTF_file
+    return items
 
 
-def ShapeDiverComputationForOptimization(parameters):
-    # Initialize a session with the model (memoized)
-    shapeDiverSessionSdk = ShapeDiverTinySessionSdkMemoized(ticket, modelViewUrl, forceNewSession=True)
+def storeExports(exportItems):
+    """Write exported assets to the entity Storage, with the aggregates of the geometry they describe"""
+    # the aggregates are replaced before the exports, so a reader always finds the aggregates of the
+    # earlier or of the new geometry, never none
+    if "BUILDING_STRUCTURE" in exportItems and "BUILDING_FLOOR_ELV_AREA" in exportItems:
+        store_geometry_aggregates(exportItems["BUILDING_STRUCTURE"], exportItems["BUILDING_FLOOR_ELV_AREA"])
+    else:
+        # aggregates of an earlier geometry must not outlive its exports
+        try:
+            Storage().delete(GEOMETRY_AGGREGATES_KEY, scope='entity')
+        except FileNotFoundError:
+            pass
+    for (exportName, data) in exportItems.items():
+        Storage().set(exportName, data=File.from_data(data), scope='entity')
 
-    # compute outputs and exports of ShapeDiver model at the same time,
-    # get resulting glTF 2 assets and export assets
-    result = shapeDiverSessionSdk.export(paramDict=parameters, includeOutputs=True)
 
-    # get resulting exported asset of export called "BUILDING_STRUCTURE"
-    exportItems = result.exportContentItems(exportName="BUILDING_STRUCTURE")
-    if len(exportItems) != 1:
-        UserMessage.warning(f'No exported asset found for export "BUILDING_STRUCTURE".')
-    else:
-        BUILDING_STRUCTURE = json.loads(File.from_url(exportItems[0]['href']).getvalue())
+def cacheResult(cacheKey, items):
+    """Write a computed result to the result cache, a failure only costs a recomputation later"""
+    try:
+        resultCache.set(cacheKey, items)
+    except Exception:
+        logger.exception('Failed to cache ShapeDiver result %s', cacheKey)
 
-    # get resulting exported asset of export called "BUILDING_FLOOR_ELV_AREA"
-    exportItems = result.exportContentItems(exportName="BUILDING_FLOOR_ELV_AREA")
-    if len(exportItems) != 1:
-        UserMessage.warning(f'No exported asset found for export "BUILDING_FLOOR_ELV_AREA".')
-    else:
-        BUILDING_FLOOR_ELV_AREA = json.loads(File.from_url(exportItems[0]['href']).getvalue())
 
-    return BUILDING_STRUCTURE, BUILDING_FLOOR_ELV_AREA
+def ShapeDiverComputationForOptimization(parameters):
+    cacheKey = resultCache.key(ticket, parameters)
+    items = resultCache.get(cacheKey, ["BUILDING_STRUCTURE", "BUILDING_FLOOR_ELV_AREA"])
+    if items is not None:
+        return json.loads(items["BUILDING_STRUCTURE"]), json.loads(items["BUILDING_FLOOR_ELV_AREA"])
+
+    # Borrow a warm session with the model from the pool,
+    # compute only the two exports needed for the optimization
+    exportNames = ["BUILDING_STRUCTURE", "BUILDING_FLOOR_ELV_AREA"]
+    with ShapeDiverSessionPoolShared(ticket, modelViewUrl).borrow() as shapeDiverSessionSdk:
+        result = shapeDiverSessionSdk.export(paramDict=parameters, exportNames=exportNames)
+
+    # download the exported assets concurrently
+    exportDownloads = {}
+    for exportName in exportNames:
+        exportItems = result.exportContentItems(exportName=exportName)
+        if len(exportItems) != 1:
+            raise UserError(f'No exported asset found for export "{exportName}".')
+        exportDownloads[exportName] = assetExecutor.submit(downloadAsset, exportItems[0]['href'])
+    items = {exportName: download.result() for (exportName, download) in exportDownloads.items()}
+
+    resultCache.set(cacheKey, items)
+    return json.loads(items["BUILDING_STRUCTURE"]), json.loads(items["BUILDING_FLOOR_ELV_AREA"])
+
+
+async def ShapeDiverComputationForOptimizationAsync(parameters, sessionPool):
+    """asyncio variant of ShapeDiverComputationForOptimization
+
+    sessionPool is a ShapeDiverAsyncSessionPool, sessions and connections are shared by all
+    computations running on the event loop.
+    """
+    cacheKey = resultCache.key(ticket, parameters)
+    items = resultCache.get(cacheKey, ["BUILDING_STRUCTURE", "BUILDING_FLOOR_ELV_AREA"])
+    if items is not None:
+        return json.loads(items["BUILDING_STRUCTURE"]), json.loads(items["BUILDING_FLOOR_ELV_AREA"])
+
+    exportNames = ["BUILDING_STRUCTURE", "BUILDING_FLOOR_ELV_AREA"]
+    try:
+        async with sessionPool.borrow() as shapeDiverSessionSdk:
+            result = await shapeDiverSessionSdk.export(paramDict=parameters, exportNames=exportNames)
+            hrefs = []
+            for exportName in exportNames:
+                exportItems = result.exportContentItems(exportName=exportName)
+                if len(exportItems) != 1:
+                    raise Exception(f'No exported asset found for export "{exportName}".')
+                hrefs.append(exportItems[0]['href'])
+            contents = await asyncio.gather(*[shapeDiverSessionSdk.fetchAsset(href) for href in hrefs])
+    except Exception as e:
+        exceptionHandler(e)
+    items = dict(zip(exportNames, contents))
+
+    resultCache.set(cacheKey, items)
+    return json.loads(items["BUILDING_STRUCTURE"]), json.loads(items["BUILDING_FLOOR_ELV_AREA"])
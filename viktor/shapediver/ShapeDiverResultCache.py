@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from shapediver.ShapeDiverTinySdk import RgbToShapeDiverColor
+
+
+def normalizeParameterValue(value):
+    """Map a parameter value to a JSON value that is equal for equal ShapeDiver inputs"""
+
+    if isinstance(value, bool) or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if all(hasattr(value, attr) for attr in ('r', 'g', 'b')):
+        return RgbToShapeDiverColor(value.r, value.g, value.b)
+    if hasattr(value, 'file'):
+        # VIKTOR FileResource, identified by the hash of its contents
+        digest = hashlib.sha256()
+        with value.file.open_binary() as binaryFile:
+            for chunk in iter(lambda: binaryFile.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    return str(value)
+
+def normalizeParameters(paramDict):
+    """Normalize a parameter dictionary, parameters without a value are left out"""
+
+    return {paramId: normalizeParameterValue(value) for (paramId, value) in sorted(paramDict.items()) if value is not None}
+
+INDEX_FILENAME = 'index.sqlite'
+
+class ShapeDiverResultCache:
+    """Size-bounded LRU disk store for ShapeDiver computation results
+
+    Entries are content-addressed by a hash of the ticket and the normalized parameter values,
+    each entry holds named binary items (e.g. the glTF and exported JSON files).
+    The least recently used entries are removed once the store exceeds maxBytes. Item sizes and
+    the last use of every entry are kept in an SQLite index next to the entries, so that a write
+    only looks at the entries when the store is over budget.
+    """
+
+    def __init__(self, directory = None, maxBytes = 512 * 1024 * 1024):
+        if directory is None:
+            directory = os.getenv("SD_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "shapediver-result-cache")
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(directory, INDEX_FILENAME), timeout = 30, check_same_thread = False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS entry (key TEXT PRIMARY KEY, last_used REAL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entry_last_used ON entry (last_used)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS item (key TEXT, name TEXT, size INTEGER, PRIMARY KEY (key, name))")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER)")
+            if self._connection.execute("INSERT OR IGNORE INTO total VALUES (0, 0)").rowcount == 1:
+                self._indexEntries()
+
+    def _indexEntries(self):
+        """Add the entries stored before there was an index"""
+
+        for key in os.listdir(self.directory):
+            entryDirectory = os.path.join(self.directory, key)
+            if not os.path.isdir(entryDirectory):
+                continue
+            self._connection.execute("INSERT OR REPLACE INTO entry VALUES (?, ?)", (key, os.stat(entryDirectory).st_mtime))
+            for item in os.scandir(entryDirectory):
+                self._connection.execute("INSERT OR REPLACE INTO item VALUES (?, ?, ?)", (key, item.name, item.stat().st_size))
+        self._connection.execute("UPDATE total SET bytes = (SELECT COALESCE(SUM(size), 0) FROM item)")
+
+    def key(self, ticket, paramDict):
+        """Content address of the results of a computation"""
+
+        body = json.dumps({'ticket': ticket, 'parameters': normalizeParameters(paramDict)}, sort_keys = True)
+        return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+    def get(self, key, names):
+        """Get the items with the given names of an entry, or None if any of them is not stored"""
+
+        entryDirectory = os.path.join(self.directory, key)
+        items = {}
+        try:
+            for name in names:
+                with open(os.path.join(entryDirectory, name), 'rb') as itemFile:
+                    items[name] = itemFile.read()
+        except FileNotFoundError:
+            return None
+        # mark entry as recently used
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE entry SET last_used = ? WHERE key = ?", (time.time(), key))
+        return items
+
+    def set(self, key, items):
+        """Store named binary items for an entry, merged with the items already stored"""
+
+        entryDirectory = os.path.join(self.directory, key)
+        with self._lock, self._connection:
+            os.makedirs(entryDirectory, exist_ok = True)
+            for (name, data) in items.items():
+                # write to a temporary file first, so readers never see partial items
+                fd, tempPath = tempfile.mkstemp(dir = entryDirectory)
+                with os.fdopen(fd, 'wb') as itemFile:
+                    itemFile.write(data)
+                os.replace(tempPath, os.path.join(entryDirectory, name))
+                row = self._connection.execute("SELECT size FROM item WHERE key = ? AND name = ?", (key, name)).fetchone()
+                self._connection.execute("INSERT OR REPLACE INTO item VALUES (?, ?, ?)", (key, name, len(data)))
+                self._connection.execute("UPDATE total SET bytes = bytes + ?", (len(data) - (row[0] if row else 0),))
+            self._connection.execute("INSERT OR REPLACE INTO entry VALUES (?, ?)", (key, time.time()))
+            if self._totalBytes() > self.maxBytes:
+                self._evict()
+
+    def _totalBytes(self):
+        return self._connection.execute("SELECT bytes FROM total").fetchone()[0]
+
+    def _evict(self):
+        """Remove the least recently used entries until the store is within maxBytes"""
+
+        totalBytes = self._totalBytes()
+        entries = self._connection.execute(
+            "SELECT entry.key, COALESCE(SUM(item.size), 0) FROM entry LEFT JOIN item ON item.key = entry.key "
+            "GROUP BY entry.key ORDER BY entry.last_used")
+        evicted = []
+        for (key, size) in entries:
+            if totalBytes <= self.maxBytes:
+                break
+            evicted.append((key,))
+            totalBytes -= size
+        self._connection.executemany("DELETE FROM entry WHERE key = ?", evicted)
+        self._connection.executemany("DELETE FROM item WHERE key = ?", evicted)
+        self._connection.execute("UPDATE total SET bytes = ?", (totalBytes,))
+        for (key,) in evicted:
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors = True)
+
+    def clear(self):
+        with self._lock, self._connection:
+            for (key,) in self._connection.execute("SELECT key FROM entry").fetchall():
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors = True)
+            self._connection.execute("DELETE FROM entry")
+            self._connection.execute("DELETE FROM item")
+            self._connection.execute("UPDATE total SET bytes = 0")
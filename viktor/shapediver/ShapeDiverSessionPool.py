@@ -0,0 +1,104 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PooledSession:
+    """An open session in a ShapeDiverSessionPool together with its bookkeeping"""
+
+    def __init__(self, sdk):
+        self.sdk = sdk
+        self.createdAt = time.monotonic()
+        self.lastUsed = self.createdAt
+
+
+class ShapeDiverSessionPool:
+    """Bounded pool of open sessions with a ShapeDiver model
+
+    Workers borrow a warm session per computation instead of opening a new one, which saves
+    the session init request and server-side session setup. At most maxSize sessions are open
+    at the same time. Sessions that have been idle for longer than idleTimeout or are older than
+    maxAge are considered expired by ShapeDiver and closed on eviction, and so are sessions
+    that raised an error while borrowed.
+    """
+
+    def __init__(self, createSession, *, maxSize = 8, idleTimeout = 240, maxAge = 3600):
+        """
+        createSession is called without arguments to open a new session (ShapeDiverTinySessionSdk)
+        """
+
+        self.createSession = createSession
+        self.maxSize = maxSize
+        self.idleTimeout = idleTimeout
+        self.maxAge = maxAge
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxSize)
+
+    def isHealthy(self, entry):
+        """Check whether a pooled session can still be used"""
+
+        now = time.monotonic()
+        return now - entry.lastUsed < self.idleTimeout and now - entry.createdAt < self.maxAge
+
+    @contextmanager
+    def borrow(self, timeout = None):
+        """Borrow a session for the duration of a with block
+
+        Blocks while maxSize sessions are in use.
+        """
+
+        if not self._slots.acquire(timeout = timeout):
+            raise TimeoutError('No ShapeDiver session became available in time')
+        try:
+            entry = self._takeIdle()
+            if entry is None:
+                entry = PooledSession(self.createSession())
+            try:
+                yield entry.sdk
+            except BaseException:
+                self._close(entry)
+                raise
+            entry.lastUsed = time.monotonic()
+            with self._lock:
+                self._idle.append(entry)
+        finally:
+            self._slots.release()
+
+    def _takeIdle(self):
+        expired = []
+        entry = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if self.isHealthy(candidate):
+                    entry = candidate
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            self._close(candidate)
+        return entry
+
+    def evictExpired(self):
+        """Close all idle sessions that are no longer healthy"""
+
+        with self._lock:
+            expired = [entry for entry in self._idle if not self.isHealthy(entry)]
+            self._idle = [entry for entry in self._idle if self.isHealthy(entry)]
+        for entry in expired:
+            self._close(entry)
+
+    def close(self):
+        """Close all idle sessions"""
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._close(entry)
+
+    def _close(self, entry):
+        try:
+            entry.sdk.close()
+        except Exception:
+            # The session might already have expired on the server
+            pass
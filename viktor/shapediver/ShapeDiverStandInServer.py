@@ -0,0 +1,269 @@
+"""Local stand-in for the ShapeDiver Geometry Backend endpoints used by ShapeDiverTinySessionSdk
+
+Implements session init (ticket), export, output, file upload and session close, and serves
+deterministic BUILDING_STRUCTURE, BUILDING_FLOOR_EDGE and BUILDING_FLOOR_ELV_AREA assets for the
+given parameter values. Latency, throttling (HTTP 429) and failures (HTTP 500) can be injected.
+
+Run it standalone (from the viktor folder) and point the app at it:
+    python -m shapediver.ShapeDiverStandInServer --port 8765 --latency 0.2 --throttle-rate 0.05
+    SD_MODEL_VIEW_URL=http://127.0.0.1:8765
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tower_geometry.generate_tower_geometry import generate_tower_geometry, generate_floor_edges
+
+# Parameter ids of the tower model, see the Geometry page of app.py
+BASE_RADIUS = 'ff31e6cb-2c58-4d73-b6b1-10e63ba346bb'
+PEAK_RADIUS = '5b127d95-8792-4225-ad73-6d958e9fa6ce'
+NO_FLOORS = 'f86e2cec-4b10-44ca-b42c-e7615be7e784'
+FLOOR_TO_FLOOR = '1125c8f7-8ba9-4b4c-8d17-4a5f2afcea01'
+GRID_SPACING = '6488bc66-2a0a-4c32-bfaa-e5e26a79ab49'
+FACES = 'f4ed86ed-aa01-4ef8-a4a1-d52912fca945'
+STRUCTURE = 'c3d98212-8694-4b6b-9d9a-9fe4fb800670'
+FLOOR = 'b04900a4-2d8f-499d-94d7-d1da11d592b0'
+INPUT_FILE = '0f4c5f0e-6d2b-4a55-9a8f-8c1f1b6f2d10'
+
+PARAMETERS = {
+    BASE_RADIUS: {'id': BASE_RADIUS, 'name': 'Base Radius', 'type': 'Float', 'defval': '83', 'min': 60, 'max': 200, 'decimalplaces': 0, 'order': 0, 'hidden': False, 'visualization': 'slider'},
+    PEAK_RADIUS: {'id': PEAK_RADIUS, 'name': 'Peak Radius', 'type': 'Float', 'defval': '60', 'min': 60, 'max': 100, 'decimalplaces': 0, 'order': 1, 'hidden': False, 'visualization': 'slider'},
+    NO_FLOORS: {'id': NO_FLOORS, 'name': 'No Floors', 'type': 'Int', 'defval': '18', 'min': 10, 'max': 50, 'order': 2, 'hidden': False, 'visualization': 'slider'},
+    FLOOR_TO_FLOOR: {'id': FLOOR_TO_FLOOR, 'name': 'Floor to Floor', 'type': 'Float', 'defval': '12', 'min': 8, 'max': 15, 'decimalplaces': 0, 'order': 3, 'hidden': False, 'visualization': 'slider'},
+    GRID_SPACING: {'id': GRID_SPACING, 'name': 'Grid Spacing', 'type': 'Float', 'defval': '40', 'min': 15, 'max': 45, 'decimalplaces': 0, 'order': 4, 'hidden': False, 'visualization': 'slider'},
+    FACES: {'id': FACES, 'name': 'Faces', 'type': 'Bool', 'defval': 'true', 'order': 5, 'hidden': False},
+    STRUCTURE: {'id': STRUCTURE, 'name': 'Structure', 'type': 'Bool', 'defval': 'false', 'order': 6, 'hidden': False},
+    FLOOR: {'id': FLOOR, 'name': 'Floor', 'type': 'Bool', 'defval': 'false', 'order': 7, 'hidden': False},
+    INPUT_FILE: {'id': INPUT_FILE, 'name': 'Input File', 'type': 'File', 'format': ['application/json'], 'max': 5000000, 'order': 8, 'hidden': True},
+}
+
+EXPORT_NAMES = ['BUILDING_STRUCTURE', 'BUILDING_FLOOR_EDGE', 'BUILDING_FLOOR_ELV_AREA']
+OUTPUT_NAMES = ['BUILDING_GLTF']
+
+
+def tower_geometry(parameters):
+    """Deterministic geometry for the given parameter values, generated by the local tower geometry engine"""
+
+    geometry = (float(parameters.get(BASE_RADIUS, 83)), float(parameters.get(PEAK_RADIUS, 60)),
+                int(float(parameters.get(NO_FLOORS, 18))), float(parameters.get(FLOOR_TO_FLOOR, 12)),
+                float(parameters.get(GRID_SPACING, 40)))
+    buildingStructure, buildingFloorElvArea = generate_tower_geometry(*geometry)
+    return {
+        'BUILDING_STRUCTURE': buildingStructure,
+        'BUILDING_FLOOR_EDGE': generate_floor_edges(*geometry),
+        'BUILDING_FLOOR_ELV_AREA': buildingFloorElvArea,
+    }
+
+
+class StandInState:
+    """Sessions, computed results and request statistics of a stand-in server"""
+
+    def __init__(self, *, latency = 0.0, latencyJitter = 0.0, throttleRate = 0.0, failureRate = 0.0, retryAfter = 0.1, seed = 0):
+        self.latency = latency
+        self.latencyJitter = latencyJitter
+        self.throttleRate = throttleRate
+        self.failureRate = failureRate
+        self.retryAfter = retryAfter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.results = {}
+        self.uploads = {}
+        self.stats = {}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def draw(self):
+        with self.lock:
+            return self.random.random(), self.random.random(), self.random.random()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def baseUrl(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def log_message(self, format, *args):
+        pass
+
+    def sendJson(self, status, body, headers = {}):
+        self.sendBytes(status, json.dumps(body).encode('utf-8'), 'application/json', headers)
+
+    def sendBytes(self, status, data, contentType, headers = {}):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        for (key, value) in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def readBody(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length > 0 else b''
+
+    def injectFaults(self, endpoint):
+        """Simulate latency, throttling and failures, returns True if the request was answered"""
+
+        self.state.count(endpoint)
+        throttle, failure, jitter = self.state.draw()
+        time.sleep(max(0.0, self.state.latency + self.state.latencyJitter * (2 * jitter - 1)))
+        if throttle < self.state.throttleRate:
+            self.state.count('429')
+            self.sendJson(429, {'message': 'Too many requests'}, {'Retry-After': str(self.state.retryAfter)})
+            return True
+        if failure < self.state.failureRate:
+            self.state.count('500')
+            self.sendJson(500, {'message': 'Injected failure'})
+            return True
+        return False
+
+    def do_GET(self):
+        match = re.fullmatch(r'/assets/(\w+)/(\w+)', self.path)
+        if match is None:
+            return self.sendJson(404, {'message': 'Not found'})
+        self.readBody()
+        if self.injectFaults('asset'):
+            return
+        key, name = match.groups()
+        with self.state.lock:
+            result = self.state.results.get(key)
+        if result is None:
+            return self.sendJson(404, {'message': 'Unknown asset'})
+        if name == 'BUILDING_GLTF':
+            return self.sendBytes(200, b'glTF' + hashlib.sha256(key.encode('utf-8')).digest(), 'model/gltf-binary')
+        return self.sendBytes(200, json.dumps(result[name]).encode('utf-8'), 'application/json')
+
+    def do_POST(self):
+        body = self.readBody()
+        if re.fullmatch(r'/api/v2/ticket/[^/]+', self.path):
+            if self.injectFaults('ticket'):
+                return
+            sessionId = str(uuid.uuid4())
+            with self.state.lock:
+                self.state.sessions.add(sessionId)
+            return self.sendJson(201, self.sessionResponse(sessionId, {}, [], []))
+        match = re.fullmatch(r'/api/v2/session/([^/]+)/(close|file/upload)', self.path)
+        if match is None or not self.hasSession(match.group(1)):
+            return self.sendJson(404, {'message': 'Unknown session'})
+        if self.injectFaults(match.group(2)):
+            return
+        sessionId = match.group(1)
+        if match.group(2) == 'close':
+            with self.state.lock:
+                self.state.sessions.discard(sessionId)
+            return self.sendJson(200, {})
+        files = {}
+        for paramId in json.loads(body or b'{}'):
+            fileId = str(uuid.uuid4())
+            files[paramId] = {'id': fileId, 'href': f'{self.baseUrl}/upload/{fileId}'}
+        return self.sendJson(200, {'sessionId': sessionId, 'asset': {'file': files}})
+
+    def do_PUT(self):
+        body = self.readBody()
+        match = re.fullmatch(r'/upload/([^/]+)', self.path)
+        if match is not None:
+            if self.injectFaults('upload'):
+                return
+            with self.state.lock:
+                self.state.uploads[match.group(1)] = body
+            return self.sendJson(200, {})
+        match = re.fullmatch(r'/api/v2/session/([^/]+)/(export|output)', self.path)
+        if match is None or not self.hasSession(match.group(1)):
+            return self.sendJson(404, {'message': 'Unknown session'})
+        if self.injectFaults(match.group(2)):
+            return
+        request = json.loads(body or b'{}')
+        if match.group(2) == 'export':
+            parameters = request.get('parameters', {})
+            exportIds = request.get('exports', [])
+            outputIds = request.get('outputs', [])
+        else:
+            parameters = request
+            exportIds = []
+            outputIds = list(OUTPUT_NAMES)
+        return self.sendJson(200, self.sessionResponse(match.group(1), parameters, exportIds, outputIds))
+
+    def hasSession(self, sessionId):
+        with self.state.lock:
+            return sessionId in self.state.sessions
+
+    def sessionResponse(self, sessionId, parameters, exportIds, outputIds):
+        """Session response with content for the requested exports and outputs"""
+
+        key = hashlib.sha256(json.dumps(parameters, sort_keys = True).encode('utf-8')).hexdigest()[:32]
+        if len(exportIds) > 0 or len(outputIds) > 0:
+            with self.state.lock:
+                computed = key in self.state.results
+            if not computed:
+                result = tower_geometry(parameters)
+                with self.state.lock:
+                    self.state.results[key] = result
+
+        exports = {}
+        for name in EXPORT_NAMES:
+            exports[name] = {'id': name, 'name': name}
+            if name in exportIds:
+                exports[name]['content'] = [{'href': f'{self.baseUrl}/assets/{key}/{name}', 'contentType': 'application/json'}]
+        outputs = {}
+        for name in OUTPUT_NAMES:
+            outputs[name] = {'id': name, 'name': name}
+            if name in outputIds:
+                outputs[name]['content'] = [{'href': f'{self.baseUrl}/assets/{key}/{name}', 'contentType': 'model/gltf-binary'}]
+        return {'sessionId': sessionId, 'parameters': PARAMETERS, 'exports': exports, 'outputs': outputs}
+
+
+class ShapeDiverStandInServer(ThreadingHTTPServer):
+    """Threaded stand-in server, use as a context manager to run it in a background thread"""
+
+    daemon_threads = True
+
+    def __init__(self, host = '127.0.0.1', port = 0, **faults):
+        super().__init__((host, port), StandInHandler)
+        self.state = StandInState(**faults)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self._thread = threading.Thread(target = self.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Local stand-in for the ShapeDiver Geometry Backend')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8765)
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds added to every request')
+    parser.add_argument('--latency-jitter', type = float, default = 0.0)
+    parser.add_argument('--throttle-rate', type = float, default = 0.0, help = 'fraction of requests answered with HTTP 429')
+    parser.add_argument('--failure-rate', type = float, default = 0.0, help = 'fraction of requests answered with HTTP 500')
+    args = parser.parse_args()
+
+    server = ShapeDiverStandInServer(args.host, args.port, latency = args.latency, latencyJitter = args.latency_jitter,
+                                     throttleRate = args.throttle_rate, failureRate = args.failure_rate)
+    print(f'ShapeDiver stand-in listening on {server.url}')
+    server.serve_forever()
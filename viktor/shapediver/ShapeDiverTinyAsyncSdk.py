@@ -0,0 +1,305 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from shapediver.ShapeDiverTinySdk import ShapeDiverResponse, retryDelay
+
+
+class AsyncAdaptiveConcurrencyLimiter:
+    """asyncio counterpart of AdaptiveConcurrencyLimiter
+
+    The limit is halved whenever ShapeDiver throttles a request (HTTP 429) and grows back
+    slowly with every successful request.
+    """
+
+    def __init__(self, *, maxConcurrency = 64, minConcurrency = 1):
+        self.maxConcurrency = maxConcurrency
+        self.minConcurrency = minConcurrency
+        self.limit = float(maxConcurrency)
+        self.inFlight = 0
+        self._condition = None
+
+    async def acquire(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.inFlight < int(self.limit))
+            self.inFlight += 1
+
+    async def release(self, *, throttled = False):
+        async with self._condition:
+            self.inFlight -= 1
+            if throttled:
+                self.limit = max(self.minConcurrency, self.limit / 2)
+            else:
+                self.limit = min(self.maxConcurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+class AsyncResponse:
+    """Status, headers and body of a completed request"""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors = 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+class ShapeDiverAsyncHttpTransport:
+    """asyncio counterpart of ShapeDiverHttpTransport
+
+    All requests share one aiohttp connection pool. Requests are retried with exponential
+    backoff on HTTP 429 and 5xx (honoring Retry-After), non-idempotent requests only when they
+    were throttled or provably not sent, and the number of concurrent requests adapts when
+    ShapeDiver throttles. Every request has a connect and read timeout. Must be closed with
+    close() from the event loop it was used in.
+    """
+
+    retryStatusCodes = {429, 500, 502, 503, 504}
+    idempotentMethods = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+    def __init__(self, *, maxRetries = 5, backoffFactor = 0.5, maxBackoff = 30, poolSize = 100, maxConcurrency = 64, timeout = (10, 300)):
+        self.maxRetries = maxRetries
+        self.backoffFactor = backoffFactor
+        self.maxBackoff = maxBackoff
+        self.poolSize = poolSize
+        self.timeout = timeout
+        self.limiter = AsyncAdaptiveConcurrencyLimiter(maxConcurrency = maxConcurrency)
+        self._session = None
+
+    def session(self):
+        if self._session is None:
+            connectTimeout, readTimeout = self.timeout
+            self._session = aiohttp.ClientSession(connector = aiohttp.TCPConnector(limit = self.poolSize),
+                timeout = aiohttp.ClientTimeout(sock_connect = connectTimeout, sock_read = readTimeout))
+        return self._session
+
+    async def request(self, method, url, **kwargs):
+        """Send a request, retrying on throttling, server errors and connection errors"""
+
+        idempotent = method.upper() in self.idempotentMethods
+        # a streamed body can only be sent once, it is passed as a function that returns a new body per attempt
+        bodyFactory = kwargs.pop('data') if callable(kwargs.get('data')) else None
+        attempt = 0
+        while True:
+            response = None
+            throttled = False
+            if bodyFactory is not None:
+                kwargs['data'] = bodyFactory()
+            await self.limiter.acquire()
+            try:
+                async with self.session().request(method, url, **kwargs) as r:
+                    response = AsyncResponse(r.status, r.headers, await r.read())
+                throttled = response.status_code == 429
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # a connector error means the connection was never established, so the request was not sent
+                if attempt >= self.maxRetries or not (idempotent or isinstance(e, aiohttp.ClientConnectorError)):
+                    raise
+            finally:
+                # also on cancellation and payload errors, which would otherwise leak the slot
+                await self.limiter.release(throttled = throttled)
+            if response is not None:
+                retry = response.status_code == 429 or (idempotent and response.status_code in self.retryStatusCodes)
+                if not retry or attempt >= self.maxRetries:
+                    return response
+            await asyncio.sleep(retryDelay(attempt, response, backoffFactor = self.backoffFactor, maxBackoff = self.maxBackoff))
+            attempt += 1
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request('PUT', url, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+class ShapeDiverTinyAsyncSessionSdk:
+    """asyncio counterpart of ShapeDiverTinySessionSdk
+
+    Open sessions with ShapeDiverTinyAsyncSessionSdk.open(...), all requests of all sessions
+    using the same transport share one connection pool. Parameter values of output and export
+    requests are converted by the parameterMapper, a coroutine function called like the
+    parameterMapper of ShapeDiverTinySessionSdk (see ShapeDiverTinySdkViktorUtils.asyncParameterMapper).
+    """
+
+    def __init__(self, *, modelViewUrl, response, transport, parameterMapper = None):
+        self.modelViewUrl = modelViewUrl
+        self.response = response
+        self.transport = transport
+        self.parameterMapper = parameterMapper
+
+    @classmethod
+    async def open(cls, *, modelViewUrl, transport, ticket = None, sessionInitResponse = None, paramDict = {}, parameterMapper = None):
+        """Open a session with a ShapeDiver model
+
+        API documentation: https://sdr7euc1.eu-central-1.shapediver.com/api/v2/docs/#/session/post_api_v2_ticket__ticketId_
+        """
+
+        if sessionInitResponse is not None:
+            return cls(modelViewUrl = modelViewUrl, response = ShapeDiverResponse(sessionInitResponse), transport = transport,
+                parameterMapper = parameterMapper)
+        if ticket is None:
+            raise Exception('Expected (ticket and modelViewUrl) or (sessionInitResponse and modelViewUrl) to be provided')
+
+        endpoint = f'{modelViewUrl}/api/v2/ticket/{ticket}'
+        response = await transport.post(endpoint, data = json.dumps(paramDict), headers = {'Content-Type': 'application/json'})
+        if response.status_code != 201:
+            raise Exception(f'Failed to open session (HTTP status code {response.status_code}): {response.text}')
+        return cls(modelViewUrl = modelViewUrl, response = ShapeDiverResponse(response.json()), transport = transport,
+            parameterMapper = parameterMapper)
+
+    async def mapParameters(self, paramDict):
+        """Convert parameter values with the parameterMapper, if there is one"""
+
+        if self.parameterMapper is None:
+            return paramDict
+        return await self.parameterMapper(paramDict = paramDict, sdk = self)
+
+    async def close(self):
+        """Close the session
+
+        API documentation: https://sdr7euc1.eu-central-1.shapediver.com/api/v2/docs/#/session/post_api_v2_session__sessionId__close
+        """
+
+        endpoint = f'{self.modelViewUrl}/api/v2/session/{self.response.sessionId()}/close'
+        response = await self.transport.post(endpoint)
+        if response.status_code != 200:
+            raise Exception(f'Failed to close session (HTTP status code {response.status_code}): {response.text}')
+
+    async def output(self, *, paramDict = {}):
+        """Request the computation of all outputs
+
+        API documentation: https://sdr7euc1.eu-central-1.shapediver.com/api/v2/docs/#/output/put_api_v2_session__sessionId__output
+        """
+
+        endpoint = f'{self.modelViewUrl}/api/v2/session/{self.response.sessionId()}/output'
+        paramDict = await self.mapParameters(paramDict)
+        response = await self.transport.put(endpoint, data = json.dumps(paramDict), headers = {'Content-Type': 'application/json'})
+        if response.status_code != 200:
+            raise Exception(f'Failed to compute outputs (HTTP status code {response.status_code}): {response.text}')
+        return ShapeDiverResponse(response.json())
+
+    async def export(self, *, paramDict = {}, includeOutputs = False, exportNames = None, outputNames = None):
+        """Request an export, see ShapeDiverTinySessionSdk.export
+
+        API documentation: https://sdr7euc1.eu-central-1.shapediver.com/api/v2/docs/#/export/put_api_v2_session__sessionId__export
+        """
+
+        endpoint = f'{self.modelViewUrl}/api/v2/session/{self.response.sessionId()}/export'
+        body = {'parameters': await self.mapParameters(paramDict)}
+        if exportNames is not None:
+            body['exports'] = self.response.exportIds(exportNames)
+        else:
+            body['exports'] = [export['id'] for export in self.response.exports()]
+        if outputNames is not None:
+            body['outputs'] = self.response.outputIds(outputNames)
+        elif includeOutputs:
+            body['outputs'] = [output['id'] for output in self.response.outputs()]
+        response = await self.transport.put(endpoint, data = json.dumps(body), headers = {'Content-Type': 'application/json'})
+        if response.status_code != 200:
+            raise Exception(f'Failed to compute export (HTTP status code {response.status_code}): {response.text}')
+        return ShapeDiverResponse(response.json())
+
+    async def requestFileUpload(self, *, requestBody = {}):
+        """Request the upload of a file for a parameter of type 'File'
+
+        API documentation: https://sdr7euc1.eu-central-1.shapediver.com/api/v2/docs/#/file/post_api_v2_session__sessionId__file_upload
+        """
+
+        endpoint = f'{self.modelViewUrl}/api/v2/session/{self.response.sessionId()}/file/upload'
+        response = await self.transport.post(endpoint, data = json.dumps(requestBody), headers = {'Content-Type': 'application/json'})
+        if response.status_code != 200:
+            raise Exception(f'Failed to request file upload (HTTP status code {response.status_code}): {response.text}')
+        return ShapeDiverResponse(response.json())
+
+    async def uploadFile(self, *, paramId, data, contentType, size = None):
+        """Upload a file for a parameter of type 'File' and return the id to use as parameter value
+
+        data is either bytes or, to stream the file, a function that returns an async iterator of
+        chunks, which requires the size.
+        """
+
+        if size is None:
+            size = len(data)
+        body = {paramId: {'size': size, 'format': contentType}}
+        uploadResponse = (await self.requestFileUpload(requestBody = body)).assetFile(paramId)
+        headers = {
+            'Content-Type': contentType,
+            'Content-Length': str(size)
+        }
+        response = await self.transport.put(uploadResponse['href'], data = data, headers = headers)
+        if response.status_code != 200:
+            raise Exception(f'Failed to put file (HTTP status code {response.status_code}): {response.text}')
+        return uploadResponse['id']
+
+    async def fetchAsset(self, href):
+        """Download the content of an output or export asset"""
+
+        response = await self.transport.get(href)
+        if response.status_code != 200:
+            raise Exception(f'Failed to download asset (HTTP status code {response.status_code}): {response.text}')
+        return response.content
+
+class ShapeDiverAsyncSessionPool:
+    """Bounded pool of async sessions with a ShapeDiver model
+
+    Sessions are opened lazily up to maxSize and shared by all tasks of one event loop. Like
+    ShapeDiverSessionPool, sessions that raised an error while borrowed are closed instead of
+    being returned to the pool.
+    """
+
+    def __init__(self, *, ticket, modelViewUrl, transport, maxSize = 8, parameterMapper = None):
+        self.ticket = ticket
+        self.modelViewUrl = modelViewUrl
+        self.transport = transport
+        self.maxSize = maxSize
+        self.parameterMapper = parameterMapper
+        self._sessions = []
+        self._idle = []
+        self._slots = None
+
+    @asynccontextmanager
+    async def borrow(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.maxSize)
+        async with self._slots:
+            if self._idle:
+                sdk = self._idle.pop()
+            else:
+                sdk = await ShapeDiverTinyAsyncSessionSdk.open(ticket = self.ticket, modelViewUrl = self.modelViewUrl,
+                    transport = self.transport, parameterMapper = self.parameterMapper)
+                self._sessions.append(sdk)
+            try:
+                yield sdk
+            except BaseException:
+                self._sessions.remove(sdk)
+                await self._close(sdk)
+                raise
+            self._idle.append(sdk)
+
+    async def close(self):
+        """Close all sessions of the pool"""
+
+        sessions, self._sessions = self._sessions, []
+        self._idle = []
+        await asyncio.gather(*[self._close(sdk) for sdk in sessions])
+
+    async def _close(self, sdk):
+        try:
+            await sdk.close()
+        except Exception:
+            # The session might already have expired on the server
+            pass
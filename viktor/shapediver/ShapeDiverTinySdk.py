@@ -1,5 +1,12 @@
 import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
 fileEndingToContentTypeMap = {
     "svg": "image/svg+xml",
@@ -114,17 +121,186 @@ def RgbToShapeDiverColor(r, g, b):
 def flatten_nested_list(nested_list):
     return [item for sublist in nested_list for item in (flatten_nested_list(sublist) if isinstance(sublist, list) else [sublist])]
 
+def retryDelay(attempt, response = None, *, backoffFactor = 0.5, maxBackoff = 30):
+    """Delay in seconds before retrying a request
+
+    Honors the Retry-After header of the response (seconds or HTTP date), otherwise 
+    uses exponential backoff with jitter.
+    """
+
+    retryAfter = response.headers.get('Retry-After') if response is not None else None
+    if retryAfter:
+        try:
+            return min(maxBackoff, max(0.0, float(retryAfter)))
+        except ValueError:
+            try:
+                return min(maxBackoff, max(0.0, parsedate_to_datetime(retryAfter).timestamp() - time.time()))
+            except (TypeError, ValueError):
+                pass
+    return min(maxBackoff, backoffFactor * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def wasNotSent(error):
+    """Whether a failed request provably never reached the server (the connection could not be established)"""
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+class AdaptiveConcurrencyLimiter:
+    """Limits the number of concurrent requests to ShapeDiver
+
+    The limit is halved whenever ShapeDiver throttles a request (HTTP 429) and grows back 
+    slowly with every successful request (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, *, maxConcurrency = 16, minConcurrency = 1):
+        self.maxConcurrency = maxConcurrency
+        self.minConcurrency = minConcurrency
+        self.limit = float(maxConcurrency)
+        self.inFlight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.inFlight >= int(self.limit):
+                self._condition.wait()
+            self.inFlight += 1
+
+    def release(self, *, throttled = False):
+        with self._condition:
+            self.inFlight -= 1
+            if throttled:
+                self.limit = max(self.minConcurrency, self.limit / 2)
+            else:
+                self.limit = min(self.maxConcurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+class ShapeDiverHttpTransport:
+    """Shared HTTP transport for requests to ShapeDiver Geometry Backend systems
+
+    Uses a pooled session with keep-alive connections, retries requests with exponential 
+    backoff on HTTP 429 and 5xx (honoring Retry-After) and adapts the number of concurrent 
+    requests when ShapeDiver throttles. Non-idempotent requests (POST, e.g. opening a session) 
+    are only retried when they were throttled or provably not sent. Every request has a 
+    (connect, read) timeout, so a stalled connection fails instead of blocking forever.
+    """
+
+    retryStatusCodes = {429, 500, 502, 503, 504}
+    idempotentMethods = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+    def __init__(self, *, maxRetries = 5, backoffFactor = 0.5, maxBackoff = 30, poolSize = 32, maxConcurrency = 16, timeout = (10, 300)):
+        self.maxRetries = maxRetries
+        self.backoffFactor = backoffFactor
+        self.maxBackoff = maxBackoff
+        self.timeout = timeout
+        self.limiter = AdaptiveConcurrencyLimiter(maxConcurrency = maxConcurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = poolSize, pool_maxsize = poolSize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def retryDelay(self, attempt, response = None):
+        """Delay before the next attempt, taken from Retry-After if present"""
+
+        return retryDelay(attempt, response, backoffFactor = self.backoffFactor, maxBackoff = self.maxBackoff)
+
+    def request(self, method, url, **kwargs):
+        """Send a request, retrying on throttling, server errors and connection errors"""
+
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method.upper() in self.idempotentMethods
+        # file-like bodies are streamed, rewind them before retrying
+        body = kwargs.get('data')
+        bodyPosition = body.tell() if hasattr(body, 'seek') and hasattr(body, 'tell') else None
+        attempt = 0
+        while True:
+            response = None
+            if bodyPosition is not None:
+                body.seek(bodyPosition)
+            throttled = False
+            self.limiter.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+                throttled = response.status_code == 429
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.maxRetries or not (idempotent or wasNotSent(e)):
+                    raise
+            finally:
+                # also on other errors and interrupts, which would otherwise leak the slot
+                self.limiter.release(throttled = throttled)
+            if response is not None:
+                retry = response.status_code == 429 or (idempotent and response.status_code in self.retryStatusCodes)
+                if not retry or attempt >= self.maxRetries:
+                    return response
+            time.sleep(self.retryDelay(attempt, response))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+"""Transport shared by all sessions of this process"""
+defaultTransport = ShapeDiverHttpTransport()
+
 class ShapeDiverResponse:
     """Wrapper for response objects from ShapeDiver Geometry Backend systems
 
+    Responses given as JSON text are only parsed when they are first accessed. Lookups by
+    export name, export id and content type use indexes that are built once, on first use.
+
     See API documentation: https://sdr7euc1.eu-central-1.shapediver.com/api/v2/docs/
     """
 
     def __init__(self, response):
-        if isinstance(response, str):
-            self.response = json.loads(response)
+        if isinstance(response, (str, bytes)):
+            self._text = response
+            self._response = None
         else:
-            self.response = response
+            self._text = None
+            self._response = response
+        self._indexes = {}
+
+    @property
+    def response(self):
+        """Parsed response"""
+
+        if self._response is None:
+            self._response = json.loads(self._text)
+            self._text = None
+        return self._response
+
+    def _index(self, name, build):
+        if name not in self._indexes:
+            self._indexes[name] = build()
+        return self._indexes[name]
+
+    def _exportsByName(self):
+        def build():
+            index = {}
+            for value in self.exports():
+                index.setdefault(value['name'], []).append(value)
+            return index
+        return self._index('exportsByName', build)
+
+    def _exportContentItemsByName(self):
+        def build():
+            return {name: flatten_nested_list([export.get('content', []) for export in exports]) 
+                for (name, exports) in self._exportsByName().items()}
+        return self._index('exportContentItemsByName', build)
+
+    def _outputContentItemsByType(self):
+        def build():
+            index = {}
+            for item in self.outputContentItems():
+                index.setdefault(item.get('contentType'), []).append(item)
+            return index
+        return self._index('outputContentItemsByType', build)
 
     def parameters(self):
         """Parameter definitions
@@ -132,7 +308,7 @@ class ShapeDiverResponse:
         Look for ResponseParameter in the API documentation.
         """
 
-        return [value for (key, value) in self.response['parameters'].items()]
+        return self._index('parameters', lambda: list(self.response['parameters'].values()))
 
     def outputs(self):
         """Output definitions and results
@@ -140,7 +316,7 @@ class ShapeDiverResponse:
         Look for ResponseOutput in the API documentation.
         """
 
-        return [value for (key, value) in self.response['outputs'].items()]
+        return self._index('outputs', lambda: list(self.response['outputs'].values()))
        
     def outputContentItems(self):
         """Content resulting from outputs
@@ -148,7 +324,16 @@ class ShapeDiverResponse:
         Look for ResponseOutputContent in the API documentation.
         """
 
-        return flatten_nested_list([outputs['content'] for outputs in self.outputs()])
+        return self._index('outputContentItems', 
+            lambda: flatten_nested_list([outputs.get('content', []) for outputs in self.outputs()]))
+
+    def outputContentItemsByType(self, contentType):
+        """Content of the given content type resulting from outputs
+
+        Look for ResponseOutputContent in the API documentation.
+        """
+
+        return self._outputContentItemsByType().get(contentType, [])
 
     def outputContentItemsGltf2(self):
         """glTF 2 content resulting from outputs
@@ -156,7 +341,7 @@ class ShapeDiverResponse:
         Look for ResponseOutputContent in the API documentation.
         """
 
-        return [item for item in self.outputContentItems() if item['contentType'] == 'model/gltf-binary']
+        return self.outputContentItemsByType('model/gltf-binary')
 
     def exports(self, *, exportName = None):
         """Export definitions and results
@@ -165,9 +350,17 @@ class ShapeDiverResponse:
         """
 
         if exportName is not None:
-            return [value for (key, value) in self.response['exports'].items() if value['name'] == exportName]
+            return self._exportsByName().get(exportName, [])
         else:
-            return [value for (key, value) in self.response['exports'].items()]
+            return self._index('exports', lambda: list(self.response['exports'].values()))
+
+    def export(self, exportId):
+        """Export definition and result of the export with the given id
+
+        Look for ResponseExport in the API documentation.
+        """
+
+        return self._index('exportsById', lambda: {value['id']: value for value in self.exports()})[exportId]
     
     def exportContentItems(self, *, exportName = None):
         """Content resulting from exports
@@ -175,8 +368,23 @@ class ShapeDiverResponse:
         Look for ResponseExportContent in the API documentation.
         """
 
-        return flatten_nested_list([exports['content'] for exports in self.exports(exportName = exportName)])
+        if exportName is not None:
+            return self._exportContentItemsByName().get(exportName, [])
+        return self._index('exportContentItems', 
+            lambda: flatten_nested_list([exports.get('content', []) for exports in self.exports()]))
     
+    def exportIds(self, exportNames):
+        """Ids of the exports with the given names"""
+
+        idsByName = self._index('exportIdsByName', lambda: {value['name']: value['id'] for value in self.exports()})
+        return resolveIds(idsByName, exportNames, 'export')
+
+    def outputIds(self, outputNames):
+        """Ids of the outputs with the given names"""
+
+        idsByName = self._index('outputIdsByName', lambda: {value['name']: value['id'] for value in self.outputs()})
+        return resolveIds(idsByName, outputNames, 'output')
+
     def sessionId(self):
         """Id of the session"""
 
@@ -190,6 +398,14 @@ class ShapeDiverResponse:
 
         return self.response['asset']['file'][paramId]
     
+def resolveIds(idsByName, names, kind):
+    """Resolve names of exports or outputs to their ids using a name index"""
+
+    missing = [name for name in names if name not in idsByName]
+    if len(missing) > 0:
+        raise Exception(f'Unknown {kind} name(s): {", ".join(missing)}')
+    return [idsByName[name] for name in names]
+
 def ExceptionHandler(func):
     """Decorator for activating the exception handler"""
     def decorate(*args, **kwargs):
@@ -223,14 +439,16 @@ class ShapeDiverTinySessionSdk:
     """
 
     @ExceptionHandler
-    def __init__(self, *, modelViewUrl, ticket=None, sessionInitResponse=None, paramDict={}, exceptionHandler=None, parameterMapper=None):
+    def __init__(self, *, modelViewUrl, ticket=None, sessionInitResponse=None, paramDict={}, exceptionHandler=None, parameterMapper=None, transport=None):
         """Open a session with a ShapeDiver model
         
         Parameter values can optionally be included in the session init request.
+        Requests are sent through the given transport, or the shared defaultTransport.
         API documentation: https://sdr7euc1.eu-central-1.shapediver.com/api/v2/docs/#/session/post_api_v2_ticket__ticketId_
         """
 
         self.modelViewUrl = modelViewUrl
+        self.transport = transport if transport is not None else defaultTransport
 
         if exceptionHandler is not None:
             self.exceptionHandler = exceptionHandler
@@ -247,12 +465,10 @@ class ShapeDiverTinySessionSdk:
             headers = {
                 'Content-Type': 'application/json'
             }
-            response = requests.post(endpoint, data=jsonBody, headers=headers)
+            response = self.transport.post(endpoint, data=jsonBody, headers=headers)
             if response.status_code != 201:
                 raise Exception(f'Failed to open session (HTTP status code {response.status_code}): {response.text}')
 
-            # TODO: handle rate-limiting and delay
-
             """Parsed response of the session init request"""
             self.response = ShapeDiverResponse(response.json())
         else:
@@ -266,7 +482,7 @@ class ShapeDiverTinySessionSdk:
         """
 
         endpoint = f'{self.modelViewUrl}/api/v2/session/{self.response.sessionId()}/close'
-        response = requests.post(endpoint);
+        response = self.transport.post(endpoint)
         if response.status_code != 200:
             raise Exception(f'Failed to close session (HTTP status code {response.status_code}): {response.text}')
 
@@ -283,38 +499,41 @@ class ShapeDiverTinySessionSdk:
         headers = {
             'Content-Type': 'application/json'
         }
-        response = requests.put(endpoint, data=jsonBody, headers=headers)
+        response = self.transport.put(endpoint, data=jsonBody, headers=headers)
         if response.status_code != 200:
             raise Exception(f'Failed to compute outputs (HTTP status code {response.status_code}): {response.text}')
 
-        # TODO: handle rate-limiting and delay
-
         return ShapeDiverResponse(response.json())
 
     @ExceptionHandler
     @ParameterMapper
-    def export(self, *, paramDict = {}, includeOutputs = False):
+    def export(self, *, paramDict = {}, includeOutputs = False, exportNames = None, outputNames = None):
         """Request an export
 
+        By default all exports are requested, pass exportNames to only request the named exports.
+        Outputs are only computed if includeOutputs is set (all outputs) or outputNames are given.
         API documentation: https://sdr7euc1.eu-central-1.shapediver.com/api/v2/docs/#/export/put_api_v2_session__sessionId__export
         """
 
         endpoint = f'{self.modelViewUrl}/api/v2/session/{self.response.sessionId()}/export'
         body = {'parameters': paramDict}
-        body['exports'] = [export['id'] for export in self.response.exports()]
-        if includeOutputs:
+        if exportNames is not None:
+            body['exports'] = self.response.exportIds(exportNames)
+        else:
+            body['exports'] = [export['id'] for export in self.response.exports()]
+        if outputNames is not None:
+            body['outputs'] = self.response.outputIds(outputNames)
+        elif includeOutputs:
             body['outputs'] = [output['id'] for output in self.response.outputs()]
         print(str(body))
         jsonBody = json.dumps(body)
         headers = {
             'Content-Type': 'application/json'
         }
-        response = requests.put(endpoint, data=jsonBody, headers=headers)
+        response = self.transport.put(endpoint, data=jsonBody, headers=headers)
         if response.status_code != 200:
             raise Exception(f'Failed to compute export (HTTP status code {response.status_code}): {response.text}')
 
-        # TODO: handle rate-limiting and delay
-
         return ShapeDiverResponse(response.json())
     
     @ExceptionHandler
@@ -329,11 +548,9 @@ class ShapeDiverTinySessionSdk:
         headers = {
             'Content-Type': 'application/json'
         }
-        response = requests.post(endpoint, data=jsonBody, headers=headers)
+        response = self.transport.post(endpoint, data=jsonBody, headers=headers)
         if response.status_code != 200:
             raise Exception(f'Failed to request file upload (HTTP status code {response.status_code}): {response.text}')
 
-        # TODO: handle rate-limiting and delay
-
         return ShapeDiverResponse(response.json())
     
\ No newline at end of file
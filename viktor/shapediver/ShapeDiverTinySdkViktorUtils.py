@@ -1,9 +1,23 @@
 from viktor.utils import memoize
 from viktor import UserError, UserMessage
+import asyncio
+import atexit
+import hashlib
 import json
-import requests
+import threading
+import time
 
 from shapediver.ShapeDiverTinySdk import ShapeDiverTinySessionSdk, RgbToShapeDiverColor, mapFileEndingToContentType
+from shapediver.ShapeDiverSessionPool import ShapeDiverSessionPool
+
+__sessionPools = {}
+__sessionPoolsLock = threading.Lock()
+
+# Ids of uploaded files, keyed by (modelViewUrl, parameter id, hash of file contents)
+__uploadedFileIds = {}
+__uploadedFileIdsLock = threading.Lock()
+UPLOADED_FILE_ID_TTL = 3600 # seconds an uploaded file id is reused
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 
 def exceptionHandler(e):
@@ -32,48 +46,116 @@ def parameterMapper(*, paramDict, sdk):
     This is used to map special value types like Color or File.
     """
 
+    return mapParameters(paramDict, sdk, lambda paramId, value: uploadFileMemoized(sdk, paramId, value))
+
+async def asyncParameterMapper(*, paramDict, sdk):
+    """parameterMapper for ShapeDiverTinyAsyncSessionSdk, files are uploaded on the event loop"""
+
+    fileIds = {}
+    for (paramId, value) in paramDict.items():
+        if value is not None and getParameterType(sdk, paramId) == 'File':
+            fileIds[paramId] = await uploadFileMemoizedAsync(sdk, paramId, value)
+    return mapParameters(paramDict, sdk, lambda paramId, value: fileIds[paramId])
+
+def getParameterType(sdk, paramId):
+    paramDef = sdk.response.response['parameters'].get(paramId)
+    return paramDef['type'] if paramDef is not None else None
+
+def mapParameters(paramDict, sdk, uploadFile):
+    """Map VIKTOR parameter values to ShapeDiver, uploadFile(paramId, value) returns the id of an uploaded file"""
+
     paramDictSd = {}
     paramIds = [key for (key, value) in paramDict.items()]
     for paramId in paramIds:
         value = paramDict[paramId]
         if value is None:
             continue
-        if paramId in sdk.response.response['parameters']:
-            paramDef = sdk.response.response['parameters'][paramId]
-            if paramDef['type'] == 'Color':
-                color = value
-                paramDictSd[paramId] = RgbToShapeDiverColor(color.r, color.g, color.b)
-            elif paramDef['type'] == 'File':
-                # See Viktor FileField and File object
-                # https://docs.viktor.ai/sdk/api/parametrization/#FileField
-                # https://docs.viktor.ai/sdk/api/core/#_File
-                # Note: Reading the whole file into memory, like done in the following, 
-                #       might cause problems in case of big files.
-                fileBinaryContent = value.file.getvalue_binary()
-                # request file upload to ShapeDiver Geometry Backend
-                # we simply use the first allowed content-type (mapping of file ending to content-type to be implemented)
-                body = {}
-                body[paramId] = {}
-                body[paramId]['size'] = len(fileBinaryContent)
-                body[paramId]['format'] = mapFileEndingToContentType(value.filename)
-                uploadResponse = sdk.requestFileUpload(requestBody = body).assetFile(paramId)
-                # upload the file
-                headers = {
-                    'Content-Type': body[paramId]['format']
-                }
-                response = requests.put(uploadResponse['href'], data=fileBinaryContent, headers=headers)
-                if response.status_code != 200:
-                    raise Exception(f'Failed to put file (HTTP status code {response.status_code}): {response.text}')
-                # set parameter value to id of uploaded file
-                paramDictSd[paramId] = uploadResponse['id']
-                # TODO memoize id of uploaded file based on hash of file contents and parameter id
-            else:
-                paramDictSd[paramId] = value
+        paramType = getParameterType(sdk, paramId)
+        if paramType == 'Color':
+            color = value
+            paramDictSd[paramId] = RgbToShapeDiverColor(color.r, color.g, color.b)
+        elif paramType == 'File':
+            # See Viktor FileField and File object
+            # https://docs.viktor.ai/sdk/api/parametrization/#FileField
+            # https://docs.viktor.ai/sdk/api/core/#_File
+            paramDictSd[paramId] = uploadFile(paramId, value)
         else:
             paramDictSd[paramId] = value
 
     return paramDictSd
 
+def hashFileContents(file):
+    """SHA-256 and size of a VIKTOR File, read in chunks"""
+
+    digest = hashlib.sha256()
+    size = 0
+    with file.open_binary() as binaryFile:
+        for chunk in iter(lambda: binaryFile.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+async def readFileChunksAsync(file):
+    """Async iterator of the chunks of a VIKTOR File, read off the event loop"""
+
+    binaryFile = await asyncio.to_thread(file.open_binary)
+    try:
+        while chunk := await asyncio.to_thread(binaryFile.read, UPLOAD_CHUNK_SIZE):
+            yield chunk
+    finally:
+        binaryFile.close()
+
+def uploadFileMemoized(sdk, paramId, fileResource):
+    """Upload the file of a File parameter and return the id of the uploaded file
+
+    Uploads are de-duplicated by the hash of the file contents and the parameter id,
+    the id of an earlier upload is reused as long as it is valid. The file is streamed
+    from disk instead of being read into memory.
+    """
+
+    contentHash, size = hashFileContents(fileResource.file)
+    key = (sdk.modelViewUrl, paramId, contentHash)
+    with __uploadedFileIdsLock:
+        uploaded = __uploadedFileIds.get(key)
+    if uploaded is not None and time.monotonic() - uploaded[1] < UPLOADED_FILE_ID_TTL:
+        return uploaded[0]
+
+    # request file upload to ShapeDiver Geometry Backend
+    contentType = mapFileEndingToContentType(fileResource.filename)
+    body = {paramId: {'size': size, 'format': contentType}}
+    uploadResponse = sdk.requestFileUpload(requestBody = body).assetFile(paramId)
+    # upload the file
+    headers = {
+        'Content-Type': contentType,
+        'Content-Length': str(size)
+    }
+    with fileResource.file.open_binary() as binaryFile:
+        response = sdk.transport.put(uploadResponse['href'], data=binaryFile, headers=headers)
+    if response.status_code != 200:
+        raise Exception(f'Failed to put file (HTTP status code {response.status_code}): {response.text}')
+
+    with __uploadedFileIdsLock:
+        __uploadedFileIds[key] = (uploadResponse['id'], time.monotonic())
+    return uploadResponse['id']
+
+async def uploadFileMemoizedAsync(sdk, paramId, fileResource):
+    """uploadFileMemoized for ShapeDiverTinyAsyncSessionSdk, ids of uploaded files are shared with it"""
+
+    # hashing reads the whole file, which would block the event loop
+    contentHash, size = await asyncio.to_thread(hashFileContents, fileResource.file)
+    key = (sdk.modelViewUrl, paramId, contentHash)
+    with __uploadedFileIdsLock:
+        uploaded = __uploadedFileIds.get(key)
+    if uploaded is not None and time.monotonic() - uploaded[1] < UPLOADED_FILE_ID_TTL:
+        return uploaded[0]
+
+    fileId = await sdk.uploadFile(paramId = paramId, data = lambda: readFileChunksAsync(fileResource.file), size = size,
+        contentType = mapFileEndingToContentType(fileResource.filename))
+
+    with __uploadedFileIdsLock:
+        __uploadedFileIds[key] = (fileId, time.monotonic())
+    return fileId
+
 def ShapeDiverTinySessionSdkMemoized(ticket, modelViewUrl, forceNewSession=False):
     """Memoized version of ShapeDiverTinySessionSdk
     
@@ -90,3 +172,20 @@ def ShapeDiverTinySessionSdkMemoized(ticket, modelViewUrl, forceNewSession=False
             exceptionHandler = exceptionHandler, parameterMapper = parameterMapper)
     return sdk
 
+def ShapeDiverSessionPoolShared(ticket, modelViewUrl, maxSize=8):
+    """Process-wide pool of sessions for the given model
+
+    Use this to borrow a warm session per computation instead of opening a new session:
+
+        with ShapeDiverSessionPoolShared(ticket, modelViewUrl).borrow() as sdk:
+            result = sdk.export(paramDict = parameters)
+    """
+
+    key = (ticket, modelViewUrl)
+    with __sessionPoolsLock:
+        if key not in __sessionPools:
+            pool = ShapeDiverSessionPool(lambda: ShapeDiverTinySessionSdkMemoized(ticket, modelViewUrl, forceNewSession = True), 
+                maxSize = maxSize)
+            atexit.register(pool.close)
+            __sessionPools[key] = pool
+        return __sessionPools[key]
@@ -0,0 +1,155 @@
+"""
+Core wall sizing of sweep samples
+
+Every design point of a Global Optimization sweep derives its story forces from its floor elevations and areas
+with the equivalent lateral force distribution of seismic.get_asce7_seismic_loads, on a spectrum that is fetched
+from USGS once per sweep, and sizes its core with structural.evol_algo. The sizing is CPU bound, so it runs on a
+pool of processes next to the I/O bound ShapeDiver evaluations. The spectrum is published to the workers once per
+sweep and the floors of every sample as a shared block (see structural.shared_building), the story forces are
+derived in the worker.
+"""
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from seismic import get_asce7_seismic_loads as seismic
+from structural import evol_algo
+from structural.shared_building import SharedBuilding, attach_building, detach_building, get_building_arrays
+
+CORE_POPULATION_SIZE = 200 # individuals of the sizing of a sweep sample, a multiple of 4
+CORE_GENERATIONS = 40 # generations of the sizing of a sweep sample
+
+
+def get_design_spectrum(latitude, longitude, code, risk_category, site_class, spectrum_type=None):
+    """
+    Fetch the spectrum used by get_seismic_force from USGS
+
+    Returns:
+    - tuple: (periods, accelerations) as lists
+    """
+    seismic_spectra = seismic.fetch_usgs_data(latitude, longitude, code, risk_category, site_class)
+    if seismic_spectra is None:
+        raise ValueError(f'No USGS design spectrum for code {code} at ({latitude}, {longitude})')
+    spectrum_df = seismic.get_spectrum(seismic_spectra, spectrum_type)
+    return spectrum_df['period'].tolist(), spectrum_df['acceleration'].tolist()
+
+
+def get_story_forces(floors, spectrum, dead_load, live_load, r_value):
+    """
+    Story forces of a building from its floors
+
+    Parameters:
+    - floors (list): [{"elevation": z, "area": area}, ...] as in BUILDING_FLOOR_ELV_AREA, the ground floor is ignored
+    - spectrum (tuple): (periods, accelerations), see get_design_spectrum
+    - dead_load, live_load (float): design loads in psf
+    - r_value (float): seismic response coefficient
+
+    Returns:
+    - dict: story forces by elevation in ascending order, starting with 0 at the ground floor
+    """
+    story_data = sorted([[floor['elevation'], floor['area']] for floor in floors if floor['elevation'] > 0], reverse=True)
+    if len(story_data) == 0:
+        return {0: 0}
+    periods, accelerations = spectrum
+    story_seismic_loads_dict = seismic.distribute_seismic_force(story_data, dead_load, live_load, r_value, periods, accelerations)[0]
+    return {0: 0, **dict(sorted(story_seismic_loads_dict.items()))}
+
+
+def size_core(story_forces, min_wall_thickness, max_wall_thickness, min_wall_length, max_wall_length, seed=None,
+              population_size=CORE_POPULATION_SIZE, generations=CORE_GENERATIONS):
+    """
+    Size the core for story forces with evol_algo.evolutionary_optimizer, runs in a worker process
+
+    Returns:
+    - dict: the best_result of evolutionary_optimizer
+    """
+    # the optimizer prints every result, which would flood the output of the worker processes
+    with contextlib.redirect_stdout(io.StringIO()):
+        best_result, data = evol_algo.evolutionary_optimizer(
+            story_forces, min_wall_thickness, max_wall_thickness, min_wall_length, max_wall_length,
+            population_size=population_size, generations=generations, seed=seed)
+    return best_result
+
+
+def size_published_core(site_handle, building_handle, loads, wall_limits, seed=None):
+    """
+    Size the core of a published building, runs in a worker process
+
+    Parameters:
+    - site_handle (SharedBuildingHandle): the periods and accelerations of the spectrum, attached for the life of the worker
+    - building_handle (SharedBuildingHandle): the story_elevations and story_areas of the building
+    - loads (tuple): dead_load, live_load, r_value
+    - wall_limits (tuple): min_wall_thickness, max_wall_thickness, min_wall_length, max_wall_length
+    """
+    site = attach_building(site_handle)
+    building = attach_building(building_handle)
+    try:
+        floors = [{'elevation': float(z), 'area': float(area)} for (z, area) in zip(building['story_elevations'], building['story_areas'])]
+    finally:
+        detach_building(building_handle)
+    story_forces = get_story_forces(floors, (site['periods'], site['accelerations']), *loads)
+    return size_core(story_forces, *wall_limits, seed=seed)
+
+
+def get_core_carbon(best_result):
+    """
+    Embodied carbon of a sized core in tonnes CO2
+    """
+    return (best_result['Concrete Embodied Carbon'] + best_result['Reinforcement Embodied Carbon']) / 1000
+
+
+def get_seed(point):
+    """
+    Seed of the sizing of a design point, so that a point always gets the same core
+    """
+    return zlib.crc32(repr(sorted(point.items())).encode('utf-8'))
+
+
+class CoreSizingPool:
+    """
+    Pool of worker processes that size cores for the samples of a sweep
+
+    Processes are started with spawn, forking a process that runs ShapeDiver threads and an event loop is unsafe.
+    """
+
+    def __init__(self, wall_limits, spectrum, loads, max_workers=None):
+        """
+        Parameters:
+        - wall_limits (tuple): min_wall_thickness, max_wall_thickness, min_wall_length, max_wall_length
+        - spectrum (tuple): (periods, accelerations), see get_design_spectrum
+        - loads (tuple): dead_load, live_load, r_value in psf, psf and -
+        - max_workers (int): number of processes, the number of CPUs by default
+        """
+        self.wall_limits = tuple(wall_limits)
+        self.loads = tuple(loads)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        periods, accelerations = spectrum
+        self._site = SharedBuilding({'periods': np.asarray(periods, dtype=float), 'accelerations': np.asarray(accelerations, dtype=float)})
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    async def size(self, floors, seed=None):
+        """
+        Size the core of a building in a worker process without blocking the event loop
+
+        Parameters:
+        - floors (list): [{"elevation": z, "area": area}, ...] as in BUILDING_FLOOR_ELV_AREA
+        """
+        with SharedBuilding(get_building_arrays(floors=floors)) as building:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, size_published_core, self._site.handle, building.handle, self.loads, self.wall_limits, seed)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._site.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,6 +1,9 @@
-def evolutionary_optimizer(story_force_dictionary, min_wall_thickness, max_wall_thickness, min_wall_length, max_wall_length):
+def evolutionary_optimizer(story_force_dictionary, min_wall_thickness, max_wall_thickness, min_wall_length, max_wall_length,
+                           population_size=1000, generations=100, seed=None):
     '''
     Input: story_force_dictionary - dictionary of story forces, with keys as story elevations and values as story forces
+    population_size, generations - size of the search, smaller values trade quality for speed (e.g. inside sweeps)
+    seed - seed of the random generator, None for a different result every run
     Output: optimized_section_dictionary - dictionary of core section, with keys as story elevations and values as core dimensions [length, thickness, reinforcement_ratio]
     '''
 
@@ -10,11 +13,14 @@ def evolutionary_optimizer(story_force_dictionary, min_wall_thickness, max_wall_
     from viktor.core import Storage
     from viktor.views import DataGroup, DataItem
 
+    if seed is not None:
+        random = random.Random(seed)
+
     # Constants
-    POPULATION_SIZE = 1000 # Number of individuals in the population
+    POPULATION_SIZE = population_size # Number of individuals in the population
     MUTATION_RATE = 0.05 # Probability of mutation
     CROSSOVER_RATE = 0.9 # Probability of crossover
-    GENERATIONS = 100 # Number of generations to run the algorithm
+    GENERATIONS = generations # Number of generations to run the algorithm
     LENGTH_MIN = min_wall_length  # Core Length min ft
     LENGTH_MAX = max_wall_length  # Core Length max ft
     THICKNESS_MIN = min_wall_thickness  # Core thickness min ft
@@ -0,0 +1,158 @@
+"""
+Building arrays shared with worker processes
+
+A building is published once as flat NumPy arrays in one multiprocessing.shared_memory block: the (n, 3) node
+coordinates and (m, 2) beam and column node indices of BUILDING_STRUCTURE, the story elevations and areas of
+BUILDING_FLOOR_ELV_AREA and, when known, story forces and core sections. Tasks only carry the small picklable
+SharedBuildingHandle, workers attach zero-copy read-only views by name instead of unpickling node lists, story
+force dicts and section dicts per task.
+"""
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+ALIGNMENT = 64 # byte alignment of every array in the block
+_attached = {} # shared memory blocks attached by this process, by name
+
+
+class SharedBuildingHandle:
+    """
+    Name and layout of a published building, {array name: (offset, shape, dtype)}
+    """
+
+    def __init__(self, name, layout):
+        self.name = name
+        self.layout = layout
+
+
+class SharedBuilding:
+    """
+    Owner of a published building, the block is removed when the building is closed
+
+    Use as a context manager, or call close() when the workers are done with it.
+    """
+
+    def __init__(self, arrays):
+        """
+        Parameters:
+        - arrays (dict): {name: array}, see get_building_arrays
+        """
+        arrays = {name: np.ascontiguousarray(array) for (name, array) in arrays.items()}
+        layout = {}
+        size = 0
+        for (name, array) in arrays.items():
+            layout[name] = (size, array.shape, array.dtype.str)
+            size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        self._memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for (name, array) in arrays.items():
+            get_view(self._memory, layout[name])[...] = array
+        self.handle = SharedBuildingHandle(self._memory.name, layout)
+
+    @property
+    def name(self):
+        return self.handle.name
+
+    def close(self):
+        if self._memory is not None:
+            detach_building(self.handle)
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_view(memory, layout_entry):
+    offset, shape, dtype = layout_entry
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=memory.buf, offset=offset)
+
+
+def attach_building(handle):
+    """
+    Read-only views of the arrays of a published building, the block stays attached for the life of the process
+
+    Returns:
+    - dict: {name: numpy.ndarray}
+    """
+    memory = _attached.get(handle.name)
+    if memory is None:
+        if sys.version_info >= (3, 13):
+            memory = shared_memory.SharedMemory(name=handle.name, track=False)
+        else:
+            # before 3.13 attaching registers the block again, with the resource tracker that spawned workers share
+            # with the owner; the tracker keeps one registration per name and the owner unregisters it on unlink
+            memory = shared_memory.SharedMemory(name=handle.name)
+        _attached[handle.name] = memory
+    arrays = {}
+    for (name, layout_entry) in handle.layout.items():
+        array = get_view(memory, layout_entry)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays
+
+
+def detach_building(handle):
+    """
+    Detach a building from this process, views of it must not be used afterwards
+    """
+    memory = _attached.pop(handle.name, None)
+    if memory is not None:
+        memory.close()
+
+
+def get_building_arrays(building_structure=None, floors=None, story_forces=None, sections=None):
+    """
+    Flat arrays of a building
+
+    Parameters:
+    - building_structure (dict): BUILDING_STRUCTURE, {"nodes": [x, y, z, ...], "beams": [[i, j], ...], "columns": ...}
+    - floors (list): BUILDING_FLOOR_ELV_AREA, [{"elevation": z, "area": area}, ...]
+    - story_forces (dict): story forces by elevation
+    - sections (dict): core sections by elevation, [length, thickness, reinforcement_ratio]
+
+    Returns:
+    - dict: nodes (n, 3), beams (m, 2), columns (k, 2), story_elevations, story_areas, force_elevations,
+        story_forces, section_elevations and sections (s, 3), only for the given inputs
+    """
+    arrays = {}
+    if building_structure is not None:
+        arrays['nodes'] = np.asarray(building_structure['nodes'], dtype=float).reshape(-1, 3)
+        for key in ('beams', 'columns'):
+            if key in building_structure:
+                arrays[key] = np.asarray(building_structure[key], dtype=np.int64).reshape(-1, 2)
+    if floors is not None:
+        arrays['story_elevations'] = np.array([floor['elevation'] for floor in floors], dtype=float)
+        arrays['story_areas'] = np.array([floor['area'] for floor in floors], dtype=float)
+    if story_forces is not None:
+        arrays['force_elevations'] = np.array(list(story_forces.keys()), dtype=float)
+        arrays['story_forces'] = np.array(list(story_forces.values()), dtype=float)
+    if sections is not None:
+        arrays['section_elevations'] = np.array(list(sections.keys()), dtype=float)
+        arrays['sections'] = np.array(list(sections.values()), dtype=float).reshape(-1, 3)
+    return arrays
+
+
+def get_story_force_dictionary(arrays):
+    """
+    Story force dictionary (elevation: force) of published arrays, the input of structural.evol_algo and
+    structural.mdof_simple_model
+    """
+    return {get_number(z): float(force) for (z, force) in zip(arrays['force_elevations'], arrays['story_forces'])}
+
+
+def get_section_dictionary(arrays):
+    """
+    Core section dictionary (elevation: [length, thickness, reinforcement_ratio]) of published arrays
+    """
+    return {get_number(z): [get_number(value) for value in section] for (z, section) in zip(arrays['section_elevations'], arrays['sections'])}
+
+
+def get_number(value):
+    # elevations and dimensions are ints in the dictionaries of the structural code, keep them that way
+    value = float(value)
+    return int(value) if value.is_integer() else value
@@ -0,0 +1,42 @@
+import numpy as np
+
+from optimization.pareto import get_epsilon_pareto_mask, get_pareto_mask
+
+
+def get_pareto_mask_brute_force(values):
+    dominated = [np.any(np.all(values <= row, axis=1) & np.any(values < row, axis=1)) for row in values]
+    return ~np.array(dominated)
+
+
+def test_pareto_mask_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for k in (2, 3, 4):
+        # integer objectives have ties and duplicates
+        values = rng.integers(0, 6, (500, k)).astype(float)
+        np.testing.assert_array_equal(get_pareto_mask(values), get_pareto_mask_brute_force(values))
+
+
+def test_pareto_mask_of_a_front():
+    rng = np.random.default_rng(1)
+    x = rng.random((2000, 2))
+    values = np.c_[x, 3 - x.sum(axis=1)]
+    assert get_pareto_mask(values).all()
+
+
+def test_epsilon_front_keeps_extent():
+    # a convex front with extent in both objectives
+    x = np.sort(np.random.default_rng(2).random(8))
+    values = np.c_[x, 1 / (x + 0.01)]
+    for epsilon in (0.05, 0.1, 0.2, 0.3):
+        mask = get_epsilon_pareto_mask(values, epsilon)
+        assert mask.sum() > 1
+        assert mask[np.argmin(values[:, 0])] and mask[np.argmin(values[:, 1])]
+        # every front point lies within a box of a kept point
+        size = epsilon * np.ptp(values, axis=0)
+        kept = values[mask]
+        assert all(np.any(np.all(kept <= row + size, axis=1)) for row in values)
+
+
+def test_epsilon_zero_is_the_full_front():
+    values = np.array([[0, 3], [1, 1], [3, 0], [2, 2]], dtype=float)
+    np.testing.assert_array_equal(get_epsilon_pareto_mask(values, 0), [True, True, True, False])
@@ -0,0 +1,22 @@
+from optimization.result_store import DESIGN_PARAMETER_IDS, get_context
+
+RATES = {'carbon_per_floor_area': 1.0, 'cost_per_floor_area': 2.0, 'carbon_per_beam_length': 3.0, 'cost_per_beam_length': 4.0}
+ENGINE = {'engine': 'shapediver', 'ticket': 'ticket'}
+
+
+def get_parameters(base_radius, peak_radius, no_floors, floor_to_floor, **other):
+    parameters = {
+        DESIGN_PARAMETER_IDS['base_radius']: base_radius,
+        DESIGN_PARAMETER_IDS['peak_radius']: peak_radius,
+        DESIGN_PARAMETER_IDS['no_floors']: no_floors,
+        DESIGN_PARAMETER_IDS['floor_to_floor']: floor_to_floor,
+    }
+    parameters.update(other)
+    return parameters
+
+
+def test_context_ignores_design_variables():
+    context = get_context(ENGINE, get_parameters(83, 40, 30, 12, other='a'), RATES)
+    assert get_context(ENGINE, get_parameters(120, 55, 45, 14, other='a'), RATES) == context
+    assert get_context(ENGINE, get_parameters(83, 40, 30, 12, other='b'), RATES) != context
+    assert get_context(ENGINE, get_parameters(83, 40, 30, 12, other='a'), {**RATES, 'cost_per_beam_length': 5.0}) != context
@@ -0,0 +1,21 @@
+import numpy as np
+
+from optimization.sampling import DesignSpace, get_sampler
+
+
+def test_surrogate_with_a_fixed_design_variable():
+    # floor to floor 12..12 has a single value
+    space = DesignSpace({
+        'base_radius': np.arange(10, 31, 2.0),
+        'peak_radius': np.arange(5, 21, 1.0),
+        'no_floors': np.arange(10, 41, 5.0),
+        'floor_to_floor': np.array([12.0]),
+    })
+    sampler = get_sampler('Surrogate guided', space, budget=60)
+    asked = []
+    while points := sampler.ask(8):
+        results = [(p['base_radius'] * p['no_floors'], p['peak_radius'] ** 2 + p['floor_to_floor']) for p in points]
+        sampler.tell(points, results)
+        asked += [tuple(p.values()) for p in points]
+    assert len(asked) == 60
+    assert len(set(asked)) == 60
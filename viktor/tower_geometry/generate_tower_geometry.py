@@ -0,0 +1,413 @@
+"""
+generate_tower_geometry.py generates the tower geometry locally, without a ShapeDiver computation
+
+The floor plates are equilateral triangles with filleted corners (one flat side facing +x), scaled per floor
+by a radius interpolated linearly from the base radius to the peak radius. Each plate carries a square grid of
+beams (grid lines at half a grid spacing offset from the origin, like the ShapeDiver model), perimeter beams,
+and columns at the grid intersections shared with the plate above. The twist of the ShapeDiver model is not
+reproduced, it changes neither floor areas nor beam lengths much; use validate_tower_geometry to check the
+deviation from ShapeDiver exports.
+
+Inputs:
+base radius
+peak radius
+number of floors
+floor to floor height
+grid spacing
+
+Outputs:
+BUILDING_STRUCTURE ({"nodes": flat list of x, y, z, "beams": [[i, j], ...], "columns": [[i, j], ...]})
+BUILDING_FLOOR_ELV_AREA ([{"elevation": z, "area": area}, ...])
+BUILDING_FLOOR_EDGE ([{"name": "{z}", "points": [{"x": x, "y": y, "z": z}, ...]}, ...])
+summary of floor areas and beam lengths for a whole design, vectorized over floors (get_tower_summary)
+"""
+import argparse
+import json
+from functools import lru_cache
+
+import numpy as np
+
+FILLET_RATIO = 0.13 # fillet radius / circumradius of the unfilleted triangle, calibrated on BUILDING_FLOOR_EDGE.json
+ARC_SEGMENTS = 8 # segments per filleted corner, even so that the corner apex is a vertex
+DEFAULT_GRID_SPACING = 40
+ROUND_DECIMALS = 6 # points closer than this are merged into one node
+GEOMETRY_VERSION = 1 # increase when a change alters generated geometry, stored optimization results are keyed by it
+
+
+@lru_cache(maxsize=None)
+def get_unit_outline(fillet_ratio=FILLET_RATIO, arc_segments=ARC_SEGMENTS):
+    """
+    Get the outline of a floor plate with a radius of 1
+
+    The radius is the distance from the center to the corner apexes.
+
+    Parameters:
+    - fillet_ratio (float): Fillet radius relative to the circumradius of the unfilleted triangle
+    - arc_segments (int): Number of straight segments approximating each filleted corner
+
+    Returns:
+    - numpy.ndarray: (n, 2) counterclockwise outline vertices
+    """
+    triangle_radius = 1 / (1 - fillet_ratio)
+    fillet_radius = fillet_ratio * triangle_radius
+    arcs = []
+    for apex in np.radians([-60, 60, 180]):
+        center = (triangle_radius - 2 * fillet_radius) * np.array([np.cos(apex), np.sin(apex)])
+        angles = np.linspace(apex - np.pi / 3, apex + np.pi / 3, arc_segments + 1)
+        arcs.append(center + fillet_radius * np.column_stack([np.cos(angles), np.sin(angles)]))
+    outline = np.concatenate(arcs)
+    outline.setflags(write=False)
+    return outline
+
+
+@lru_cache(maxsize=None)
+def get_unit_chains(fillet_ratio=FILLET_RATIO, arc_segments=ARC_SEGMENTS):
+    """
+    Get the boundary chains of the unit outline, used to intersect grid lines with a floor plate
+
+    The outline is symmetric about the x axis, so the chains only cover y >= 0.
+
+    Returns:
+    - tuple: (x, upper y) sorted by x, (y, right x) and (y, left x) sorted by y
+    """
+    outline = get_unit_outline(fillet_ratio, arc_segments)
+    upper = outline[outline[:, 1] >= -1e-12]
+    upper = upper[np.argsort(upper[:, 0])]
+    top = upper[np.argmax(upper[:, 1])]
+    right = upper[upper[:, 0] >= top[0]]
+    right = right[np.argsort(right[:, 1])]
+    left = upper[upper[:, 0] <= top[0]]
+    left = left[np.argsort(left[:, 1])]
+    return (upper[:, 0], np.maximum(upper[:, 1], 0)), (right[:, 1], right[:, 0]), (left[:, 1], left[:, 0])
+
+
+def get_outline_area_and_perimeter(outline):
+    """
+    Get the area (shoelace formula) and the perimeter of a closed outline
+
+    Parameters:
+    - outline (numpy.ndarray): (n, 2) outline vertices
+
+    Returns:
+    - tuple: area and perimeter
+    """
+    x, y = outline[:, 0], outline[:, 1]
+    area = 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+    perimeter = np.linalg.norm(np.roll(outline, -1, axis=0) - outline, axis=1).sum()
+    return area, perimeter
+
+
+def get_floor_radii(base_radius, peak_radius, no_floors):
+    """
+    Get the radius of every floor plate, interpolated linearly from the ground floor to the top floor
+
+    Returns:
+    - numpy.ndarray: (no_floors,) radii
+    """
+    return np.linspace(base_radius, peak_radius, int(no_floors))
+
+
+def get_floor_elevations(no_floors, floor_to_floor):
+    """
+    Get the elevation of every floor plate, the ground floor is at 0
+
+    Returns:
+    - numpy.ndarray: (no_floors,) elevations
+    """
+    return np.arange(int(no_floors)) * float(floor_to_floor)
+
+
+def get_grid_lines(max_radius, grid_spacing):
+    """
+    Get the coordinates of the grid lines covering a floor plate, at half a grid spacing offset from the origin
+
+    Returns:
+    - numpy.ndarray: Coordinates of the grid lines, used for both the x and the y direction
+    """
+    count = int(np.ceil(max_radius / grid_spacing)) + 1
+    return (np.arange(-count, count) + 0.5) * grid_spacing
+
+
+def get_grid_chords(radii, grid):
+    """
+    Intersect the grid lines with the floor plates
+
+    Parameters:
+    - radii (numpy.ndarray): (f,) radii of the floor plates
+    - grid (numpy.ndarray): (g,) grid line coordinates
+
+    Returns:
+    - tuple: (f, g) arrays y_high (vertical lines x = grid, span -y_high..y_high), and x_left, x_right (horizontal
+             lines y = grid), NaN where a line misses a plate
+    """
+    (chain_x, chain_y), (right_y, right_x), (left_y, left_x) = get_unit_chains()
+    radii = np.asarray(radii, dtype=float)[:, None]
+
+    u = grid[None, :] / radii
+    y_high = np.where((u > chain_x[0]) & (u < chain_x[-1]), radii * np.interp(u, chain_x, chain_y), np.nan)
+
+    v = np.abs(grid[None, :]) / radii
+    inside = v < right_y[-1]
+    x_left = np.where(inside, radii * np.interp(v, left_y, left_x), np.nan)
+    x_right = np.where(inside, radii * np.interp(v, right_y, right_x), np.nan)
+    return y_high, x_left, x_right
+
+
+def get_interior_mask(radii, grid):
+    """
+    Get which grid intersections lie strictly inside each floor plate
+
+    Returns:
+    - numpy.ndarray: (f, g, g) boolean mask indexed by floor, x grid line and y grid line
+    """
+    y_high, _, _ = get_grid_chords(radii, grid)
+    with np.errstate(invalid='ignore'):
+        return np.abs(grid)[None, None, :] < y_high[:, :, None] - 10 ** -ROUND_DECIMALS
+
+
+def get_tower_summary(base_radius, peak_radius, no_floors, floor_to_floor, grid_spacing=DEFAULT_GRID_SPACING):
+    """
+    Get the floor areas and beam lengths of a design without building its node and beam lists
+
+    All floors are computed at once, which makes this fast enough for sweeps over thousands of designs.
+    The totals equal those of generate_tower_geometry for the same inputs.
+
+    Parameters:
+    - base_radius (float): Radius of the ground floor plate
+    - peak_radius (float): Radius of the top floor plate
+    - no_floors (int): Number of floor plates
+    - floor_to_floor (float): Floor to floor height
+    - grid_spacing (float): Spacing of the beam grid
+
+    Returns:
+    - dict: elevations, areas and beam_lengths per floor, total_floor_area, total_beam_length and total_column_length
+    """
+    radii = get_floor_radii(base_radius, peak_radius, no_floors)
+    elevations = get_floor_elevations(no_floors, floor_to_floor)
+    grid = get_grid_lines(max(base_radius, peak_radius), grid_spacing)
+    unit_area, unit_perimeter = get_outline_area_and_perimeter(get_unit_outline())
+
+    y_high, x_left, x_right = get_grid_chords(radii, grid)
+    grid_lengths = np.nansum(2 * y_high, axis=1) + np.nansum(x_right - x_left, axis=1)
+    areas = unit_area * radii ** 2
+    beam_lengths = grid_lengths + unit_perimeter * radii
+
+    interior = get_interior_mask(radii, grid)
+    columns = np.count_nonzero(interior[1:] & interior[:-1])
+    return {
+        'elevations': elevations,
+        'areas': areas,
+        'beam_lengths': beam_lengths,
+        'total_floor_area': float(areas.sum()),
+        'total_beam_length': float(beam_lengths.sum()),
+        'total_column_length': float(columns * floor_to_floor),
+    }
+
+
+def generate_tower_geometry(base_radius, peak_radius, no_floors, floor_to_floor, grid_spacing=DEFAULT_GRID_SPACING):
+    """
+    Generate the BUILDING_STRUCTURE and BUILDING_FLOOR_ELV_AREA data of a design
+
+    Parameters:
+    - base_radius (float): Radius of the ground floor plate
+    - peak_radius (float): Radius of the top floor plate
+    - no_floors (int): Number of floor plates
+    - floor_to_floor (float): Floor to floor height
+    - grid_spacing (float): Spacing of the beam grid
+
+    Returns:
+    - tuple: building_structure dict ("nodes", "beams", "columns") and building_floor_elv_area list
+    """
+    floors = list(iter_floor_geometry(base_radius, peak_radius, no_floors, floor_to_floor, grid_spacing))
+
+    nodes = []
+    beams = []
+    columns = []
+    floor_elv_area = []
+    offset = 0
+    previous = None
+    for (elevation, area, points, floor_beams, interior_ids, perimeter_count) in floors:
+        nodes.append(np.column_stack([points, np.full(len(points), elevation)]))
+        beams.append(floor_beams + offset)
+        interior_ids = np.where(interior_ids >= 0, interior_ids + offset, -1)
+        if previous is not None:
+            shared = (previous >= 0) & (interior_ids >= 0)
+            columns.append(np.column_stack([previous[shared], interior_ids[shared]]))
+        previous = interior_ids
+        floor_elv_area.append({'elevation': float(elevation), 'area': float(area)})
+        offset += len(points)
+
+    building_structure = {
+        'nodes': np.concatenate(nodes).ravel().tolist() if nodes else [],
+        'beams': np.concatenate(beams).tolist() if beams else [],
+        'columns': np.concatenate(columns).tolist() if columns else [],
+    }
+    return building_structure, floor_elv_area
+
+
+def generate_floor_edges(base_radius, peak_radius, no_floors, floor_to_floor, grid_spacing=DEFAULT_GRID_SPACING):
+    """
+    Generate the BUILDING_FLOOR_EDGE data of a design: the closed perimeter of every floor plate
+
+    Returns:
+    - list: [{"name": "{elevation}", "points": [{"x": x, "y": y, "z": z}, ...]}, ...]
+    """
+    floor_edges = []
+    for (elevation, area, points, floor_beams, interior_ids, perimeter_count) in \
+            iter_floor_geometry(base_radius, peak_radius, no_floors, floor_to_floor, grid_spacing):
+        perimeter = points[:perimeter_count]
+        perimeter = np.concatenate([perimeter, perimeter[:1]])
+        floor_edges.append({
+            'name': '{' + f'{elevation:g}' + '}',
+            'points': [{'x': float(x), 'y': float(y), 'z': float(elevation)} for (x, y) in perimeter],
+        })
+    return floor_edges
+
+
+def iter_floor_geometry(base_radius, peak_radius, no_floors, floor_to_floor, grid_spacing=DEFAULT_GRID_SPACING):
+    """
+    Generate the nodes and beams of each floor plate
+
+    Yields:
+    - tuple: elevation, area, (n, 2) node coordinates (perimeter nodes first, counterclockwise), (m, 2) beams as
+             node indices, (g, g) index of the node at each grid intersection (-1 outside the plate) and the number
+             of perimeter nodes
+    """
+    radii = get_floor_radii(base_radius, peak_radius, no_floors)
+    elevations = get_floor_elevations(no_floors, floor_to_floor)
+    grid = get_grid_lines(max(base_radius, peak_radius), grid_spacing)
+    unit_outline = get_unit_outline()
+    unit_area, _ = get_outline_area_and_perimeter(unit_outline)
+    y_high, x_left, x_right = get_grid_chords(radii, grid)
+    interior = get_interior_mask(radii, grid)
+
+    for (floor, radius) in enumerate(radii):
+        vertical = np.flatnonzero(~np.isnan(y_high[floor]))
+        horizontal = np.flatnonzero(~np.isnan(x_left[floor]))
+
+        # perimeter: outline vertices and the points where grid lines cross the outline, ordered by angle
+        candidates = np.concatenate([
+            radius * unit_outline,
+            np.column_stack([grid[vertical], -y_high[floor, vertical]]),
+            np.column_stack([grid[vertical], y_high[floor, vertical]]),
+            np.column_stack([x_left[floor, horizontal], grid[horizontal]]),
+            np.column_stack([x_right[floor, horizontal], grid[horizontal]]),
+        ])
+        unique, inverse = np.unique(np.round(candidates, ROUND_DECIMALS), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(np.arctan2(unique[:, 1], unique[:, 0]))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        perimeter = unique[order]
+        ends = np.split(rank[inverse[len(unit_outline):]], np.cumsum([len(vertical), len(vertical), len(horizontal)]))
+
+        # interior grid intersections, numbered after the perimeter nodes
+        interior_ids = np.full(interior[floor].shape, -1)
+        ix, iy = np.nonzero(interior[floor])
+        interior_ids[ix, iy] = len(perimeter) + np.arange(len(ix))
+        points = np.concatenate([perimeter, np.column_stack([grid[ix], grid[iy]])])
+
+        floor_beams = [np.column_stack([np.arange(len(perimeter)), np.roll(np.arange(len(perimeter)), -1)])]
+        for (k, line) in enumerate(vertical):
+            ids = interior_ids[line][interior_ids[line] >= 0]
+            floor_beams.append(get_line_beams(ends[0][k], ids, ends[1][k]))
+        for (k, line) in enumerate(horizontal):
+            ids = interior_ids[:, line][interior_ids[:, line] >= 0]
+            floor_beams.append(get_line_beams(ends[2][k], ids, ends[3][k]))
+
+        yield (elevations[floor], unit_area * radius ** 2, points, np.concatenate(floor_beams), interior_ids,
+               len(perimeter))
+
+
+def get_line_beams(start, interior_ids, end):
+    """
+    Get the beams along one grid line, from a perimeter node through the interior nodes to a perimeter node
+
+    Returns:
+    - numpy.ndarray: (m, 2) beams as node indices
+    """
+    ids = np.concatenate([[start], interior_ids, [end]])
+    return np.column_stack([ids[:-1], ids[1:]])
+
+
+def validate_tower_geometry(generated, exported, rtol=0.05):
+    """
+    Compare generated geometry with ShapeDiver exports of the same design
+
+    Parameters:
+    - generated (tuple): building_structure and building_floor_elv_area from generate_tower_geometry
+    - exported (tuple): BUILDING_STRUCTURE and BUILDING_FLOOR_ELV_AREA exported by ShapeDiver
+    - rtol (float): Accepted relative deviation of the floor areas and the total beam length
+
+    Returns:
+    - dict: Per metric the generated value, the exported value and the relative error, and "valid"
+    """
+    metrics = {}
+    (generated_structure, generated_floors), (exported_structure, exported_floors) = generated, exported
+
+    generated_areas = np.array([floor['area'] for floor in generated_floors], dtype=float)
+    exported_areas = np.array([floor['area'] for floor in exported_floors], dtype=float)
+    metrics['floor_count'] = (len(generated_areas), len(exported_areas),
+                              abs(len(generated_areas) - len(exported_areas)) / max(len(exported_areas), 1))
+    metrics['total_floor_area'] = get_metric(generated_areas.sum(), exported_areas.sum())
+    if len(generated_areas) == len(exported_areas) and len(exported_areas) > 0:
+        errors = np.abs(generated_areas - exported_areas) / np.maximum(np.abs(exported_areas), 1e-12)
+        metrics['max_floor_area'] = (float(generated_areas[errors.argmax()]), float(exported_areas[errors.argmax()]),
+                                     float(errors.max()))
+    metrics['total_beam_length'] = get_metric(get_total_beam_length(generated_structure),
+                                              get_total_beam_length(exported_structure))
+
+    metrics['valid'] = metrics['floor_count'][2] == 0 and all(
+        error <= rtol for (key, (_, _, error)) in metrics.items() if key != 'floor_count')
+    return metrics
+
+
+def get_metric(generated_value, exported_value):
+    generated_value, exported_value = float(generated_value), float(exported_value)
+    return generated_value, exported_value, abs(generated_value - exported_value) / max(abs(exported_value), 1e-12)
+
+
+def get_total_beam_length(building_structure):
+    """
+    Get the total length of the beams of a BUILDING_STRUCTURE
+
+    Returns:
+    - float: Sum of the beam lengths
+    """
+    return float(get_member_lengths(building_structure['nodes'], building_structure['beams']).sum())
+
+
+def get_member_lengths(nodes, members):
+    """
+    Lengths of members in one gather and norm
+
+    Parameters:
+    - nodes (list or numpy.ndarray): flat node coordinates [x, y, z, ...] or an (n, 3) array
+    - members (list or numpy.ndarray): [[i, j], ...] node indices or an (m, 2) array
+
+    Returns:
+    - numpy.ndarray: (m,) member lengths
+    """
+    nodes = np.asarray(nodes, dtype=float).reshape(-1, 3)
+    members = np.asarray(members, dtype=np.int64).reshape(-1, 2)
+    return np.linalg.norm(nodes[members[:, 1]] - nodes[members[:, 0]], axis=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare locally generated tower geometry with ShapeDiver exports')
+    parser.add_argument('base_radius', type=float)
+    parser.add_argument('peak_radius', type=float)
+    parser.add_argument('no_floors', type=int)
+    parser.add_argument('floor_to_floor', type=float)
+    parser.add_argument('--grid-spacing', type=float, default=DEFAULT_GRID_SPACING)
+    parser.add_argument('--structure', required=True, help='BUILDING_STRUCTURE export (json)')
+    parser.add_argument('--floor-elv-area', required=True, help='BUILDING_FLOOR_ELV_AREA export (json)')
+    parser.add_argument('--rtol', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with open(args.structure) as structure_file, open(args.floor_elv_area) as floor_file:
+        exported = (json.load(structure_file), json.load(floor_file))
+    generated = generate_tower_geometry(args.base_radius, args.peak_radius, args.no_floors, args.floor_to_floor,
+                                        args.grid_spacing)
+    for (key, value) in validate_tower_geometry(generated, exported, args.rtol).items():
+        print(key, value)
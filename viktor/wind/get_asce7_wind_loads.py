@@ -12,31 +12,136 @@ base shear x
 base shear y
 story forces x
 story forces y
+directional story forces and base shear envelope (get_directional_wind_forces)
 """
-import requests
-from pyproj import Transformer
+import codecs
 import json
+import os
 
-WGS84 = "EPSG:4326"  # World Geodetic System 1984 (latitude, longitude)
-WEB_MERCATOR = "EPSG:3857"  # Pseudo Web Mercator (meters)
+import numpy as np
+
+from wind.wind_speed_cache import get_cached_wind_speeds, DEFAULT_EDITION
+
+# Terrain exposure constants alpha and zg (ft), ASCE 7-16 Table 26.11-1
+EXPOSURE_CONSTANTS = {
+    "B": (7.0, 1200),
+    "C": (9.5, 900),
+    "D": (11.5, 700),
+}
+DEFAULT_EXPOSURE = "B"
+KZ_TABLE_STEP = 0.5 # ft, resolution of the precomputed Kz curves
+
+_kz_tables = {}
 
 
 def get_building_data(json_filename):
     """
     Get the building data from the given json file
 
+    The file is parsed lazily, one floor at a time, see iter_floor_points.
+
     Parameters:
-    - json_filename (str): The filename of the json file
+    - json_filename (str or file): The filename of the json file, or an open file or VIKTOR File
 
     Returns:
-    - list: List containing dictionaries for each floor in the building
+    - iterator: Iterator over the floor perimeters of the building as (n, 3) arrays of x, y and z coordinates
+    """
+    return iter_floor_points(json_filename)
+
+
+def iter_floor_points(source, chunk_size=65536):
     """
-    with open(json_filename, "r") as json_file:
-        floors = json.load(json_file)
-    return floors
+    Stream the floors of a BUILDING_FLOOR_EDGE export without loading the whole file
+
+    The export is a list of floors, each floor holding a list of {x, y, z} points (optionally under a "points" key).
+    Only the floor that is currently being decoded is held in memory as Python objects.
 
+    Parameters:
+    - source (str or file): The filename of the json file, or an open file or VIKTOR File
+    - chunk_size (int): Number of characters read from the file at a time
 
-def get_wind_forces(latitude, longitude, risk_category, floors):
+    Yields:
+    - np.ndarray: Floor perimeter of shape (n, 3) with x, y and z coordinates
+    """
+    if isinstance(source, (str, os.PathLike)):
+        json_file = open(source, "r")
+    elif hasattr(source, "read"):
+        json_file = source
+    else:
+        json_file = source.open()
+
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    started = False
+    end_of_file = False
+
+    def read(size):
+        chunk = json_file.read(size)
+        if isinstance(chunk, bytes):
+            chunk = utf8_decoder.decode(chunk, final=not chunk)
+        return chunk
+
+    try:
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position == len(buffer):
+                if end_of_file:
+                    raise ValueError("Unexpected end of floor edge data")
+                buffer, position = read(chunk_size), 0
+                end_of_file = len(buffer) == 0
+                continue
+
+            char = buffer[position]
+            if not started:
+                if char != "[":
+                    raise ValueError("Floor edge data should be a list of floors")
+                started = True
+                position += 1
+            elif char == "]":
+                return
+            elif char == ",":
+                position += 1
+            else:
+                try:
+                    floor, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if end_of_file:
+                        raise
+                    # The floor is not complete yet, read at least as much as is buffered to keep parsing linear
+                    chunk = read(max(chunk_size, len(buffer) - position))
+                    end_of_file = len(chunk) == 0
+                    buffer, position = buffer[position:] + chunk, 0
+                    continue
+                position = end
+                if position > chunk_size:
+                    buffer, position = buffer[position:], 0
+                yield get_floor_points(floor)
+    finally:
+        if json_file is not source:
+            json_file.close()
+
+
+def get_floor_points(floor):
+    """
+    Get the perimeter nodes of a floor as an array
+
+    Parameters:
+    - floor (dict, list or np.ndarray): Floor with "points", list of {x, y, z} nodes or array of coordinates
+
+    Returns:
+    - np.ndarray: Floor perimeter of shape (n, 3) with x, y and z coordinates
+    """
+    if isinstance(floor, np.ndarray):
+        return floor
+    if isinstance(floor, dict):
+        floor = floor["points"]
+    return np.array([(node['x'], node['y'], node['z']) for node in floor], dtype=float).reshape(-1, 3)
+
+
+def get_wind_forces(latitude, longitude, risk_category, floors, exposure=DEFAULT_EXPOSURE, Kzt=1, Ke=1):
     """
     Get the base shear data for a building given information about it's location, risk category and geometry
 
@@ -45,6 +150,9 @@ def get_wind_forces(latitude, longitude, risk_category, floors):
     - longitude (float): The lognitude the building is located at
     - risk_category (int): The risk category of the building (1, 2, 3, or 4)
     - floors (list[]): The list of floors in the building
+    - exposure (str): Exposure category (B, C or D)
+    - Kzt (float): Topographic factor
+    - Ke (float): Ground elevation factor, see get_Ke
 
     Returns:
     - tuple: containing the following
@@ -53,31 +161,84 @@ def get_wind_forces(latitude, longitude, risk_category, floors):
         story_forces_x dict[float]: dict of story forces in X direction, k = elevation, v = force
         story_forces_y dict[float]: dict of story forces in Y direction, k = elevation, v = force
     """
-    z_last = 0
-    story_forces_x = {}
-    story_forces_y = {}
-    base_x = 0
-    base_y = 0
+    directions, elevations, story_forces, base_shears = get_directional_wind_forces(
+        latitude, longitude, risk_category, floors, directions=[0, 90], exposure=exposure, Kzt=Kzt, Ke=Ke)
+    story_forces_x = {float(z): float(force) for z, force in zip(elevations, story_forces[:, 0])}
+    story_forces_y = {float(z): float(force) for z, force in zip(elevations, story_forces[:, 1])}
+    return float(base_shears[0]), float(base_shears[1]), story_forces_x, story_forces_y
+
+
+def get_directional_wind_forces(latitude, longitude, risk_category, floors, directions=None, exposure=DEFAULT_EXPOSURE,
+                                Kzt=1, Ke=1):
+    """
+    Get the story forces and base shears of a building for a set of wind directions in one pass
+
+    Parameters:
+    - latitude (float): The latitude the building is located at
+    - longitude (float): The lognitude the building is located at
+    - risk_category (int): The risk category of the building (1, 2, 3, or 4)
+    - floors (iterable): The floors in the building as dicts or (n, 3) arrays, consumed one floor at a time
+    - directions (list[float]): Wind directions in degrees from the X axis, defaults to every 5 degrees
+    - exposure (str): Exposure category (B, C or D)
+    - Kzt (float): Topographic factor
+    - Ke (float): Ground elevation factor, see get_Ke
+
+    Returns:
+    - tuple: containing the following
+        directions np.ndarray: Wind directions in degrees, shape (d,)
+        elevations np.ndarray: Floor elevations, shape (n,)
+        story_forces np.ndarray: Story forces per floor and direction, shape (n, d)
+        base_shears np.ndarray: Base shear per direction, shape (d,)
+    """
+    if directions is None:
+        directions = np.arange(0, 360, 5)
+    directions = np.asarray(directions, dtype=float)
     V = get_wind_speed_for_risk(latitude, longitude, risk_category)
-    Kzt = 1 #Kzt can be adjusted for local topography, future implementation
-    Kd = 0.85
-    Ke = 1 #Don't take advantage of elevation factor, future implementation
-    for floor in floors[1:]:
-        z = floor["points"][0]['z'] #Z coordinate of first node in floor area
-        Kz = get_Kz(z)
-        qz = 0.00256*Kz*Kzt*Kd*Ke*V*V #Wind pressure
-        width_x, width_y = get_widths(floor["points"])
-        area_x = width_x * (z-z_last)
-        area_y = width_y * (z-z_last)
-        force_x = qz*area_x/1000
-        force_y = qz*area_y/1000
-        story_forces_x[z] = force_x
-        story_forces_y[z] = force_y
-        base_x += force_x
-        base_y += force_y
-        z_last = z
-    return base_x, base_y, story_forces_x, story_forces_y
-        
+
+    elevations = []
+    widths = []
+    for i, floor in enumerate(floors):
+        if i == 0:
+            continue
+        points = get_floor_points(floor)
+        elevations.append(points[0, 2]) #Z coordinate of first node in floor area
+        widths.append(get_projected_widths(points, directions))
+    elevations = np.array(elevations)
+    widths = np.array(widths).reshape(len(elevations), len(directions))
+    qz = get_qz(elevations, V, exposure, Kzt, Ke) #Wind pressure
+    story_heights = np.diff(elevations, prepend=0)
+    story_forces = (qz*story_heights)[:, np.newaxis]*widths/1000
+    base_shears = story_forces.sum(axis=0)
+    return directions, elevations, story_forces, base_shears
+
+
+def get_base_shear_envelope(directions, base_shears):
+    """
+    Get the governing wind direction and base shear from the directional base shears
+
+    Returns:
+    - tuple: governing direction in degrees and maximum base shear
+    """
+    governing = int(np.argmax(base_shears))
+    return float(directions[governing]), float(base_shears[governing])
+
+
+def get_projected_widths(perimeters, directions):
+    """
+    Get the width of a floor projected onto every wind direction
+
+    Parameters:
+    - perimeters (np.ndarray): Floor perimeter coordinates of shape (nodes, 3), or (floors, nodes, 3) padded with NaN
+    - directions (np.ndarray): Directions in degrees from the X axis, 0 gives the X projection and 90 the Y projection
+
+    Returns:
+    - np.ndarray: Projected widths of shape (directions,), or (floors, directions)
+    """
+    angles = np.radians(directions)
+    axes = np.stack([np.cos(angles), np.sin(angles)])
+    projections = perimeters[..., :2] @ axes
+    return np.nanmax(projections, axis=-2) - np.nanmin(projections, axis=-2)
+
 
 def get_widths(floor):
     """
@@ -91,41 +252,94 @@ def get_widths(floor):
         width_x float: Width of the X projection of the floor
         width_y float: Width of the Y projection of the floor
     """
-    x_min = floor[0]['x']
-    x_max = floor[0]['x']
-    y_min = floor[0]['y']
-    y_max = floor[0]['y']
-    for node in floor:
-        if node['x'] < x_min:
-            x_min = node['x']
-        elif node['x'] > x_max:
-            x_max = node['x']
-        if node['y'] < y_min:
-            y_min = node['x']
-        elif node['y'] > y_max:
-            y_max = node['y']
-    width_x = x_max - x_min
-    width_y = y_max - y_min
-    return width_x, width_y
-
-
-def get_Kz(z):
+    width_x, width_y = get_projected_widths(get_floor_points(floor), [0, 90])
+    return float(width_x), float(width_y)
+
+
+def get_Kz_table(exposure=DEFAULT_EXPOSURE):
+    """
+    Get the precomputed Kz curve of an exposure category, sampled every KZ_TABLE_STEP ft up to zg
+
+    Above zg the curve is constant, np.interp holds the last value.
+
+    Parameters:
+    - exposure (str): Exposure category (B, C or D)
+
+    Returns:
+    - tuple: elevations and Kz factors of the curve
+    """
+    if exposure not in _kz_tables:
+        if exposure not in EXPOSURE_CONSTANTS:
+            raise ValueError("Unknown exposure category: {}".format(exposure))
+        a, zg = EXPOSURE_CONSTANTS[exposure]
+        z = np.arange(0, zg + KZ_TABLE_STEP, KZ_TABLE_STEP)
+        _kz_tables[exposure] = (z, 2.01*(np.maximum(z, 15)/zg)**(2/a))
+    return _kz_tables[exposure]
+
+
+def get_Kz(z, exposure=DEFAULT_EXPOSURE):
     """
     Get the Kz factor for a given floor elevation.
 
     Parameters:
-    - z (float): Elevation of the floor
+    - z (float or np.ndarray): Elevation of the floor, or a vector of elevations
+    - exposure (str): Exposure category (B, C or D)
 
     Returns:
-    - float: The Kz factor
+    - float or np.ndarray: The Kz factor
     """
-    a = 7 #This could be a variable in the future depending on exposure category
-    zg = 1200 #This could be a variable in the future depending on exposure category
-    if z < 15:
-        return 2.01*(15/zg)**(2/a)
-    else:
-        return 2.01*(z/zg)**(2/a)
-    
+    z_table, kz_table = get_Kz_table(exposure)
+    return np.interp(z, z_table, kz_table)
+
+
+def get_Ke(ground_elevation):
+    """
+    Get the ground elevation factor Ke (ASCE 7-16 Table 26.9-1)
+
+    Parameters:
+    - ground_elevation (float): Ground elevation above sea level in ft
+
+    Returns:
+    - float: The Ke factor
+    """
+    return np.exp(-0.0000362*ground_elevation)
+
+
+def get_qz(z, wind_speed, exposure=DEFAULT_EXPOSURE, Kzt=1, Ke=1, Kd=0.85):
+    """
+    Get the velocity pressure at the given elevations
+
+    Parameters:
+    - z (float or np.ndarray): Elevation, or a vector of elevations
+    - wind_speed (float): Design wind speed
+    - exposure (str): Exposure category (B, C or D)
+    - Kzt (float): Topographic factor
+    - Ke (float): Ground elevation factor
+    - Kd (float): Wind directionality factor
+
+    Returns:
+    - float or np.ndarray: Velocity pressure qz
+    """
+    return 0.00256*get_Kz(z, exposure)*Kzt*Kd*Ke*wind_speed*wind_speed
+
+
+def get_qz_table(elevations, wind_speeds, exposures=("B", "C", "D"), Kzt=1, Ke=1, Kd=0.85):
+    """
+    Evaluate the velocity pressure for every combination of exposure, wind speed and elevation in one call
+
+    Parameters:
+    - elevations (list[float]): Elevations
+    - wind_speeds (list[float]): Design wind speeds
+    - exposures (list[str]): Exposure categories
+    - Kzt, Ke, Kd (float): Topographic, ground elevation and wind directionality factor
+
+    Returns:
+    - np.ndarray: Velocity pressures of shape (exposures, wind speeds, elevations)
+    """
+    kz = np.array([get_Kz(np.asarray(elevations, dtype=float), exposure) for exposure in exposures])
+    wind_speeds = np.asarray(wind_speeds, dtype=float)
+    return 0.00256*Kzt*Kd*Ke*kz[:, np.newaxis, :]*(wind_speeds**2)[np.newaxis, :, np.newaxis]
+
 
 def get_wind_speed_for_risk(latitude, longitude, risk_category):
     """
@@ -151,54 +365,23 @@ def get_wind_speed_for_risk(latitude, longitude, risk_category):
     return wind_speed_dict[return_period]
 
 
-def get_wind_speed(latitude, longitude, server_url='https://gis.asce.org'):
+def get_wind_speed(latitude, longitude, server_url='https://gis.asce.org', edition=DEFAULT_EDITION):
     """
     Fetch wind speed for given latitude and longitude from the provided server URL.
+
+    Results are served from a prefetched wind speed grid or the local wind speed cache when available,
+    see wind_speed_cache.py.
     
     Parameters:
     - latitude (float): Latitude of the location.
     - longitude (float): Longitude of the location.
     - server_url (str): URL of the wind speed service.
+    - edition (str): Wind map edition, e.g. wind2016
     
     Returns:
     - dict: Dictionary of wind speed values for different return periods.
     """
-    
-    # Wind return periods (years)
-    return_periods = [10, 25, 50, 100, 300, 700, 1700, 3000]
-    
-    # Initialize transformer for coordinate transformation
-    transformer = Transformer.from_crs(WGS84, WEB_MERCATOR)
-    
-    # Convert latitude and longitude to Web Mercator projection
-    x_coordinate, y_coordinate = transformer.transform(latitude, longitude)
-    
-    params = {
-        "geometry": "{},{}".format(x_coordinate, y_coordinate),
-        "geometryType": "esriGeometryPoint",
-        "returnGeometry": "false",
-        "pixelSize": "1000,1000",
-        "f": "json",
-    }
-
-    wind_speeds = {}
-
-    for period in return_periods:
-        service_name = "ASCE/wind2016_{}".format(period)
-        identify_url = "{}/arcgis/rest/services/{}/ImageServer/identify".format(server_url, service_name)
-
-        response = requests.get(identify_url, params=params)
-
-        if response.status_code == 200:
-            data = response.json()
-            if "value" in data:
-                wind_speeds[period] = data["value"]
-            else:
-                raise ValueError("No wind speed value found in service response for return period: {}".format(period))
-        else:
-            raise ConnectionError("Failed to connect to service with status code: {}".format(response.status_code))
-    
-    return wind_speeds
+    return get_cached_wind_speeds(latitude, longitude, server_url=server_url, edition=edition)
 
 
 def get_story_shears(story_forces):
@@ -0,0 +1,397 @@
+"""
+wind_speed_cache.py keeps ASCE hazard tool wind speed lookups local
+
+ASCE wind speeds only change with the map edition, so identify results are stored on disk and reused.
+
+Lookups go through, in order:
+1. a prefetched wind speed grid (compact .npz file covering a region), if one is loaded and covers the point
+2. a persistent SQLite cache keyed by (edition, return period, snapped Web-Mercator cell)
+3. the gis.asce.org identify service, whose results are written back into the cache
+
+Prefetch a region from the command line (run from the viktor folder):
+    python -m wind.wind_speed_cache prefetch <south> <west> <north> <east> <output.npz>
+
+Environment variables:
+WIND_SPEED_CACHE: path of the SQLite cache file
+WIND_SPEED_GRID: path of a prefetched grid file used for offline lookups
+"""
+import argparse
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import requests
+from pyproj import Transformer
+
+WGS84 = "EPSG:4326"  # World Geodetic System 1984 (latitude, longitude)
+WEB_MERCATOR = "EPSG:3857"  # Pseudo Web Mercator (meters)
+
+DEFAULT_SERVER_URL = "https://gis.asce.org"
+DEFAULT_EDITION = "wind2016"
+RETURN_PERIODS = [10, 25, 50, 100, 300, 700, 1700, 3000]
+CELL_SIZE = 1000  # meters, same as the pixelSize of the identify request
+DEFAULT_MAX_ENTRIES = 200000
+
+_transformer = None
+_default_cache = None
+_default_grid = None
+_default_lock = threading.Lock()
+
+
+def to_web_mercator(latitude, longitude):
+    """
+    Convert a latitude and longitude to Web Mercator coordinates
+
+    Parameters:
+    - latitude (float): Latitude of the location.
+    - longitude (float): Longitude of the location.
+
+    Returns:
+    - tuple: x and y coordinate in meters
+    """
+    global _transformer
+    if _transformer is None:
+        _transformer = Transformer.from_crs(WGS84, WEB_MERCATOR)
+    return _transformer.transform(latitude, longitude)
+
+
+def snap_to_cell(x_coordinate, y_coordinate, cell_size=CELL_SIZE):
+    """
+    Snap a Web Mercator coordinate to the index of the grid cell containing it
+
+    Returns:
+    - tuple: (column, row) index of the cell
+    """
+    return int(math.floor(x_coordinate / cell_size)), int(math.floor(y_coordinate / cell_size))
+
+
+def cell_center(cell, cell_size=CELL_SIZE):
+    """
+    Get the Web Mercator coordinate of the center of a grid cell
+    """
+    return (cell[0] + 0.5) * cell_size, (cell[1] + 0.5) * cell_size
+
+
+def identify_wind_speed(x_coordinate, y_coordinate, return_period, edition=DEFAULT_EDITION,
+                        server_url=DEFAULT_SERVER_URL, session=None):
+    """
+    Request the wind speed of a single return period at a Web Mercator coordinate from the ASCE identify service
+
+    Parameters:
+    - x_coordinate (float): Web Mercator x coordinate
+    - y_coordinate (float): Web Mercator y coordinate
+    - return_period (int): Return period in years
+    - edition (str): Wind map edition, e.g. wind2016
+    - server_url (str): URL of the wind speed service.
+    - session (requests.Session): Optional session to reuse connections
+
+    Returns:
+    - float: Wind speed
+    """
+    params = {
+        "geometry": "{},{}".format(x_coordinate, y_coordinate),
+        "geometryType": "esriGeometryPoint",
+        "returnGeometry": "false",
+        "pixelSize": "{},{}".format(CELL_SIZE, CELL_SIZE),
+        "f": "json",
+    }
+    service_name = "ASCE/{}_{}".format(edition, return_period)
+    identify_url = "{}/arcgis/rest/services/{}/ImageServer/identify".format(server_url, service_name)
+
+    response = (session or requests).get(identify_url, params=params)
+
+    if response.status_code == 200:
+        data = response.json()
+        if "value" in data:
+            return float(data["value"])
+        else:
+            raise ValueError("No wind speed value found in service response for return period: {}".format(return_period))
+    else:
+        raise ConnectionError("Failed to connect to service with status code: {}".format(response.status_code))
+
+
+class WindSpeedCache:
+    """
+    Disk backed cache of wind speeds keyed by (edition, return period, snapped Web-Mercator cell)
+
+    The least recently used entries are evicted once the cache holds more than max_entries values.
+    """
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES, cell_size=CELL_SIZE):
+        if path is None:
+            path = os.getenv("WIND_SPEED_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "aectech2023", "wind_speeds.sqlite")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.cell_size = cell_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS wind_speed ("
+            "edition TEXT, return_period INTEGER, cell_x INTEGER, cell_y INTEGER, cell_size INTEGER, "
+            "value REAL, last_used REAL, "
+            "PRIMARY KEY (edition, return_period, cell_x, cell_y, cell_size))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS wind_speed_last_used ON wind_speed (last_used)")
+        self._connection.commit()
+
+    def get(self, edition, return_period, cell):
+        """
+        Get a cached wind speed, or None if the cell has not been looked up yet
+        """
+        key = (edition, return_period, cell[0], cell[1], self.cell_size)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM wind_speed WHERE edition=? AND return_period=? AND cell_x=? AND cell_y=? AND cell_size=?",
+                key).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE wind_speed SET last_used=? WHERE edition=? AND return_period=? AND cell_x=? AND cell_y=? AND cell_size=?",
+                (time.time(),) + key)
+            self._connection.commit()
+        return row[0]
+
+    def set(self, edition, return_period, cell, value):
+        """
+        Store a wind speed and evict the least recently used entries if the cache is full
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO wind_speed VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (edition, return_period, cell[0], cell[1], self.cell_size, value, time.time()))
+            self._evict()
+            self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM wind_speed").fetchone()[0]
+
+    def _evict(self):
+        count = self._connection.execute("SELECT COUNT(*) FROM wind_speed").fetchone()[0]
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM wind_speed WHERE rowid IN (SELECT rowid FROM wind_speed ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,))
+
+    def close(self):
+        self._connection.close()
+
+
+class WindSpeedGrid:
+    """
+    Wind speeds for a region sampled at the centers of a regular Web Mercator grid
+
+    values has shape (number of return periods, rows, columns), cells that could not be fetched are NaN.
+    """
+
+    def __init__(self, edition, return_periods, origin_cell, cell_size, values):
+        self.edition = edition
+        self.return_periods = [int(period) for period in return_periods]
+        self.origin_cell = (int(origin_cell[0]), int(origin_cell[1]))
+        self.cell_size = cell_size
+        self.values = np.asarray(values, dtype=np.float32)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(str(data["edition"]), data["return_periods"], data["origin_cell"], float(data["cell_size"]), data["values"])
+
+    def save(self, filename):
+        with open(filename, "wb") as grid_file:
+            np.savez_compressed(grid_file, edition=np.array(self.edition), return_periods=np.array(self.return_periods),
+                                origin_cell=np.array(self.origin_cell), cell_size=np.array(self.cell_size),
+                                values=self.values)
+
+    def _fractional_index(self, latitude, longitude):
+        x_coordinate, y_coordinate = to_web_mercator(latitude, longitude)
+        column = x_coordinate / self.cell_size - 0.5 - self.origin_cell[0]
+        row = y_coordinate / self.cell_size - 0.5 - self.origin_cell[1]
+        return column, row
+
+    def contains(self, latitude, longitude):
+        column, row = self._fractional_index(latitude, longitude)
+        n_rows, n_columns = self.values.shape[1:]
+        return -0.5 <= column <= n_columns - 0.5 and -0.5 <= row <= n_rows - 0.5
+
+    def lookup(self, latitude, longitude, method="bilinear"):
+        """
+        Get the wind speeds at a location from the grid
+
+        Parameters:
+        - latitude (float): Latitude of the location.
+        - longitude (float): Longitude of the location.
+        - method (str): 'nearest' for the value of the nearest cell or 'bilinear' to interpolate between cell centers
+
+        Returns:
+        - dict: Dictionary of wind speed values for different return periods.
+        """
+        if not self.contains(latitude, longitude):
+            raise ValueError("Location ({}, {}) is outside of the wind speed grid".format(latitude, longitude))
+        column, row = self._fractional_index(latitude, longitude)
+        n_rows, n_columns = self.values.shape[1:]
+
+        nearest = self.values[:, min(max(int(round(row)), 0), n_rows - 1), min(max(int(round(column)), 0), n_columns - 1)]
+        if method == "nearest":
+            speeds = nearest
+        elif method == "bilinear":
+            column = min(max(column, 0), n_columns - 1)
+            row = min(max(row, 0), n_rows - 1)
+            c0, r0 = min(int(column), max(n_columns - 2, 0)), min(int(row), max(n_rows - 2, 0))
+            c1, r1 = min(c0 + 1, n_columns - 1), min(r0 + 1, n_rows - 1)
+            tc, tr = column - c0, row - r0
+            speeds = (self.values[:, r0, c0] * (1 - tc) * (1 - tr) + self.values[:, r0, c1] * tc * (1 - tr) +
+                      self.values[:, r1, c0] * (1 - tc) * tr + self.values[:, r1, c1] * tc * tr)
+            # Fall back to the nearest cell next to cells that could not be fetched
+            speeds = np.where(np.isnan(speeds), nearest, speeds)
+        else:
+            raise ValueError("Unknown interpolation method: {}".format(method))
+
+        if np.isnan(speeds).any():
+            raise ValueError("No wind speed stored in the grid at location ({}, {})".format(latitude, longitude))
+        return {period: float(speed) for period, speed in zip(self.return_periods, speeds)}
+
+
+def prefetch_wind_grid(south, west, north, east, filename=None, edition=DEFAULT_EDITION, return_periods=None,
+                       server_url=DEFAULT_SERVER_URL, cache=None, cell_size=CELL_SIZE):
+    """
+    Fetch identify results for every grid cell in a region and store them as a compact grid file
+
+    Already cached cells are not requested again, so an interrupted prefetch can simply be restarted.
+
+    Parameters:
+    - south, west, north, east (float): Bounding box of the region in degrees
+    - filename (str): Optional .npz file to write the grid to
+    - edition (str): Wind map edition
+    - return_periods (list[int]): Return periods to fetch, defaults to all
+    - server_url (str): URL of the wind speed service.
+    - cache (WindSpeedCache): Cache to read from and write to, defaults to the shared cache
+    - cell_size (float): Grid spacing in Web Mercator meters
+
+    Returns:
+    - WindSpeedGrid: The fetched grid
+    """
+    return_periods = return_periods or RETURN_PERIODS
+    if cache is None:
+        cache = get_default_cache()
+    x_min, y_min = to_web_mercator(south, west)
+    x_max, y_max = to_web_mercator(north, east)
+    first_cell = snap_to_cell(x_min, y_min, cell_size)
+    last_cell = snap_to_cell(x_max, y_max, cell_size)
+    n_columns = last_cell[0] - first_cell[0] + 1
+    n_rows = last_cell[1] - first_cell[1] + 1
+
+    values = np.full((len(return_periods), n_rows, n_columns), np.nan, dtype=np.float32)
+    use_cache = cache.cell_size == cell_size
+    with requests.Session() as session:
+        for row in range(n_rows):
+            for column in range(n_columns):
+                cell = (first_cell[0] + column, first_cell[1] + row)
+                x_coordinate, y_coordinate = cell_center(cell, cell_size)
+                for k, period in enumerate(return_periods):
+                    value = cache.get(edition, period, cell) if use_cache else None
+                    if value is None:
+                        try:
+                            value = identify_wind_speed(x_coordinate, y_coordinate, period, edition, server_url, session)
+                        except ValueError:
+                            # No wind speed defined at this cell (e.g. offshore)
+                            continue
+                        if use_cache:
+                            cache.set(edition, period, cell, value)
+                    values[k, row, column] = value
+
+    grid = WindSpeedGrid(edition, return_periods, first_cell, cell_size, values)
+    if filename is not None:
+        grid.save(filename)
+    return grid
+
+
+def get_default_cache():
+    """
+    Get the shared wind speed cache, created on first use
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = WindSpeedCache()
+        return _default_cache
+
+
+def get_default_grid():
+    """
+    Get the prefetched grid configured with the WIND_SPEED_GRID environment variable, or None
+    """
+    global _default_grid
+    filename = os.getenv("WIND_SPEED_GRID")
+    if not filename:
+        return None
+    with _default_lock:
+        if _default_grid is None:
+            _default_grid = WindSpeedGrid.load(filename)
+        return _default_grid
+
+
+def get_cached_wind_speeds(latitude, longitude, server_url=DEFAULT_SERVER_URL, edition=DEFAULT_EDITION,
+                           return_periods=None, cache=None, grid=None, method="bilinear"):
+    """
+    Get wind speeds for a location from a prefetched grid, the disk cache or the identify service
+
+    Parameters:
+    - latitude (float): Latitude of the location.
+    - longitude (float): Longitude of the location.
+    - server_url (str): URL of the wind speed service.
+    - edition (str): Wind map edition
+    - return_periods (list[int]): Return periods to get, defaults to all
+    - cache (WindSpeedCache): Cache to use, defaults to the shared cache
+    - grid (WindSpeedGrid): Prefetched grid to use, defaults to the grid in WIND_SPEED_GRID
+    - method (str): Grid interpolation method, 'nearest' or 'bilinear'
+
+    Returns:
+    - dict: Dictionary of wind speed values for different return periods.
+    """
+    return_periods = return_periods or RETURN_PERIODS
+    grid = grid or get_default_grid()
+    if grid is not None and grid.edition == edition and grid.contains(latitude, longitude) \
+            and all(period in grid.return_periods for period in return_periods):
+        speeds = grid.lookup(latitude, longitude, method)
+        return {period: speeds[period] for period in return_periods}
+
+    if cache is None:
+        cache = get_default_cache()
+    cell = snap_to_cell(*to_web_mercator(latitude, longitude), cache.cell_size)
+    x_coordinate, y_coordinate = cell_center(cell, cache.cell_size)
+    wind_speeds = {}
+    session = None
+    for period in return_periods:
+        value = cache.get(edition, period, cell)
+        if value is None:
+            session = session or requests.Session()
+            value = identify_wind_speed(x_coordinate, y_coordinate, period, edition, server_url, session)
+            cache.set(edition, period, cell, value)
+        wind_speeds[period] = value
+    if session is not None:
+        session.close()
+    return wind_speeds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefetch ASCE wind speeds for a region into a grid file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    prefetch = subparsers.add_parser("prefetch")
+    prefetch.add_argument("south", type=float)
+    prefetch.add_argument("west", type=float)
+    prefetch.add_argument("north", type=float)
+    prefetch.add_argument("east", type=float)
+    prefetch.add_argument("output")
+    prefetch.add_argument("--edition", default=DEFAULT_EDITION)
+    prefetch.add_argument("--server-url", default=DEFAULT_SERVER_URL)
+    prefetch.add_argument("--cell-size", type=float, default=CELL_SIZE)
+    args = parser.parse_args()
+
+    grid = prefetch_wind_grid(args.south, args.west, args.north, args.east, args.output, edition=args.edition,
+                              server_url=args.server_url, cell_size=args.cell_size)
+    print("Stored {} x {} cells in {}".format(grid.values.shape[2], grid.values.shape[1], args.output))